@@ -1,20 +1,92 @@
-from PIL import Image, ImageFont, ImageDraw
-from utils import ASCII_CHARS_TAB, OutputType, accelerate_conversion_ascii, accelerate_conversion_ascii_colour, accelerate_conversion_pixel, createFolder, createVideo
-from typing import Tuple
+from PIL import Image, ImageDraw, ImageColor
+from utils import ASCII_CHARS_TAB, GRID_BACKENDS, RECORD_EXTENTIONS, StillCapture, is_image, OutputType, QuantiseMode, RecordBackend, RenderEngine, accelerate_conversion_ascii, accelerate_conversion_ascii_colour, accelerate_conversion_pixel, accelerate_conversion_ascii_grid, accelerate_conversion_ascii_colour_grid, accelerate_conversion_pixel_grid, accelerate_preprocessing, warm_up_kernels, createFolder, createOutputFolder, createVideo
+from render import DECODED_FRAMES, FRAME_CELL_BYTES, PIXEL_CONTEXT, STRIP_PIXEL_BYTES, DeltaRenderer, StripRenderer, compose_pixels, default_font, get_glyph_atlas
+from recorder import FFmpegRecorder
+from segments import SegmentedRecorder
+from textoutput import grid_recorder
+from parallel import ParallelRecorder
+from profiling import StageProfiler
+from prefetch import FramePrefetcher
+from cache import RenderCache, cache_key, source_digest
+from quantise import Quantiser
+from live import LiveCapture, LiveClock, is_live, live_name
+from typing import Callable, Tuple
 import numpy as np
 import cv2
 
 
 # ASCIIXEL class for images and videos ASCII conversion
 class ASCIIXEL:
-    def __init__(self, path: str ='', ascii_set: int =2, element_size: int =12, display_original: bool =False, resolution: Tuple(int, int) =None, record: bool =False, reverse_colour: bool =False, output_type: OutputType =OutputType.ASCII, colour_lvl: int =8) -> None:
+    def __init__(self, path: str ='', ascii_set: int =2, element_size: int =12, display_original: bool =False, resolution: Tuple[int, int] =None, record: bool =False, reverse_colour: bool =False, output_type: OutputType =OutputType.ASCII, colour_lvl: int =8, engine: RenderEngine =RenderEngine.NUMPY, record_backend: RecordBackend =RecordBackend.PIPE, nb_workers: int =1, incremental: bool =False, full_redraw_ratio: float =0.5, prefetch: int =8, prefetch_mb: int =256, quantise: QuantiseMode =QuantiseMode.UNIFORM, palette: str ='pico8', nb_colours: int =16, start: float =None, end: float =None, segment_frames: int =0, memory_mb: int =0, calibrated_glyphs: bool =False, shape_matching: bool =False, cache: RenderCache =None) -> None:
         self.path = path
         self.output_type = output_type
+        self.engine = engine
         self.reverse_colour = reverse_colour
         self.custom_resolution = resolution
         self.display_original = display_original
         self.ascii_set = ascii_set
         self.record = record
+        self.record_backend = record_backend
+        self.recorder = None
+        self.nb_workers = nb_workers
+        self.profiler = None
+
+        # Incremental rendering only redraws the cells that changed, unless more than full_redraw_ratio of them did
+        self.incremental = incremental
+        self.full_redraw_ratio = full_redraw_ratio
+        self.delta = None
+        self.changed_ratio = 1.0
+
+        # Output arrays drawn into in turn, the GUI displays one while the next frame is drawn into another
+        self.nb_out_buffers = 1
+        self.out_index = 0
+
+        # Frames are only rasterised when something needs the pixels
+        self.rasterise = True
+
+        # Number of frames decoded ahead on a background thread, 0 to decode them when they are needed
+        self.prefetch = prefetch
+        self.prefetch_mb = prefetch_mb
+        self.prefetcher = None
+
+        # Cells and rendered frames of earlier runs, shared between the runs and left out of the settings
+        self.cache = cache
+        self.source_key = None
+        self.rendered = None
+
+        # Last decoded frame, only kept when it is displayed
+        self.frame = None
+
+        # Still images are read as a video of one frame and recorded as an image
+        self.still = False
+
+        # Folder of the recordings, the PNG backend always encodes its frames into outputs
+        self.output_dir = 'outputs'
+
+        # Cameras and streams are read on a background thread that keeps their newest frames, their recordings follow the wall clock
+        self.live = None
+        self.live_clock = None
+
+        # Copy of the last live frame recorded and its capture time, it is only recorded once the next frame is captured
+        self.live_frames = None
+        self.live_time = None
+
+        # Index of the next frame to read, and of the frame the video is at, which differ after frames taken from the cache
+        self.source_index = 0
+        self.source_position = 0
+        self.frame_index = 0
+
+        # Time range to render in seconds, and the frame it ends at
+        self.start = start
+        self.end = end
+        self.end_frame = None
+
+        # Recordings in segments of segment_frames frames resume after the segments already encoded, 0 records in one piece
+        self.segment_frames = segment_frames
+
+        # Memory budget in MB of the frame buffers, the recordings are drawn and streamed to ffmpeg in strips to stay within it, 0 for no limit
+        self.memory_mb = memory_mb
+        self.strips = None
 
         self.WIDTH = None
         self.nb_frame = 0
@@ -24,34 +96,148 @@ class ASCIIXEL:
         self.draw_char = self.draw_ascii
         self.colour_lvl = colour_lvl
 
+        # The glyphs are picked by their measured ink rather than spread evenly over the luma in the order of the set
+        self.calibrated_glyphs = calibrated_glyphs
+
+        # The glyphs are matched to the shape of the cells sampled on a small block rather than to their luma alone
+        self.shape_matching = shape_matching
+        self.matcher = None
+
+        # Quantisation of the colours: uniform to colour_lvl levels, a named palette or a palette of nb_colours fitted per scene
+        self.quantise = quantise
+        self.palette = palette
+        self.nb_colours = nb_colours
+
         # Character display settings
         self.element_size = element_size
 
     def setup(self) -> bool:
         if self.path == '': return False
 
-        self.name = self.path.split('/')[-1].split('.')[0]
-        self.current_element_size = self.element_size
-        self.output_name = f'ASCIIXEL_{self.name}_{self.output_type.name}_elSize{self.current_element_size}'
-        if self.output_type != OutputType.PIXEL_ART:
-            self.output_name += f'_asciiPal{self.ascii_set}'
+        self.setup_output_name()
 
-        if self.output_type != OutputType.ASCII:
-            self.output_name += f'_colourLvl{self.colour_lvl}'
+        # Compile or load the kernels while the video opens
+        warm_up_kernels()
         
         # Video/Image setup
-        self.cap = cv2.VideoCapture(self.path)
-        self.get_image()
+        if self.custom_resolution:
+            self.ORIGWIDTH, self.ORIGHEIGHT = self.custom_resolution
+        self.close_live()
+        self.live = None
+        if is_live(self.path):
+            # The end of a live source is the duration of its capture
+            self.cap = self.live = LiveCapture(self.path, duration=self.end)
+        else:
+            self.cap = StillCapture(self.path) if self.still else cv2.VideoCapture(self.path)
 
-        # Character display settings
-        self.font = ImageFont.load_default()
+        # The first frame gives the size of the video, the only frame of a still is rendered too
+        ret, self.frame = self.cap.read()
+        if not ret:
+            self.finish = True
+            return False
+        self.source_index = 0 if self.still else 1
+        self.source_position = 1
+        self.rendered = None
+        self.source_key = source_digest(self.path) if self.cache is not None and self.live is None else None
 
         # Screen settings
         if self.custom_resolution:
-            self.ORIGWIDTH, self.ORIGHEIGHT = self.custom_resolution
+            self.setup_render(self.custom_resolution)
         else:
-            self.ORIGWIDTH, self.ORIGHEIGHT = self.image.shape[0], self.image.shape[1]
+            self.setup_render((self.frame.shape[1], self.frame.shape[0]))
+
+        # Recording settings
+        self.rec_fps =  self.cap.get(cv2.CAP_PROP_FPS)
+
+        # The frames before start are skipped by seeking on the first read
+        self.end_frame = self.time_frame(self.end) if not self.still and self.live is None else None
+        if self.start is not None and not self.still and self.live is None:
+            self.seek(self.time_frame(self.start))
+        
+        if self.record:
+            self.live_clock = LiveClock(self.rec_fps) if self.live is not None else None
+            self.live_frames = None
+            if self.writes_image():
+                createOutputFolder(self.output_dir)
+            elif self.segment_frames > 0 and self.pipes_frames() and self.live is None:
+                createOutputFolder(self.output_dir)
+                self.recorder = SegmentedRecorder(self.output_path(), self.ORIGWIDTH, self.ORIGHEIGHT, self.rec_fps, self.path, self.segment_frames, self.source_index, self.segment_key(), audio_start=self.range_start())
+                self.recorder.start()
+
+                # Go on after the segments already encoded, only join them if they are all there
+                resume = self.recorder.resume_frame()
+                if resume is None:
+                    self.finish = True
+                else:
+                    self.seek(resume)
+            elif self.pipes_frames():
+                createOutputFolder(self.output_dir)
+                self.recorder = FFmpegRecorder(self.output_path(), self.ORIGWIDTH, self.ORIGHEIGHT, self.rec_fps, self.path if self.live is None else None, audio_start=self.range_start())
+                self.recorder.start()
+            elif self.record_backend in GRID_BACKENDS:
+                # A frame sequence stores a single palette for the whole video
+                if self.record_backend == RecordBackend.FRAMES and self.adapts_palette():
+                    raise ValueError(f'{self.quantise.name} fits a palette per scene, it can not be recorded as {RecordBackend.FRAMES.name}')
+                createOutputFolder(self.output_dir)
+                self.recorder = grid_recorder(self.record_backend, self.output_path(), self.WIDTH, self.HEIGHT, self.rec_fps, self.ASCII_CHARS, self.output_type, self.colour_lvl, self.quantiser.colours)
+                self.recorder.start()
+            else:
+                createFolder()
+                # Start of the audio of a time range, taken before the frames are read
+                self.audio_start = self.range_start()
+
+        return True
+
+    # Name the outputs after the input and the settings
+    def setup_output_name(self) -> None:
+        self.name = live_name(self.path) if is_live(self.path) else self.path.split('/')[-1].split('.')[0]
+        self.still = is_image(self.path)
+        self.output_name = f'ASCIIXEL_{self.name}_{self.output_type.name}_elSize{self.element_size}'
+        if self.output_type != OutputType.PIXEL_ART:
+            self.output_name += f'_asciiPal{self.ascii_set}'
+
+        if self.output_type != OutputType.ASCII:
+            if self.quantise == QuantiseMode.UNIFORM:
+                self.output_name += f'_colourLvl{self.colour_lvl}'
+            elif self.quantise == QuantiseMode.PALETTE:
+                self.output_name += f'_palette{self.palette}'
+            else:
+                self.output_name += f'_{self.quantise.name.lower()}{self.nb_colours}'
+
+        if self.shape_matching and self.output_type != OutputType.PIXEL_ART:
+            self.output_name += '_shape'
+        elif self.calibrated_glyphs and self.output_type != OutputType.PIXEL_ART:
+            self.output_name += '_calibrated'
+
+        if self.reverse_colour:
+            self.output_name += '_reversed'
+
+        if self.custom_resolution:
+            self.output_name += f'_res{self.custom_resolution[0]}x{self.custom_resolution[1]}'
+
+        if (self.start is not None or self.end is not None) and not is_live(self.path):
+            self.output_name += f'_from{self.start or 0:g}s'
+            if self.end is not None:
+                self.output_name += f'_to{self.end:g}s'
+
+    # Path of the recorded video, or of the recorded grids
+    def output_path(self) -> str:
+        if self.writes_image(): return f'{self.output_dir}/{self.output_name}.png'
+        return f'{self.output_dir}/{self.output_name}{RECORD_EXTENTIONS[self.record_backend]}'
+
+    # Check if the recording is a single image, as the stills recorded with the video backends are
+    def writes_image(self) -> bool:
+        return self.still and self.record_backend not in GRID_BACKENDS
+
+    # Prepare the rendering of frames of the given output size, without opening the video
+    def setup_render(self, size: Tuple[int, int]) -> None:
+        self.current_element_size = self.element_size
+
+        # Character display settings
+        self.font = default_font()
 
+        # Screen settings
+        self.ORIGWIDTH, self.ORIGHEIGHT = size
         self.WIDTH, self.HEIGHT = self.ORIGWIDTH//self.current_element_size, self.ORIGHEIGHT//self.current_element_size
 
         self.original_ratio = self.ORIGHEIGHT/self.ORIGWIDTH
@@ -60,6 +246,8 @@ class ASCIIXEL:
         # Display settings
         self.bg = 'white' if self.reverse_colour else 'black'
         self.fg = 'black' if self.reverse_colour else 'white'
+        self.bg_rgb = ImageColor.getrgb(self.bg)
+        self.fg_rgb = ImageColor.getrgb(self.fg)
 
         # Selection of the character sets
         self.ASCII_CHARS = ASCII_CHARS_TAB[self.ascii_set]
@@ -69,7 +257,6 @@ class ASCIIXEL:
         if self.reverse_colour: 
             self.ASCII_CHARS = self.ASCII_CHARS[::-1]
             self.skip_index = len(self.ASCII_CHARS)-1
-        self.ASCII_COEFF = (len(self.ASCII_CHARS)-1)/255
 
         # Selection of the style
         if self.output_type == OutputType.ASCII:
@@ -79,53 +266,374 @@ class ASCIIXEL:
         elif self.output_type == OutputType.PIXEL_ART:
             self.draw_char = self.draw_pixel
 
+        # Selection of the NumPy renderers, the strips never build the lists of the PIL engine and draw the same pixels
+        if self.engine == RenderEngine.NUMPY or self.uses_strips():
+            if self.output_type == OutputType.ASCII:
+                self.draw_char = self.draw_ascii_atlas
+            elif self.output_type == OutputType.ASCII_COLOUR:
+                self.draw_char = self.draw_ascii_colour_atlas
+            elif self.output_type == OutputType.PIXEL_ART:
+                self.draw_char = self.draw_pixel_blocks
+
+        # Glyph tiles and colour table used by the NumPy renderers
+        self.atlas = get_glyph_atlas(self.font, self.ASCII_CHARS, self.current_element_size)
+
+        # Table from the luma of a cell to its glyph, shared by all the renderers
+        # The shapes are matched while preprocessing and the luma grid then holds the glyphs, read through an identity table
+        self.matcher = None
+        if self.shape_matching and self.output_type != OutputType.PIXEL_ART:
+            self.matcher = self.atlas.shape_matcher(self.reverse_colour)
+            self.char_lut = np.arange(256, dtype=np.uint8)
+        else:
+            self.char_lut = self.atlas.char_lut(self.skip_index, self.calibrated_glyphs, self.reverse_colour)
+        self.quantiser = Quantiser(self.quantise, self.colour_lvl, self.palette, self.nb_colours)
+        self.colour_lut = self.quantiser.lut
+
+        # Grids filled by the conversion kernels, reused from one frame to the next
+        self.char_grid = np.empty((self.WIDTH, self.HEIGHT), dtype=np.uint8)
+        self.colour_grid = np.empty((self.WIDTH, self.HEIGHT, 3), dtype=np.uint8)
+        self.drawn_grid = np.empty((self.WIDTH, self.HEIGHT), dtype=np.bool_)
+
+        # Buffers of the preprocessing, reused from one frame to the next
+        self.cell_buffers = self.allocate_cells()
+
+        # The frames drawn in strips never exist whole, nor are they drawn incrementally
+        self.strips = None
+        self.delta = None
+        self.out_index = 0
+        self.canvas = None
+        if self.uses_strips():
+            self.out_image = self.img_draw = self.out_array = None
+            self.out_buffers = [None]
+            self.deltas = [None]
+            self.strips = StripRenderer((self.ORIGHEIGHT, self.ORIGWIDTH, 3), self.current_element_size, *self.compose_context(), self.strip_cells())
+            return
+
         # Create output image
         self.out_image = Image.new('RGB', (self.ORIGWIDTH, self.ORIGHEIGHT), self.bg)
         self.img_draw = ImageDraw.Draw(self.out_image)
-
-        # Recording settings
-        self.rec_fps =  self.cap.get(cv2.CAP_PROP_FPS)
-        
-        if self.record:
-            createFolder()
-
-        return True
+        self.out_buffers = [np.empty((self.ORIGHEIGHT, self.ORIGWIDTH, 3), dtype=np.uint8) for _ in range(max(1, self.nb_out_buffers))]
+        for out_array in self.out_buffers:
+            out_array[:] = self.bg_rgb
+        self.out_array = self.out_buffers[0]
+
+        # Canvas of whole cells the glyphs spilling over their neighbours are blended on, of this renderer as the atlas is shared
+        if not self.atlas.fits and self.output_type != OutputType.PIXEL_ART:
+            self.canvas = np.empty((-(-self.ORIGHEIGHT//self.current_element_size)*self.current_element_size, -(-self.ORIGWIDTH//self.current_element_size)*self.current_element_size, 3), dtype=np.uint8)
+
+        # Grids of the previous frame drawn into each output array, to find the cells to redraw
+        self.deltas = [None]*len(self.out_buffers)
+        if self.incremental and self.draws_array():
+            self.deltas = [DeltaRenderer(out_array.shape, self.current_element_size, *self.compose_context()) for out_array in self.out_buffers]
+            self.delta = self.deltas[0]
+
+    # Cells around a cell that its drawing can reach, and the values of the grids for the cells outside the frame
+    def compose_context(self) -> tuple:
+        if self.output_type == OutputType.PIXEL_ART:
+            return PIXEL_CONTEXT, (0, False)
+        return self.atlas.context(), (self.atlas.blank, 0)
+
+    # Check if the frames are drawn in strips streamed to ffmpeg, as the recordings to a video with a memory budget are
+    def uses_strips(self) -> bool:
+        return self.memory_mb > 0 and self.record and self.pipes_frames() and self.live is None
+
+    # Rows of cells of the strips fitting in the memory budget, once the cells, the decoded frames and the prefetched frames are counted
+    def strip_cells(self) -> int:
+        left, top, right, bottom = self.compose_context()[0]
+        source = self.frame.nbytes if self.frame is not None else self.ORIGWIDTH*self.ORIGHEIGHT*3
+        cells = self.WIDTH*self.HEIGHT
+        fixed = cells*FRAME_CELL_BYTES + DECODED_FRAMES*source + self.prefetch_bytes() + cells*7
+        if self.matcher is not None:
+            fixed += cells*4*self.matcher.block**2
+
+        # A strip of n rows of cells composes a canvas of n+top+bottom rows of cells
+        row = (-(-self.ORIGWIDTH//self.current_element_size)+left+right)*self.current_element_size**2*STRIP_PIXEL_BYTES
+        nb_row = (self.memory_mb*2**20-fixed)//row - top - bottom
+        if nb_row < 1:
+            needed = (fixed + (1+top+bottom)*row)/2**20
+            raise ValueError(f'A memory budget of {self.memory_mb} MB is too small for {self.ORIGWIDTH}x{self.ORIGHEIGHT} frames of {self.current_element_size} pixel cells, it needs at least {needed:.0f} MB')
+        return nb_row
+
+    # Memory budget of the prefetched frames, at most a quarter of the memory budget
+    def prefetch_bytes(self) -> int:
+        if not self.prefetch: return 0
+        if self.memory_mb: return min(self.prefetch_mb*2**20, self.memory_mb*2**20//4)
+        return self.prefetch_mb*2**20
+
+    # Draw the next frame into the next output array, return its index
+    def swap_output(self) -> int:
+        self.out_index = (self.out_index+1) % len(self.out_buffers)
+        self.out_array = self.out_buffers[self.out_index]
+        self.delta = self.deltas[self.out_index]
+        return self.out_index
     
     def reset(self) -> None:
+        self.stop_prefetch()
+        self.close_live()
         self.WIDTH = None
         self.nb_frame = 0
         self.finish = False
+        if self.profiler is not None:
+            self.profiler.reset()
     
+    # Get the settings given to the constructor, enough to build the same renderer elsewhere
+    def settings(self) -> dict:
+        return {
+            'path': self.path,
+            'ascii_set': self.ascii_set,
+            'element_size': self.element_size,
+            'display_original': self.display_original,
+            'resolution': self.custom_resolution,
+            'record': self.record,
+            'reverse_colour': self.reverse_colour,
+            'output_type': self.output_type,
+            'colour_lvl': self.colour_lvl,
+            'engine': self.engine,
+            'record_backend': self.record_backend,
+            'nb_workers': self.nb_workers,
+            'incremental': self.incremental,
+            'full_redraw_ratio': self.full_redraw_ratio,
+            'prefetch': self.prefetch,
+            'prefetch_mb': self.prefetch_mb,
+            'quantise': self.quantise,
+            'palette': self.palette,
+            'nb_colours': self.nb_colours,
+            'start': self.start,
+            'end': self.end,
+            'segment_frames': self.segment_frames,
+            'memory_mb': self.memory_mb,
+            'calibrated_glyphs': self.calibrated_glyphs,
+            'shape_matching': self.shape_matching
+        }
+
     # Retrieve a frame from a video/image
     def get_image(self) -> None:
-        ret, self.cv2_image = self.cap.read()
-        if not ret:
+        if self.prefetcher is not None:
+            images = self.prefetcher.get()
+        else:
+            ret, source = self.read_source()
+            images = self.prepare_source(source, self.cell_buffers) if ret else None
+        self.mark('decode')
+        if images is None:
             self.finish = True
             return
 
-        if self.custom_resolution: self.cv2_image = cv2.resize(self.cv2_image, (self.ORIGWIDTH, self.ORIGHEIGHT), interpolation=cv2.INTER_AREA)
-        self.cv2_image = cv2.cvtColor(self.cv2_image, cv2.COLOR_BGR2RGB)
+        self.frame, self.image, self.grayscale, self.rendered, self.frame_index = images
+        self.mark('preprocess')
+
+    # Read the next frame, only decoding it when neither its cells nor its rendering are cached
+    # Return (ret, (index, frame, cells, rendered)) with None for what was not needed
+    def read_source(self) -> tuple:
+        index = self.source_index
+        if self.end_frame is not None and index >= self.end_frame: return False, None
+
+        cells, rendered = None, None
+        if self.source_key is not None:
+            rendered = self.cache.get(self.frame_key(index)) if self.caches_frames() else None
+            if rendered is None:
+                cells = self.cache.get(self.cells_key(index))
+
+        frame = None
+        if self.display_original or (rendered is None and cells is None):
+            ret, frame = self.read_frame()
+            if not ret: return False, None
+        else:
+            self.source_index += 1
+        return True, (index, frame, cells, rendered)
+
+    # Decode the next frame, seeking first when the video is not at that frame
+    def read_frame(self) -> tuple:
+        index = self.source_index
+        if self.end_frame is not None and index >= self.end_frame: return False, None
+        self.source_index += 1
+
+        if self.source_position != index:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+        ret, frame = self.cap.read()
+        if ret:
+            self.source_position = index+1
+        return ret, frame
+
+    # Go on from a frame of the video, rendered as if the video started there
+    def seek(self, index: int) -> None:
+        self.stop_prefetch()
+        self.source_index = index
+        for delta in self.deltas:
+            if delta is not None: delta.reset()
+        self.quantiser.scene = None
+
+    # Time in seconds of the first frame of a time range, None when the whole video is rendered
+    def range_start(self) -> float:
+        if (self.start is None and self.end is None) or self.live is not None: return None
+        return self.source_index/self.rec_fps
+
+    # Frame of the video at a time in seconds, None for no time
+    def time_frame(self, seconds: float) -> int:
+        if seconds is None: return None
+        return max(0, round(seconds*self.rec_fps))
+
+    # Images used by the conversion of a frame read by read_source: the frame if it is displayed,
+    # its cells, its cached rendering and its index
+    def prepare_source(self, source: tuple, buffers: tuple =None) -> tuple:
+        index, frame, cells, rendered = source
+        if rendered is not None:
+            return frame if self.display_original else None, None, None, rendered[0], index
+        if cells is not None:
+            return (frame if self.display_original else None, *cells, None, index)
+
+        frame, image, grayscale = self.preprocess(frame, buffers)
+        if self.source_key is not None:
+            self.cache.put(self.cells_key(index), (image, grayscale))
+        return frame, image, grayscale, None, index
+
+    # Drop the next frames without converting them, return how many were dropped
+    def skip_frames(self, nb_frame: int) -> int:
+        for index in range(nb_frame):
+            if self.prefetcher is not None:
+                skipped = self.prefetcher.get() is not None
+            else:
+                skipped = self.skip_source()
+
+            if not skipped:
+                self.finish = True
+                return index
+        return nb_frame
+
+    # Skip the next frame, only grabbing it when the video is at that frame
+    def skip_source(self) -> bool:
+        index = self.source_index
+        if self.end_frame is not None and index >= self.end_frame: return False
+        self.source_index += 1
+        if self.source_position != index: return True
+
+        if not self.cap.grab(): return False
+        self.source_position += 1
+        return True
 
-        resized_img = self.cv2_image
-        if self.WIDTH: resized_img = cv2.resize(resized_img, (self.WIDTH, self.HEIGHT), interpolation=cv2.INTER_AREA)
-        self.image = cv2.transpose(resized_img)
-        self.grayscale = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
+    # Keys of the cache: the cells depend on the frame and the size of the grid, the rendered frames on all the settings
+    def cells_key(self, index: int) -> str:
+        if self.matcher is not None:
+            return cache_key('cells', self.source_key, index, self.WIDTH, self.HEIGHT, 'shape', self.ascii_set, self.current_element_size, self.reverse_colour)
+        return cache_key('cells', self.source_key, index, self.WIDTH, self.HEIGHT)
+
+    def frame_key(self, index: int) -> str:
+        return cache_key('frame', self.source_key, index, *self.render_settings())
+
+    # Settings the rendered frames depend on
+    def render_settings(self) -> tuple:
+        return (self.output_type.value, self.engine.value, self.ascii_set, self.element_size, self.colour_lvl, self.quantise.value, self.palette, self.nb_colours, self.reverse_colour, self.calibrated_glyphs, self.shape_matching, self.ORIGWIDTH, self.ORIGHEIGHT)
+
+    # Key of a segmented recording: the segments of a recording with another key can not be reused
+    def segment_key(self) -> str:
+        return cache_key('segments', source_digest(self.path), self.source_index, self.end_frame, self.segment_frames, self.rec_fps, *self.render_settings())
+
+    # Check if rendered frames can be taken from the cache, the grid backends need the grids of every frame
+    # and the frames quantised with adaptive palettes depend on the frames shown before them
+    def caches_frames(self) -> bool:
+        return self.source_key is not None and self.strips is None and self.rasterise and not self.adapts_palette() and not (self.record and self.record_backend in GRID_BACKENDS)
+
+    # Check if the colours of the frames are quantised with a palette fitted per scene, the plain ASCII uses no colour
+    def adapts_palette(self) -> bool:
+        return self.quantiser.adaptive and self.output_type != OutputType.ASCII
+
+    # Convert a decoded BGR frame into the images used by the conversion
+    def prepare_image(self, frame: np.ndarray) -> None:
+        self.frame, self.image, self.grayscale = self.preprocess(frame, self.cell_buffers)
+        self.rendered = None
+        self.mark('preprocess')
+
+    # Buffers of the preprocessing: the BGR cells as resized, the (width, height) RGB cells and their luma,
+    # and with shape matching the BGR and luma samples of the blocks of the cells
+    def allocate_cells(self) -> tuple:
+        block = self.matcher.block if self.matcher is not None else 0
+        return (
+            np.empty((self.HEIGHT, self.WIDTH, 3), dtype=np.uint8),
+            np.empty((self.WIDTH, self.HEIGHT, 3), dtype=np.uint8),
+            np.empty((self.WIDTH, self.HEIGHT), dtype=np.uint8),
+            np.empty((self.HEIGHT*block, self.WIDTH*block, 3), dtype=np.uint8),
+            np.empty((self.HEIGHT*block, self.WIDTH*block), dtype=np.uint8)
+        )
+
+    # Cells of a decoded BGR frame: the frame is averaged straight into the cell grid, whatever the output resolution,
+    # then a single pass transposes the cells to RGB and computes their luma
+    # Only reads the settings, so that it can run on the prefetching thread with its own buffers
+    def preprocess(self, frame: np.ndarray, buffers: tuple =None) -> tuple:
+        cells, image, grayscale, blocks, blocks_luma = buffers or self.allocate_cells()
+        cv2.resize(frame, (self.WIDTH, self.HEIGHT), dst=cells, interpolation=cv2.INTER_AREA)
+        accelerate_preprocessing(cells, image, grayscale)
+
+        # The glyphs matched replace the luma of the cells
+        if self.matcher is not None:
+            block = self.matcher.block
+            cv2.resize(frame, (self.WIDTH*block, self.HEIGHT*block), dst=blocks, interpolation=cv2.INTER_AREA)
+            cv2.cvtColor(blocks, cv2.COLOR_BGR2GRAY, dst=blocks_luma)
+            self.matcher.match(blocks_luma, grayscale)
+
+        # The frame is only kept when it is displayed
+        return frame if self.display_original else None, image, grayscale
+
+    # Decoded frame in RGB at the output resolution, None if it was not kept
+    def original_image(self) -> np.ndarray:
+        if self.frame is None: return None
+
+        image = self.frame
+        if self.custom_resolution: image = cv2.resize(image, (self.ORIGWIDTH, self.ORIGHEIGHT), interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+    # Decode and preprocess the next frames on a background thread
+    def start_prefetch(self) -> None:
+        self.stop_prefetch()
+        self.prefetcher = FramePrefetcher(self.read_source, self.prepare_source, self.prefetch, self.prefetch_bytes())
+        self.prefetcher.start()
+
+    def stop_prefetch(self) -> None:
+        if self.prefetcher is not None:
+            self.prefetcher.stop()
+            self.prefetcher = None
+
+    # Stop reading the camera or the stream, its statistics are kept until the next setup
+    def close_live(self) -> None:
+        if self.live is not None:
+            self.live.release()
 
     # Draw the classic ASCII
     def draw_ascii(self) -> None:
-        array_of_values = accelerate_conversion_ascii(self.grayscale, self.WIDTH, self.HEIGHT, self.ASCII_COEFF, self.skip_index)
+        array_of_values = accelerate_conversion_ascii(self.grayscale, self.WIDTH, self.HEIGHT, self.char_lut, self.atlas.blank)
+        self.mark('kernel')
         for char_index, (x, y) in array_of_values:
             self.img_draw.text((x*self.current_element_size, y*self.current_element_size), self.ASCII_CHARS[char_index], fill=self.fg, font=self.font, font_size=self.current_element_size)
     
     # Draw the colour ASCII
     def draw_ascii_colour(self) -> None:
-        array_of_values = accelerate_conversion_ascii_colour(self.image, self.grayscale, self.WIDTH, self.HEIGHT, self.ASCII_COEFF, self.colour_lvl, self.skip_index)
+        array_of_values = accelerate_conversion_ascii_colour(self.quantiser.apply(self.image), self.grayscale, self.WIDTH, self.HEIGHT, self.char_lut, self.colour_lut, self.atlas.blank)
+        self.mark('kernel')
         for char_index, colour, (x, y) in array_of_values:
             self.img_draw.text((x*self.current_element_size, y*self.current_element_size), self.ASCII_CHARS[char_index], fill=colour, font=self.font, font_size=self.current_element_size)
     
+    # Fill the grids of the current frame with the conversion kernel of the output type
+    def convert_grids(self) -> None:
+        if self.output_type == OutputType.ASCII:
+            accelerate_conversion_ascii_grid(self.grayscale, self.char_lut, self.char_grid)
+        elif self.output_type == OutputType.ASCII_COLOUR:
+            accelerate_conversion_ascii_colour_grid(self.quantiser.apply(self.image), self.grayscale, self.char_lut, self.colour_lut, self.atlas.blank, self.char_grid, self.colour_grid)
+        elif self.output_type == OutputType.PIXEL_ART:
+            accelerate_conversion_pixel_grid(self.quantiser.apply(self.image), self.colour_lut, self.colour_grid, self.drawn_grid)
+        self.mark('kernel')
+
+    # Draw the classic ASCII from the glyph atlas
+    def draw_ascii_atlas(self) -> None:
+        self.convert_grids()
+        self.compose_cells(lambda char_grid, out: self.atlas.compose(char_grid, self.fg_rgb, self.bg_rgb, out, self.canvas), self.char_grid)
+
+    # Draw the colour ASCII from the glyph atlas
+    def draw_ascii_colour_atlas(self) -> None:
+        self.convert_grids()
+        self.compose_cells(lambda char_grid, colour_grid, out: self.atlas.compose_colour(char_grid, colour_grid, self.bg_rgb, out, self.canvas), self.char_grid, self.colour_grid)
+
     # Draw the pixel art
     def draw_pixel(self) -> None:
-        array_of_values = accelerate_conversion_pixel(self.image, self.WIDTH, self.HEIGHT, self.colour_lvl)
+        array_of_values = accelerate_conversion_pixel(self.quantiser.apply(self.image), self.WIDTH, self.HEIGHT, self.colour_lut)
+        self.mark('kernel')
         for colour, (x, y) in array_of_values:
             self.img_draw.rectangle(
                 [
@@ -135,41 +643,260 @@ class ASCIIXEL:
                     (y*self.current_element_size)+self.current_element_size
                 ], fill=colour)
 
+    # Draw the pixel art as whole arrays scaled up from the quantised image
+    def draw_pixel_blocks(self) -> None:
+        self.convert_grids()
+        self.compose_cells(lambda colour_grid, drawn_grid, out: compose_pixels(colour_grid, drawn_grid, self.current_element_size, self.bg_rgb, out), self.colour_grid, self.drawn_grid)
+
+    # Composite the grids into out_array, only redrawing the cells that changed in incremental mode
+    def compose_cells(self, compose, *grids: np.ndarray) -> None:
+        if self.strips is not None:
+            # The strips go to ffmpeg as they are drawn, stop the rendering if it exited early
+            if not self.strips.render(grids, compose, self.recorder.write_rows):
+                self.finish = True
+            return
+        if self.delta is None:
+            compose(*grids, self.out_array)
+            return
+        self.changed_ratio = self.delta.render(grids, compose, self.out_array, self.full_redraw_ratio)
+
+    # Check if the current style is drawn into out_array instead of out_image
+    def draws_array(self) -> bool:
+        return self.draw_char in (self.draw_ascii_atlas, self.draw_ascii_colour_atlas, self.draw_pixel_blocks)
+
     # Draw the converted frame
     def draw(self) -> None:
-        self.out_image = Image.new('RGB', (self.ORIGWIDTH, self.ORIGHEIGHT), self.bg)
-        self.img_draw = ImageDraw.Draw(self.out_image)
-
         self.get_image()
+        if self.finish: return
+
+        self.draw_frame()
+
+    # Draw the image already prepared
+    def draw_frame(self) -> None:
+        # The grid backends only need the grids when no one looks at the frames
+        if not self.rasterise:
+            self.convert_grids()
+            self.mark('draw')
+            return
+
+        if self.rendered is not None:
+            self.show_rendered()
+            self.mark('draw')
+            return
+
+        if not self.draws_array():
+            self.out_image = Image.new('RGB', (self.ORIGWIDTH, self.ORIGHEIGHT), self.bg)
+            self.img_draw = ImageDraw.Draw(self.out_image)
+
         self.draw_char()
+        if self.caches_frames():
+            self.cache.put(self.frame_key(self.frame_index), (self.frame_array(),))
+        self.mark('draw')
+
+    # Show a frame taken from the cache, the next frame is redrawn in full as its grids are not known
+    def show_rendered(self) -> None:
+        if not self.draws_array():
+            self.out_image = Image.fromarray(self.rendered)
+            return
+
+        np.copyto(self.out_array, self.rendered)
+        if self.delta is not None:
+            self.delta.reset()
+
+    # Get the last converted frame as an array
+    def frame_array(self) -> np.ndarray:
+        if self.draws_array():
+            return self.out_array
+        return np.asarray(self.out_image)
+
+    # Get the last converted frame as a PIL image
+    def frame_image(self) -> Image.Image:
+        if self.draws_array():
+            return Image.fromarray(self.out_array)
+        return self.out_image
 
     # Save an image
     def save_image(self) -> None:
-        self.out_image.save(f'frames/{self.output_name}_{self.nb_frame:05d}.png')
+        self.frame_image().save(self.frame_path())
 
-    # Convert all the frames into a video if record is true
-    def record_video(self) -> None:
-        if self.record:
-            createVideo(self.output_name, self.path, self.rec_fps, self.ORIGWIDTH, self.ORIGHEIGHT)
+    # Path of the current frame when recording in PNG
+    def frame_path(self) -> str:
+        return f'frames/{self.output_name}_{self.nb_frame:05d}.png'
+
+    # Record the current frame with the selected backend
+    def save_frame(self) -> None:
+        if self.strips is not None:
+            # Already recorded strip by strip
+            return
+
+        # A live frame lasts until the capture of the next one, the previous frame fills the slots elapsed until then
+        if self.live is not None:
+            self.record_live(self.live_clock.frames_due(self.live.frame_time))
+            self.hold_live_frame()
+            return
+
+        if self.record_backend == RecordBackend.PNG and not self.pipes_frames() and not self.writes_image():
+            self.save_image()
+        elif self.record_backend in GRID_BACKENDS:
+            if not self.record_grids():
+                self.finish = True
+        elif not self.record_frame(self.frame_array()):
+            # Stop the rendering if ffmpeg exited early
+            self.finish = True
+
+    # Record the live frame held nb_record times
+    def record_live(self, nb_record: int) -> None:
+        if self.live_frames is None or nb_record == 0: return
+
+        for _ in range(nb_record):
+            if self.record_backend in GRID_BACKENDS:
+                recorded = self.recorder.write(*self.live_frames)
+            else:
+                recorded = self.record_frame(self.live_frames[0])
+            if not recorded:
+                # Stop the rendering if ffmpeg exited early
+                self.finish = True
+                return
+        self.live.add_latency('recorded', self.live_time)
+
+    # Keep a copy of the live frame just drawn, recorded once the capture of the next frame tells how long it lasts
+    def hold_live_frame(self) -> None:
+        current = self.recorded_grids() if self.record_backend in GRID_BACKENDS else (self.frame_array(),)
+        if self.live_frames is None:
+            self.live_frames = tuple(None if array is None else array.copy() for array in current)
+        else:
+            for held, array in zip(self.live_frames, current):
+                if held is not None: np.copyto(held, array)
+        self.live_time = self.live.frame_time
+
+    # Check if the frames are streamed to ffmpeg, the segmented recordings always are
+    def pipes_frames(self) -> bool:
+        if self.writes_image(): return False
+        return self.record_backend == RecordBackend.PIPE or (self.record_backend == RecordBackend.PNG and (self.segment_frames > 0 or self.live is not None))
+
+    # Record a frame given as an array, return False if the recording can not go on
+    def record_frame(self, frame: np.ndarray) -> bool:
+        if self.writes_image():
+            Image.fromarray(frame).save(self.output_path())
+            return True
+        if not self.pipes_frames():
+            Image.fromarray(frame).save(self.frame_path())
+            return True
+        return self.recorder.write(frame)
+
+    # Record the grids of the current frame, return False if the recording can not go on
+    def record_grids(self) -> bool:
+        return self.recorder.write(*self.recorded_grids())
+
+    # Grids of the current frame recorded by the grid backends, None for a grid the output type does not use
+    def recorded_grids(self) -> tuple:
+        # The PIL engine draws without filling the grids
+        if self.rasterise and not self.draws_array():
+            self.convert_grids()
+
+        char_grid = self.char_grid if self.output_type != OutputType.PIXEL_ART else None
+        colour_grid = self.colour_grid if self.output_type != OutputType.ASCII else None
+        return char_grid, colour_grid
+
+    # Convert all the frames into a video if record is true, return the ffmpeg exit status
+    def record_video(self) -> int:
+        if not self.record: return None
+        if self.writes_image(): return 0
+
+        # The last live frame fills its own slot
+        if self.live_frames is not None:
+            self.record_live(self.live_clock.frames_left())
+            self.live_frames = None
+
+        if self.record_backend != RecordBackend.PNG or self.pipes_frames():
+            return self.recorder.close()
+        return createVideo(self.output_name, self.path, self.rec_fps, self.ORIGWIDTH, self.ORIGHEIGHT, self.audio_start)
+
+    # Stop a recording before the end of the video without keeping a partial output
+    def cancel_record(self) -> None:
+        self.stop_prefetch()
+        if self.record and self.recorder is not None:
+            self.recorder.abort()
+
+    # Turn on the per-stage timing of the frames, kept for the last capacity frames
+    def enable_profiling(self, capacity: int =512) -> StageProfiler:
+        self.profiler = StageProfiler(capacity)
+        return self.profiler
+
+    def disable_profiling(self) -> None:
+        self.profiler = None
+
+    # Attribute the time since the previous mark to a stage of the current frame, free when profiling is off
+    def mark(self, stage: str) -> None:
+        if self.profiler is not None:
+            self.profiler.mark(stage)
 
     # Run one step of the algorithm
     def runStep(self) -> bool:
         if self.finish: return self.finish
 
+        if self.profiler is not None:
+            self.profiler.start_frame()
+
+        # The first frame read by setup sets the size, the next ones can be prefetched
+        # A live source already keeps its newest frames, queueing them would only add latency
+        if self.prefetch and self.prefetcher is None and self.live is None:
+            self.start_prefetch()
+
         self.draw()
 
         if self.finish: return self.finish
 
         if self.record:
-            self.save_image()
+            self.save_frame()
+            self.mark('save')
 
         self.nb_frame += 1
 
-    # Run the main algorithm
-    def run(self) -> None:
-        if not setup(): return
-
-        while not self.finish:
-            self.runStep()
+    # Run the main algorithm, return the ffmpeg exit status when recording
+    def run(self) -> int:
+        if not self.setup(): return None
+        return self.render()
+
+    # Render the rest of the video of an ASCIIXEL already set up, calling on_frame after each frame, return the ffmpeg exit status when recording
+    def render(self, on_frame: Callable[[], None] =None) -> int:
+        # Nothing shows the frames, the grid backends do not need them rasterised
+        self.rasterise = not (self.record and self.record_backend in GRID_BACKENDS)
+
+        # Render the frames on several processes when recording video, the adaptive palettes need the frames in order
+        # and the strips hold a single frame at a time
+        try:
+            if self.record and self.nb_workers > 1 and self.rasterise and not self.adapts_palette() and self.strips is None and not self.still and self.live is None:
+                return ParallelRecorder(self, self.nb_workers).run()
+
+            while not self.finish:
+                self.runStep()
+                if on_frame is not None: on_frame()
+        except KeyboardInterrupt:
+            # A live source has no end, it is stopped with Ctrl+C and what was recorded is kept
+            # The recording of a file stopped with Ctrl+C is dropped rather than left partial
+            if self.live is None:
+                self.cancel_record()
+                raise
+        finally:
+            # No thread is left reading the source, the prefetcher is kept for its statistics
+            if self.prefetcher is not None:
+                self.prefetcher.stop()
         
-        record_video()
\ No newline at end of file
+        status = self.record_video()
+        self.close_live()
+        return status
+
+    # Record the frames [first, last) into a video of their own without audio, for a segment joined later with others
+    # A last of None records up to the end of the video
+    # The ASCIIXEL has to be set up without recording, return the ffmpeg exit status
+    def record_segment(self, first: int, last: int, output_path: str) -> int:
+        self.seek(first)
+        self.end_frame = last
+        self.record = True
+        self.record_backend = RecordBackend.PIPE
+        if self.uses_strips():
+            self.setup_render((self.ORIGWIDTH, self.ORIGHEIGHT))
+        self.recorder = FFmpegRecorder(output_path, self.ORIGWIDTH, self.ORIGHEIGHT, self.rec_fps)
+        self.recorder.start()
+        return self.render()
\ No newline at end of file
@@ -1,20 +1,36 @@
 from PySide6.QtWidgets import QApplication, QMainWindow, QGroupBox, QLabel, QWidget, QLineEdit, QPushButton, QCheckBox, QComboBox, QSpinBox, QVBoxLayout, QHBoxLayout, QGridLayout, QFileDialog
 from PySide6.QtCore import QObject, QThread, Signal, Slot, Qt, QSize
-from PySide6.QtGui import QPixmap, QResizeEvent
+from PySide6.QtGui import QPixmap, QImage, QResizeEvent
 import qdarkstyle
-from PIL.ImageQt import ImageQt
-from PIL import Image
+import numpy as np
 from ASCIIXEL import ASCIIXEL
-from utils import EXTENTIONS, ASCII_CHARS_TAB, OutputType
+from cache import RenderCache
+from live import is_live
+from preview import FramePacer, LatestFrame
+from quantise import PALETTES
+from utils import EXTENTIONS, IMAGE_EXTENTIONS, ASCII_CHARS_TAB, OutputType, QuantiseMode, warm_up_kernels
+import time
 import sys
 import os
 
+# Wrap an RGB array as a QImage without copying it, the array has to outlive the image
+def array_to_qimage(array: np.ndarray) -> QImage:
+    height, width = array.shape[:2]
+    return QImage(array.data, width, height, array.strides[0], QImage.Format.Format_RGB888)
+
 # Create the application window
 class MainWindow(QMainWindow):
     def __init__(self) -> None:
         super().__init__()
 
-        self.app_ASCIIXEL = ASCIIXEL()
+        # Compile or load the kernels while the user picks a video
+        warm_up_kernels()
+
+        # Previews run again with other settings reuse the cells and the frames already rendered
+        self.app_ASCIIXEL = ASCIIXEL(cache=RenderCache())
+
+        # The preview shows one output array while the next frame is drawn into the other
+        self.app_ASCIIXEL.nb_out_buffers = 2
 
         # Create the Worker Thread Object
         self.instanced_thread = WorkerThread(self, self.app_ASCIIXEL)
@@ -34,12 +50,14 @@ class MainWindow(QMainWindow):
         self.asciiSetLayout = QVBoxLayout()
         self.elementSizeLayout = QVBoxLayout()
         self.colourLevelLayout = QVBoxLayout()
+        self.quantiseLayout = QVBoxLayout()
+        self.paletteLayout = QVBoxLayout()
 
         # Create a group box for the settings
         self.settingsGroupBox = QGroupBox("Settings")
 
         # Create all the Widgets
-        self.textQuery = QLabel(text="Enter the path of the video to convert: ")
+        self.textQuery = QLabel(text="Enter the path of the video to convert, a camera index or a stream URL: ")
         self.videoPath = QLineEdit()
         self.videoSearchButton = QPushButton(text="Open File")
 
@@ -65,18 +83,55 @@ class MainWindow(QMainWindow):
         self.colourLevelSpinBox.setMinimum(2)
         self.colourLevelSpinBox.setValue(self.app_ASCIIXEL.colour_lvl)
 
+        self.quantiseLabel = QLabel(text="Quantisation")
+        self.quantiseComboBox = QComboBox()
+        for el in QuantiseMode:
+            self.quantiseComboBox.addItem(el.name)
+        self.quantiseComboBox.setCurrentIndex(self.app_ASCIIXEL.quantise.value)
+
+        self.paletteLabel = QLabel(text="Palette / Size")
+        self.paletteComboBox = QComboBox()
+        for el in PALETTES:
+            self.paletteComboBox.addItem(el)
+        self.paletteComboBox.setCurrentText(self.app_ASCIIXEL.palette)
+        self.nbColoursSpinBox = QSpinBox()
+        self.nbColoursSpinBox.setRange(2, 256)
+        self.nbColoursSpinBox.setValue(self.app_ASCIIXEL.nb_colours)
+
         self.displayOrigCheckBox = QCheckBox(text="Display Original")
         self.displayOrigCheckBox.setChecked(self.app_ASCIIXEL.display_original)
 
         self.reverseColourCheckBox = QCheckBox(text="Reverse Colour")
         self.reverseColourCheckBox.setChecked(self.app_ASCIIXEL.reverse_colour)
 
+        self.incrementalCheckBox = QCheckBox(text="Incremental")
+        self.incrementalCheckBox.setChecked(self.app_ASCIIXEL.incremental)
+
+        self.calibratedCheckBox = QCheckBox(text="Calibrated Glyphs")
+        self.calibratedCheckBox.setChecked(self.app_ASCIIXEL.calibrated_glyphs)
+
+        self.shapeMatchingCheckBox = QCheckBox(text="Shape Matching")
+        self.shapeMatchingCheckBox.setChecked(self.app_ASCIIXEL.shape_matching)
+
+        self.realTimeCheckBox = QCheckBox(text="Real Time Preview")
+        self.realTimeCheckBox.setChecked(self.instanced_thread.real_time)
+
+        self.profilingCheckBox = QCheckBox(text="Profiling")
+        self.profilingCheckBox.setChecked(self.app_ASCIIXEL.profiler is not None)
+        self.saveTraceButton = QPushButton(text="Save Trace")
+
         self.previewButton = QPushButton(text="Run Preview")
         self.recordButton = QPushButton(text="Record")
         self.cancelButton = QPushButton(text="Cancel")
+        self.fpsLabel = QLabel()
         self.videoLabel = QLabel()
         self.videoOrigLabel = QLabel()
 
+        # Stage timings drawn over the result
+        self.statsLabel = QLabel(self.videoLabel)
+        self.statsLabel.setStyleSheet("font-family: monospace; color: white; background-color: rgba(0, 0, 0, 160); padding: 4px;")
+        self.statsLabel.hide()
+
         # Add the widgets to their corresponding layouts
         self.pathLayout.addWidget(self.videoPath)
         self.pathLayout.addWidget(self.videoSearchButton)
@@ -97,14 +152,30 @@ class MainWindow(QMainWindow):
         self.colourLevelLayout.addWidget(self.colourLevelSpinBox)
         self.settingsLayout.addLayout(self.colourLevelLayout, 3, 0, 1, 2)
 
-        self.settingsLayout.addWidget(self.displayOrigCheckBox, 4, 0)
-        self.settingsLayout.addWidget(self.reverseColourCheckBox, 4, 1)
+        self.quantiseLayout.addWidget(self.quantiseLabel)
+        self.quantiseLayout.addWidget(self.quantiseComboBox)
+        self.settingsLayout.addLayout(self.quantiseLayout, 4, 0)
+
+        self.paletteLayout.addWidget(self.paletteLabel)
+        self.paletteLayout.addWidget(self.paletteComboBox)
+        self.paletteLayout.addWidget(self.nbColoursSpinBox)
+        self.settingsLayout.addLayout(self.paletteLayout, 4, 1)
+
+        self.settingsLayout.addWidget(self.displayOrigCheckBox, 5, 0)
+        self.settingsLayout.addWidget(self.reverseColourCheckBox, 5, 1)
+        self.settingsLayout.addWidget(self.incrementalCheckBox, 6, 0)
+        self.settingsLayout.addWidget(self.realTimeCheckBox, 6, 1)
+        self.settingsLayout.addWidget(self.profilingCheckBox, 7, 0)
+        self.settingsLayout.addWidget(self.saveTraceButton, 7, 1)
+        self.settingsLayout.addWidget(self.calibratedCheckBox, 8, 0)
+        self.settingsLayout.addWidget(self.shapeMatchingCheckBox, 8, 1)
 
         self.settingsGroupBox.setLayout(self.settingsLayout)
 
         self.buttonLayout.addWidget(self.previewButton)
         self.buttonLayout.addWidget(self.recordButton)
         self.buttonLayout.addWidget(self.cancelButton)
+        self.buttonLayout.addWidget(self.fpsLabel)
 
         self.videoLayout.addWidget(self.videoLabel)
         self.videoLayout.addWidget(self.videoOrigLabel)
@@ -121,12 +192,22 @@ class MainWindow(QMainWindow):
 
         # Connect custom function to widget events
         self.videoSearchButton.clicked.connect(self.search)
+        self.videoPath.editingFinished.connect(self.onPathEdited)
         self.displayOrigCheckBox.stateChanged.connect(self.onStatesChanged)
         self.reverseColourCheckBox.stateChanged.connect(self.onStatesChanged)
+        self.incrementalCheckBox.stateChanged.connect(self.onStatesChanged)
+        self.calibratedCheckBox.stateChanged.connect(self.onStatesChanged)
+        self.shapeMatchingCheckBox.stateChanged.connect(self.onStatesChanged)
+        self.realTimeCheckBox.stateChanged.connect(self.onStatesChanged)
+        self.profilingCheckBox.stateChanged.connect(self.onStatesChanged)
+        self.saveTraceButton.clicked.connect(self.saveTrace)
         self.asciiSetComboBox.currentIndexChanged.connect(self.onAsciiSetIndexChanged)
         self.typeComboBox.currentIndexChanged.connect(self.onTypeIndexChanged)
         self.elementSizeSpinBox.valueChanged.connect(self.onElementSizeValueChanged)
         self.colourLevelSpinBox.valueChanged.connect(self.onColourLevelValueChanged)
+        self.quantiseComboBox.currentIndexChanged.connect(self.onQuantiseIndexChanged)
+        self.paletteComboBox.currentTextChanged.connect(self.onPaletteChanged)
+        self.nbColoursSpinBox.valueChanged.connect(self.onNbColoursValueChanged)
         self.previewButton.clicked.connect(self.clickPreview)
         self.recordButton.clicked.connect(self.clickRecord)
         self.cancelButton.clicked.connect(self.instanced_thread.stop)
@@ -137,16 +218,22 @@ class MainWindow(QMainWindow):
 
     # Search video file
     def search(self) -> None:
-        videoPathName = QFileDialog.getOpenFileName(caption="Open File", dir="/", filter="Video (*.mp4 *.mov *.mkv)")
+        videoPathName = QFileDialog.getOpenFileName(caption="Open File", dir="/", filter="Video or image (*.mp4 *.mov *.mkv *.png *.jpg *.jpeg *.webp *.bmp)")
         
         ext = os.path.splitext(videoPathName[0])
 
-        if not os.path.exists(videoPathName[0]) or ext[1] not in EXTENTIONS:
+        if not os.path.exists(videoPathName[0]) or ext[1].lower() not in EXTENTIONS+IMAGE_EXTENTIONS:
             return
 
         self.videoPath.setText(videoPathName[0])
         self.app_ASCIIXEL.path = videoPathName[0]
 
+    # Use the path typed, a video, an image, a camera index such as 0 or a stream URL
+    def onPathEdited(self) -> None:
+        path = self.videoPath.text().strip()
+        if is_live(path) or os.path.isfile(path):
+            self.app_ASCIIXEL.path = path
+
     # Modify ASCIIXEL when any checkbox change
     def onStatesChanged(self) -> None:
         self.app_ASCIIXEL.display_original = self.displayOrigCheckBox.isChecked()
@@ -154,6 +241,25 @@ class MainWindow(QMainWindow):
             self.videoOrigLabel.clear()
 
         self.app_ASCIIXEL.reverse_colour = self.reverseColourCheckBox.isChecked()
+        self.app_ASCIIXEL.incremental = self.incrementalCheckBox.isChecked()
+        self.app_ASCIIXEL.calibrated_glyphs = self.calibratedCheckBox.isChecked()
+        self.app_ASCIIXEL.shape_matching = self.shapeMatchingCheckBox.isChecked()
+        self.instanced_thread.real_time = self.realTimeCheckBox.isChecked()
+
+        if self.profilingCheckBox.isChecked() and self.app_ASCIIXEL.profiler is None:
+            self.app_ASCIIXEL.enable_profiling()
+        elif not self.profilingCheckBox.isChecked():
+            self.app_ASCIIXEL.disable_profiling()
+            self.statsLabel.hide()
+
+    # Save the stage timings of the last frames as a trace file
+    def saveTrace(self) -> None:
+        if self.app_ASCIIXEL.profiler is None: return
+
+        tracePathName = QFileDialog.getSaveFileName(caption="Save Trace", dir="trace.json", filter="Trace (*.json)")
+        if not tracePathName[0]: return
+
+        self.app_ASCIIXEL.profiler.dump_trace(tracePathName[0])
 
     # Modify the output type
     def onTypeIndexChanged(self, index) -> None:
@@ -171,6 +277,18 @@ class MainWindow(QMainWindow):
     def onColourLevelValueChanged(self, value) -> None:
         self.app_ASCIIXEL.colour_lvl = value
 
+    # Modify the quantisation of the colours
+    def onQuantiseIndexChanged(self, index) -> None:
+        self.app_ASCIIXEL.quantise = QuantiseMode(index)
+
+    # Modify the named palette used by the PALETTE quantisation
+    def onPaletteChanged(self, text) -> None:
+        self.app_ASCIIXEL.palette = text
+
+    # Modify the size of the palettes fitted per scene
+    def onNbColoursValueChanged(self, value) -> None:
+        self.app_ASCIIXEL.nb_colours = value
+
     # Start ASCIIXEL app in a thread without saving the output
     def clickPreview(self) -> None:
         self.clickCancel()
@@ -200,22 +318,45 @@ class MainWindow(QMainWindow):
         # Kill thread if it is running
         if self.instanced_thread.isRunning():
             self.instanced_thread.stop()
+            self.instanced_thread.wait()
 
-    # Slot for communicating with the thread worker to get the result image
-    @Slot(QPixmap)
-    def updateResultImageField(self, img):
-        self.videoLabel.setPixmap(img)
-
-    # Slot for communicating with the thread worker to get the original image
-    @Slot(QPixmap)
-    def updateOrigImageField(self, img):
-        self.videoOrigLabel.setPixmap(img)
+    # Slot for communicating with the thread worker to get the latest result and original images
+    @Slot()
+    def updateImageFields(self):
+        frame = self.instanced_thread.latest_frame.take()
+        if frame is None: return
+
+        # The pixmaps are made here as they can only be used on the GUI thread, then the worker can reuse the arrays
+        img, img_orig, capture_time = frame
+        self.videoLabel.setPixmap(QPixmap.fromImage(array_to_qimage(img)))
+        if img_orig is not None:
+            self.videoOrigLabel.setPixmap(QPixmap.fromImage(array_to_qimage(img_orig)))
+        self.instanced_thread.latest_frame.release()
+
+        # Time from the capture of a live frame to its display
+        live = self.app_ASCIIXEL.live
+        if capture_time is not None and live is not None:
+            live.add_latency('shown', capture_time)
+
+    # Slot for communicating with the thread worker to get the achieved and target frame rates
+    @Slot(str)
+    def updateFpsField(self, text):
+        self.fpsLabel.setText(text)
+
+    # Slot for communicating with the thread worker to get the stage timings
+    @Slot(str)
+    def updateStatsField(self, text):
+        if not self.profilingCheckBox.isChecked(): return
+        self.statsLabel.setText(text)
+        self.statsLabel.adjustSize()
+        self.statsLabel.show()
 
 
 # Create signal type
 class ImgSignals(QObject):
-    signal_img = Signal(QPixmap)
-    signal_img_orig = Signal(QPixmap)
+    signal_frame = Signal()
+    signal_fps = Signal(str)
+    signal_stats = Signal(str)
 
 # Create the Worker Thread
 class WorkerThread(QThread):
@@ -226,29 +367,82 @@ class WorkerThread(QThread):
 
         self.exit = False
 
+        # Pace the previews to the frame rate of the video, recordings always render every frame
+        self.real_time = True
+
+        # Only the latest frame is handed to the GUI
+        self.latest_frame = LatestFrame()
+
         # Instantiate signals and connect signals to slots
         self.signals = ImgSignals()
-        self.signals.signal_img.connect(parent.updateResultImageField)
-        self.signals.signal_img_orig.connect(parent.updateOrigImageField)
+        self.signals.signal_frame.connect(parent.updateImageFields)
+        self.signals.signal_fps.connect(parent.updateFpsField)
+        self.signals.signal_stats.connect(parent.updateStatsField)
     
     def run(self) -> None:
         if self.app_ASCIIXEL == None: return
 
+        # A live source is already paced by its capture
+        live = self.app_ASCIIXEL.live
+        pacer = FramePacer(self.app_ASCIIXEL.rec_fps, paced=self.real_time and not self.app_ASCIIXEL.record and live is None)
+
+        last_stats = 0.0
         while not self.app_ASCIIXEL.finish:
             if self.exit:
                 self.exit = False
+                # A live source has no end, stopping it ends its recording
+                if live is not None: break
+                self.app_ASCIIXEL.cancel_record()
                 return
 
-            self.app_ASCIIXEL.runStep()
-            img = QPixmap.fromImage(ImageQt(self.app_ASCIIXEL.out_image))
-            self.signals.signal_img.emit(img)
+            # Drop the frames the preview is already late for
+            late = pacer.frames_late()
+            if late:
+                pacer.skip(self.app_ASCIIXEL.skip_frames(late))
 
-            if self.app_ASCIIXEL.display_original:
-                pil_img_orig = Image.fromarray(self.app_ASCIIXEL.cv2_image).convert('RGB')
-                img_orig = QPixmap.fromImage(ImageQt(pil_img_orig))
-                self.signals.signal_img_orig.emit(img_orig)
+            # Draw into the output array the GUI is not reading
+            buffer = self.app_ASCIIXEL.swap_output()
+            self.latest_frame.acquire(buffer)
 
-        self.app_ASCIIXEL.record_video()
+            self.app_ASCIIXEL.runStep()
+            if self.app_ASCIIXEL.finish: break
+
+            # The arrays are handed over as they are, the styles drawn with PIL give a new array every frame
+            img = self.app_ASCIIXEL.frame_array()
+            if not self.app_ASCIIXEL.draws_array(): buffer = None
+            img_orig = self.app_ASCIIXEL.original_image() if self.app_ASCIIXEL.display_original else None
+            self.app_ASCIIXEL.mark('qt')
+
+            pacer.wait()
+            capture_time = live.frame_time if live is not None else None
+            if self.latest_frame.publish((img, img_orig, capture_time), buffer):
+                self.signals.signal_frame.emit()
+            pacer.tick()
+
+            # Refresh the frame rates and the stage timings twice per second
+            if time.perf_counter()-last_stats < 0.5: continue
+            last_stats = time.perf_counter()
+            self.signals.signal_fps.emit(pacer.summary())
+
+            profiler = self.app_ASCIIXEL.profiler
+            if profiler is not None:
+                summary = profiler.summary()
+                if self.app_ASCIIXEL.delta is not None:
+                    summary += f'\nchanged    {self.app_ASCIIXEL.changed_ratio:7.1%}'
+                if self.app_ASCIIXEL.prefetcher is not None:
+                    summary += '\n' + self.app_ASCIIXEL.prefetcher.summary()
+                if self.app_ASCIIXEL.cache is not None:
+                    summary += '\n' + self.app_ASCIIXEL.cache.summary()
+                if live is not None:
+                    summary += '\n' + live.summary()
+                self.signals.signal_stats.emit(summary)
+
+        self.signals.signal_fps.emit(pacer.summary())
+        status = self.app_ASCIIXEL.record_video()
+        self.app_ASCIIXEL.close_live()
+        # A failed recording is shown in place of the frame rates
+        if status:
+            self.signals.signal_fps.emit(f'ffmpeg exited with status {status}')
     
     @Slot()
     def stop(self) -> None:
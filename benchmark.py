@@ -0,0 +1,303 @@
+from utils import OutputType, QuantiseMode, RenderEngine, accelerate_conversion_ascii, accelerate_conversion_ascii_colour, accelerate_conversion_pixel, accelerate_conversion_ascii_grid, accelerate_conversion_ascii_colour_grid, accelerate_conversion_pixel_grid
+from recorder import FFMPEG, FFmpegRecorder
+from ASCIIXEL import ASCIIXEL
+from io import BytesIO
+import numpy as np
+import statistics
+import itertools
+import platform
+import argparse
+import tempfile
+import subprocess
+import shutil
+import json
+import time
+import sys
+import os
+
+
+##### Synthetic Frames #####
+
+# Deterministic BGR frame with gradients, hard edges and noise, so every palette entry and colour level shows up
+def synthetic_frame(width: int, height: int, seed: int =0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    frame[..., 0] = x*255//max(1, width-1)
+    frame[..., 1] = y*255//max(1, height-1)
+    frame[..., 2] = ((x//32 + y//32) % 2)*255
+
+    # Noisy block in the middle, as found in textured footage
+    frame[height//4:height//2, width//4:width//2] = rng.integers(0, 256, (height//2-height//4, width//2-width//4, 3), dtype=np.uint8)
+    return frame
+
+
+##### Cases #####
+
+RESOLUTIONS = [(640, 360), (1280, 720), (1920, 1080)]
+ELEMENT_SIZES = [4, 8, 12]
+PALETTES = [0, 2, 4]
+COLOUR_LEVELS = [2, 8, 32]
+QUANTISATIONS = [(QuantiseMode.PALETTE, 'pico8', 16), (QuantiseMode.PALETTE, 'websafe', 16), (QuantiseMode.KMEANS, 'pico8', 16), (QuantiseMode.MEDIAN_CUT, 'pico8', 256)]
+
+# Settings of every benchmarked case
+# Resolutions and element sizes are crossed with every style, palettes and colour levels are swept on their own
+def benchmark_cases(quick: bool =False) -> list:
+    resolutions = RESOLUTIONS[:1] if quick else RESOLUTIONS
+    element_sizes = ELEMENT_SIZES[1:2] if quick else ELEMENT_SIZES
+
+    cases = []
+    for resolution, element_size, output_type, engine in itertools.product(resolutions, element_sizes, OutputType, RenderEngine):
+        cases.append({'resolution': resolution, 'element_size': element_size, 'output_type': output_type, 'engine': engine, 'ascii_set': 2, 'colour_lvl': 8})
+
+    if not quick:
+        for ascii_set, engine in itertools.product(PALETTES, RenderEngine):
+            cases.append({'resolution': (1280, 720), 'element_size': 8, 'output_type': OutputType.ASCII, 'engine': engine, 'ascii_set': ascii_set, 'colour_lvl': 8})
+        for colour_lvl, engine in itertools.product(COLOUR_LEVELS, RenderEngine):
+            cases.append({'resolution': (1280, 720), 'element_size': 8, 'output_type': OutputType.ASCII_COLOUR, 'engine': engine, 'ascii_set': 2, 'colour_lvl': colour_lvl})
+        for (quantise, palette, nb_colours), engine in itertools.product(QUANTISATIONS, RenderEngine):
+            cases.append({'resolution': (1280, 720), 'element_size': 8, 'output_type': OutputType.ASCII_COLOUR, 'engine': engine, 'ascii_set': 2, 'colour_lvl': 8, 'quantise': quantise, 'palette': palette, 'nb_colours': nb_colours})
+
+    # Shape matching against the luma alone, the glyphs are matched in the prepare stage
+    for element_size, output_type in itertools.product(element_sizes, (OutputType.ASCII, OutputType.ASCII_COLOUR)):
+        cases.append({'resolution': resolutions[-1], 'element_size': element_size, 'output_type': output_type, 'engine': RenderEngine.NUMPY, 'ascii_set': 2, 'colour_lvl': 8, 'shape_matching': True})
+
+    # Drop the duplicates of the sweeps
+    unique = {case_name(case): case for case in cases}
+    return list(unique.values())
+
+def case_name(case: dict) -> str:
+    width, height = case['resolution']
+    name = f'{width}x{height}/el{case["element_size"]}/{case["output_type"].name}/{case["engine"].name}'
+    if case['output_type'] != OutputType.PIXEL_ART:
+        name += f'/pal{case["ascii_set"]}'
+        if case.get('shape_matching'):
+            name += '/shape'
+    if case['output_type'] != OutputType.ASCII:
+        quantise = case.get('quantise', QuantiseMode.UNIFORM)
+        if quantise == QuantiseMode.UNIFORM:
+            name += f'/lvl{case["colour_lvl"]}'
+        elif quantise == QuantiseMode.PALETTE:
+            name += f'/{case["palette"]}'
+        else:
+            name += f'/{quantise.name.lower()}{case["nb_colours"]}'
+    return name
+
+
+##### Stages #####
+
+# Call of the conversion kernel used by the renderer of an ASCIIXEL already set up
+def kernel_stage(app: ASCIIXEL):
+    if app.engine == RenderEngine.PIL:
+        if app.output_type == OutputType.ASCII:
+            return lambda: accelerate_conversion_ascii(app.grayscale, app.WIDTH, app.HEIGHT, app.char_lut, app.atlas.blank)
+        if app.output_type == OutputType.ASCII_COLOUR:
+            return lambda: accelerate_conversion_ascii_colour(app.quantiser.apply(app.image), app.grayscale, app.WIDTH, app.HEIGHT, app.char_lut, app.colour_lut, app.atlas.blank)
+        return lambda: accelerate_conversion_pixel(app.quantiser.apply(app.image), app.WIDTH, app.HEIGHT, app.colour_lut)
+
+    if app.output_type == OutputType.ASCII:
+        return lambda: accelerate_conversion_ascii_grid(app.grayscale, app.char_lut, app.char_grid)
+    if app.output_type == OutputType.ASCII_COLOUR:
+        return lambda: accelerate_conversion_ascii_colour_grid(app.quantiser.apply(app.image), app.grayscale, app.char_lut, app.colour_lut, app.atlas.blank, app.char_grid, app.colour_grid)
+    return lambda: accelerate_conversion_pixel_grid(app.quantiser.apply(app.image), app.colour_lut, app.colour_grid, app.drawn_grid)
+
+# Time a stage, the first call is left out so that numba compilation and caches do not count
+def time_stage(stage, repeat: int) -> dict:
+    stage()
+
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        stage()
+        durations.append((time.perf_counter()-start)*1000)
+
+    return {
+        'median_ms': statistics.median(durations),
+        'min_ms': min(durations),
+        'mean_ms': statistics.fmean(durations),
+        'runs': repeat
+    }
+
+# Time every stage of one case
+def run_case(case: dict, repeat: int, record: bool) -> dict:
+    width, height = case['resolution']
+    frame = synthetic_frame(width, height)
+
+    app = ASCIIXEL(ascii_set=case['ascii_set'], element_size=case['element_size'], output_type=case['output_type'], colour_lvl=case['colour_lvl'], engine=case['engine'], quantise=case.get('quantise', QuantiseMode.UNIFORM), palette=case.get('palette', 'pico8'), nb_colours=case.get('nb_colours', 16), shape_matching=case.get('shape_matching', False))
+    app.setup_render(case['resolution'])
+    app.prepare_image(frame)
+
+    stages = {
+        'prepare': lambda: app.prepare_image(frame),
+        'kernel': kernel_stage(app),
+        'draw': app.draw_frame,
+        'frame': app.frame_array,
+        'png': lambda: app.frame_image().save(BytesIO(), 'PNG')
+    }
+
+    results = {name: time_stage(stage, repeat) for name, stage in stages.items()}
+
+    # Feed the frame to a real encoder, the time includes waiting for ffmpeg when it is behind
+    if record:
+        folder = tempfile.mkdtemp()
+        recorder = FFmpegRecorder(os.path.join(folder, 'benchmark.mp4'), width, height, 30)
+        recorder.start()
+        results['pipe'] = time_stage(lambda: recorder.write(app.frame_array()), repeat)
+        recorder.close()
+        shutil.rmtree(folder, ignore_errors=True)
+
+    return results
+
+
+##### Startup #####
+
+# Run in a fresh interpreter: time the imports, the kernel compilation or cache loading and the first frame
+STARTUP_PROBE = '''
+import time
+start = time.perf_counter()
+from ASCIIXEL import ASCIIXEL
+from benchmark import synthetic_frame
+import utils
+imported = time.perf_counter()
+utils.warm_up_kernels(background=False)
+warmed = time.perf_counter()
+app = ASCIIXEL(output_type=utils.OutputType.{output_type})
+app.setup_render(({width}, {height}))
+app.prepare_image(synthetic_frame({width}, {height}))
+app.draw_frame()
+app.frame_array()
+first_frame = time.perf_counter()
+print(imported-start, warmed-imported, first_frame-warmed, utils.kernels_compiled())
+'''
+
+# Startup-to-first-frame of a new process, in milliseconds
+# The numba cache goes to an empty folder so that the first run compiles and the second one loads from the disk
+def run_startup(resolution: tuple =(1280, 720), output_type: OutputType =OutputType.ASCII) -> dict:
+    code = STARTUP_PROBE.format(output_type=output_type.name, width=resolution[0], height=resolution[1])
+    cache_dir = tempfile.mkdtemp()
+    runs = [('cold', {'NUMBA_CACHE_DIR': cache_dir}), ('cached', {'NUMBA_CACHE_DIR': cache_dir}), ('numpy', {'ASCIIXEL_NO_NUMBA': '1'})]
+
+    results = {}
+    for name, env in runs:
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', code], env={**os.environ, **env}, cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True).stdout
+        total = time.perf_counter()-start
+
+        import_s, warm_up_s, first_frame_s, compiled = output.split()[-4:]
+        results[name] = {
+            'total_ms': total*1000,
+            'import_ms': float(import_s)*1000,
+            'warm_up_ms': float(warm_up_s)*1000,
+            'first_frame_ms': float(first_frame_s)*1000,
+            'compiled': compiled == 'True'
+        }
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    return results
+
+def print_startup(startup: dict) -> None:
+    print(f'{"startup":<8} {"total":>10} {"import":>10} {"warm-up":>10} {"1st frame":>10}')
+    for name, timing in startup.items():
+        print(f'{name:<8} {timing["total_ms"]:>8.0f}ms {timing["import_ms"]:>8.0f}ms {timing["warm_up_ms"]:>8.0f}ms {timing["first_frame_ms"]:>8.0f}ms')
+
+
+##### Results #####
+
+def numba_version() -> str:
+    try:
+        import numba
+    except ImportError:
+        return None
+    return numba.__version__
+
+def run_benchmark(cases: list, repeat: int, record: bool) -> dict:
+    results = []
+    for index, case in enumerate(cases):
+        name = case_name(case)
+        print(f'[{index+1}/{len(cases)}] {name}', flush=True)
+        for stage, timing in run_case(case, repeat, record).items():
+            params = {**case, 'resolution': list(case['resolution']), 'output_type': case['output_type'].name, 'engine': case['engine'].name}
+            if 'quantise' in case:
+                params['quantise'] = case['quantise'].name
+            results.append({'case': name, 'stage': stage, 'params': params, **timing})
+
+    return {
+        'meta': {
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'numba': numba_version(),
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count()
+        },
+        'results': results
+    }
+
+# Compare the medians with a baseline, return the rows of the comparison and the number of regressions
+# Changes smaller than min_ms are timer noise and never reported
+def compare(current: dict, baseline: dict, threshold: float, min_ms: float =0.05) -> tuple:
+    previous = {(result['case'], result['stage']): result for result in baseline['results']}
+
+    rows = []
+    nb_regression = 0
+    for result in current['results']:
+        key = (result['case'], result['stage'])
+        if key not in previous: continue
+
+        ratio = result['median_ms']/previous[key]['median_ms'] if previous[key]['median_ms'] else float('inf')
+        verdict = ''
+        if abs(result['median_ms']-previous[key]['median_ms']) < min_ms:
+            pass
+        elif ratio > 1+threshold:
+            verdict = 'REGRESSION'
+            nb_regression += 1
+        elif ratio < 1-threshold:
+            verdict = 'faster'
+        rows.append((result['case'], result['stage'], previous[key]['median_ms'], result['median_ms'], ratio, verdict))
+    return rows, nb_regression
+
+def print_comparison(rows: list) -> None:
+    print(f'{"case":<48} {"stage":<8} {"baseline":>10} {"current":>10} {"change":>8}')
+    for case, stage, before, after, ratio, verdict in rows:
+        print(f'{case:<48} {stage:<8} {before:>8.3f}ms {after:>8.3f}ms {(ratio-1)*100:>+7.1f}% {verdict}')
+
+
+def main(argv: list =None) -> int:
+    parser = argparse.ArgumentParser(description='Time every conversion and render stage of ASCIIXEL on synthetic frames.')
+    parser.add_argument('--output', default='benchmark.json', help='JSON file receiving the results')
+    parser.add_argument('--baseline', help='JSON results of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative change of the median reported as a regression')
+    parser.add_argument('--min-ms', type=float, default=0.05, help='smallest change of the median in milliseconds reported')
+    parser.add_argument('--repeat', type=int, default=10, help='timed runs of every stage')
+    parser.add_argument('--quick', action='store_true', help='only the smallest resolution and one element size')
+    parser.add_argument('--filter', default='', help='only the cases whose name contains this text')
+    parser.add_argument('--no-record', dest='record', action='store_false', help='skip the ffmpeg pipe stage')
+    parser.add_argument('--fail-on-regression', action='store_true', help='exit with an error code if a stage regressed')
+    parser.add_argument('--no-startup', dest='startup', action='store_false', help='skip the startup-to-first-frame measurement')
+    args = parser.parse_args(argv)
+
+    cases = [case for case in benchmark_cases(args.quick) if args.filter in case_name(case)]
+    record = args.record and shutil.which(FFMPEG) is not None
+    current = run_benchmark(cases, args.repeat, record)
+    if args.startup:
+        current['startup'] = run_startup()
+        print_startup(current['startup'])
+
+    with open(args.output, 'w') as file:
+        json.dump(current, file, indent=2)
+    print(f'Results written to {args.output}')
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        rows, nb_regression = compare(current, baseline, args.threshold, args.min_ms)
+        print_comparison(rows)
+        print(f'{nb_regression} regression(s) over {len(rows)} stages')
+        if nb_regression and args.fail_on_regression:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,161 @@
+from collections import OrderedDict
+import numpy as np
+import threading
+import hashlib
+import os
+
+
+# Bytes read at each end of a file to identify its content
+DIGEST_CHUNK = 2**20
+
+
+##### Cache Keys #####
+
+# Identify a file by its content rather than its path: its size and the bytes at both ends
+# Reading the whole file would cost as much as decoding it, the ends change with any re-encode or edit
+def source_digest(path: str) -> str:
+    digest = hashlib.sha1()
+    size = os.path.getsize(path)
+    digest.update(str(size).encode())
+    with open(path, 'rb') as file:
+        digest.update(file.read(DIGEST_CHUNK))
+        if size > DIGEST_CHUNK:
+            file.seek(max(DIGEST_CHUNK, size-DIGEST_CHUNK))
+            digest.update(file.read(DIGEST_CHUNK))
+    return digest.hexdigest()
+
+# Key of an entry from the values it depends on
+def cache_key(*parts) -> str:
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+##### Render Cache #####
+
+# Tuples of arrays kept under a budget in bytes, the least recently used are evicted first
+# The entries evicted from memory are written to the folder when there is one, itself under a budget,
+# so that they are found again by later runs on the same clip
+# The arrays are copied in and must not be modified once out, get and put can be called from several threads
+class RenderCache:
+    def __init__(self, max_bytes: int =512*2**20, folder: str =None, max_disk_bytes: int =4*2**30) -> None:
+        self.max_bytes = max_bytes
+        self.folder = folder
+        self.max_disk_bytes = max_disk_bytes
+
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.nb_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        # Files of the folder from the least to the most recently used
+        self.files = OrderedDict()
+        self.disk_bytes = 0
+        if folder is not None:
+            os.makedirs(folder, exist_ok=True)
+            names = [name for name in os.listdir(folder) if name.endswith('.npz')]
+            for name in sorted(names, key=lambda name: os.path.getmtime(os.path.join(folder, name))):
+                self.files[name[:-4]] = os.path.getsize(os.path.join(folder, name))
+                self.disk_bytes += self.files[name[:-4]]
+
+    def file_path(self, key: str) -> str:
+        return os.path.join(self.folder, f'{key}.npz')
+
+    # Arrays stored under the key, None if they are not cached
+    def get(self, key: str) -> tuple:
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+
+            if key not in self.files:
+                self.misses += 1
+                return None
+
+            # Bring the entry back in memory from the folder
+            try:
+                with np.load(self.file_path(key)) as file:
+                    arrays = tuple(file[f'arr_{index}'] for index in range(len(file.files)))
+            except (OSError, ValueError):
+                self.remove_file(key)
+                self.misses += 1
+                return None
+
+            os.utime(self.file_path(key))
+            self.files.move_to_end(key)
+            self.disk_hits += 1
+            self.insert(key, arrays)
+            return arrays
+
+    def put(self, key: str, arrays: tuple) -> None:
+        arrays = tuple(np.array(array) for array in arrays)
+        with self.lock:
+            if key in self.entries:
+                self.nb_bytes -= sum(array.nbytes for array in self.entries.pop(key))
+            self.insert(key, arrays)
+
+    def insert(self, key: str, arrays: tuple) -> None:
+        size = sum(array.nbytes for array in arrays)
+        if size > self.max_bytes:
+            self.spill(key, arrays)
+            return
+
+        self.entries[key] = arrays
+        self.nb_bytes += size
+        while self.nb_bytes > self.max_bytes:
+            old_key, old_arrays = self.entries.popitem(last=False)
+            self.nb_bytes -= sum(array.nbytes for array in old_arrays)
+            self.spill(old_key, old_arrays)
+
+    # Write an entry to the folder, removing the least recently used files over the budget
+    def spill(self, key: str, arrays: tuple) -> None:
+        if self.folder is None or key in self.files: return
+
+        # Written under another name first so that a reader never sees a partial file
+        path = self.file_path(key)
+        with open(f'{path}.tmp', 'wb') as file:
+            np.savez(file, *arrays)
+        os.replace(f'{path}.tmp', path)
+
+        self.files[key] = os.path.getsize(path)
+        self.disk_bytes += self.files[key]
+        while self.disk_bytes > self.max_disk_bytes and len(self.files) > 1:
+            self.remove_file(next(iter(self.files)))
+
+    def remove_file(self, key: str) -> None:
+        self.disk_bytes -= self.files.pop(key, 0)
+        try:
+            os.remove(self.file_path(key))
+        except OSError:
+            pass
+
+    # Write the entries still only in memory to the folder, for the next runs
+    def flush(self) -> None:
+        with self.lock:
+            for key, arrays in self.entries.items():
+                self.spill(key, arrays)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.nb_bytes = 0
+
+    def stats(self) -> dict:
+        lookups = max(1, self.hits+self.disk_hits+self.misses)
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_ratio': (self.hits+self.disk_hits)/lookups,
+            'entries': len(self.entries),
+            'memory_mb': self.nb_bytes/2**20,
+            'disk_mb': self.disk_bytes/2**20
+        }
+
+    def summary(self) -> str:
+        stats = self.stats()
+        return (
+            f'cache      {stats["hit_ratio"]:.0%} hits ({stats["hits"]} memory, {stats["disk_hits"]} disk, {stats["misses"]} misses), '
+            f'{stats["memory_mb"]:.0f} MB memory, {stats["disk_mb"]:.0f} MB disk'
+        )
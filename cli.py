@@ -0,0 +1,317 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from utils import OutputType, QuantiseMode, RecordBackend, RenderEngine, is_image
+from quantise import PALETTES
+from ASCIIXEL import ASCIIXEL
+from cache import RenderCache
+from profiling import peak_rss_mb
+from live import is_live
+from images import IMAGE_FORMATS, collect_images, convert_batch, is_pattern, plan_batches
+import multiprocessing as mp
+import argparse
+import json
+import time
+import csv
+import sys
+import os
+
+
+##### Settings Parsing #####
+
+def parse_bool(value) -> bool:
+    if isinstance(value, bool): return value
+    if str(value).strip().lower() in ('1', 'true', 'yes', 'y', 'on'): return True
+    if str(value).strip().lower() in ('0', 'false', 'no', 'n', 'off', ''): return False
+    raise ValueError(f'Invalid boolean: {value}')
+
+# Resolution given as "WIDTHxHEIGHT" or as a [width, height] list
+def parse_resolution(value) -> tuple:
+    if value is None or value == '': return None
+    if isinstance(value, (list, tuple)): return int(value[0]), int(value[1])
+    width, height = str(value).lower().split('x')
+    return int(width), int(height)
+
+# Enum given by name or by value
+def enum_parser(enum: type):
+    def parse(value):
+        if isinstance(value, enum): return value
+        if isinstance(value, int) or str(value).isdigit(): return enum(int(value))
+        return enum[str(value).strip().upper()]
+    parse.__name__ = enum.__name__
+    return parse
+
+# Parsers of the ASCIIXEL settings, shared by the command line and the manifests
+SETTINGS_PARSERS = {
+    'ascii_set': int,
+    'element_size': int,
+    'display_original': parse_bool,
+    'resolution': parse_resolution,
+    'record': parse_bool,
+    'reverse_colour': parse_bool,
+    'output_type': enum_parser(OutputType),
+    'colour_lvl': int,
+    'engine': enum_parser(RenderEngine),
+    'record_backend': enum_parser(RecordBackend),
+    'nb_workers': int,
+    'incremental': parse_bool,
+    'full_redraw_ratio': float,
+    'prefetch': int,
+    'prefetch_mb': int,
+    'quantise': enum_parser(QuantiseMode),
+    'palette': str,
+    'nb_colours': int,
+    'start': float,
+    'end': float,
+    'segment_frames': int,
+    'memory_mb': int,
+    'calibrated_glyphs': parse_bool,
+    'shape_matching': parse_bool
+}
+
+# Convert the raw settings of a job, unknown keys are rejected
+def parse_settings(raw: dict) -> dict:
+    settings = {}
+    for key, value in raw.items():
+        if key == 'path':
+            settings['path'] = str(value)
+        elif key in SETTINGS_PARSERS:
+            if value is None or value == '': continue
+            settings[key] = SETTINGS_PARSERS[key](value)
+        else:
+            raise ValueError(f'Unknown setting: {key}')
+    return settings
+
+# Load the jobs of a JSON list of objects or of a CSV file with a header, each job needs a path
+def load_manifest(path: str) -> list:
+    with open(path, newline='') as file:
+        if path.lower().endswith('.csv'):
+            jobs = list(csv.DictReader(file))
+        else:
+            jobs = json.load(file)
+
+    for job in jobs:
+        if not job.get('path'):
+            raise ValueError(f'Job without path in {path}: {job}')
+    return jobs
+
+
+##### Jobs #####
+
+# Cache of the process, shared by the jobs it runs so that jobs on the same clip reuse each other's work
+process_cache = None
+
+def get_cache(cache_mb: int, cache_dir: str =None, cache_disk_mb: int =4096) -> RenderCache:
+    global process_cache
+    if not cache_mb and not cache_dir: return None
+    if process_cache is None:
+        process_cache = RenderCache(cache_mb*2**20, cache_dir, cache_disk_mb*2**20)
+    return process_cache
+
+# Check if the output of a job is newer than its input
+def is_up_to_date(app: ASCIIXEL) -> bool:
+    output = app.output_path()
+    return os.path.exists(output) and os.path.getmtime(output) >= os.path.getmtime(app.path)
+
+# Render one job, return its report
+def run_job(settings: dict, force: bool =False, cache: dict =None) -> dict:
+    app = ASCIIXEL(**settings, cache=get_cache(**cache) if cache else None)
+    app.setup_output_name()
+    report = {'path': app.path, 'output': app.output_path(), 'status': 'done', 'frames': 0, 'time': 0.0, 'fps': 0.0}
+
+    if not os.path.exists(app.path) and not is_live(app.path):
+        report['status'] = 'failed'
+        report['error'] = 'input not found'
+        return report
+
+    if app.record and not force and not is_live(app.path) and is_up_to_date(app):
+        report['status'] = 'skipped'
+        return report
+
+    start = time.perf_counter()
+    try:
+        code = app.run()
+    except Exception as error:
+        report['status'] = 'failed'
+        report['error'] = str(error)
+        return report
+
+    if app.live is not None and not app.live.nb_captured:
+        report['status'] = 'failed'
+        report['error'] = 'no frame captured'
+        return report
+
+    if app.cache is not None:
+        app.cache.flush()
+        report['cache'] = app.cache.stats()
+
+    report['time'] = time.perf_counter()-start
+    report['frames'] = app.nb_frame
+    report['fps'] = app.nb_frame/report['time'] if report['time'] else 0.0
+    if app.delta is not None:
+        report['changed'] = app.delta.mean_changed_ratio()
+    if app.prefetcher is not None:
+        report['prefetch'] = app.prefetcher.stats()
+    if app.live is not None:
+        report['live'] = app.live.stats()
+    if peak_rss_mb() is not None:
+        report['peak_rss_mb'] = peak_rss_mb()
+    if code:
+        report['status'] = 'failed'
+        report['error'] = f'ffmpeg exited with status {code}'
+    return report
+
+def format_report(report: dict, index: int, nb_job: int) -> str:
+    line = f'[{index}/{nb_job}] {report["path"]} -> {report["output"]}: '
+    if report['status'] == 'skipped':
+        return line + 'skipped (up to date)'
+    if report['status'] == 'failed':
+        return line + f'failed ({report["error"]})'
+    if report.get('image'):
+        return line + f'{report["time"]*1000:.0f} ms'
+    line += f'{report["frames"]} frames in {report["time"]:.2f} s ({report["fps"]:.1f} fps)'
+    if 'changed' in report:
+        line += f', {report["changed"]:.1%} of the cells changed per frame'
+    if 'prefetch' in report:
+        prefetch = report['prefetch']
+        line += f', {prefetch["bound"]} (decode {prefetch["decode_ms"]+prefetch["prepare_ms"]:.1f} ms, render waited {prefetch["render_wait_ms"]:.1f} ms per frame)'
+    if 'cache' in report:
+        line += f', {report["cache"]["hit_ratio"]:.0%} cache hits'
+    if 'live' in report:
+        live = report['live']
+        line += f', {live["dropped"]} of {live["captured"]} captured frames dropped'
+        if 'recorded_ms' in live:
+            line += f' (capture to recording {live["recorded_ms"]:.1f} ms, p95 {live["recorded_p95_ms"]:.1f} ms)'
+    if 'peak_rss_mb' in report:
+        line += f', peak memory {report["peak_rss_mb"]:.0f} MB'
+    return line
+
+# Run the jobs in this process or on a pool of processes, print a line per job as they finish
+def run_jobs(jobs: list, nb_process: int =1, force: bool =False, cache: dict =None) -> list:
+    reports = []
+    start = time.perf_counter()
+
+    if nb_process <= 1:
+        for settings in jobs:
+            reports.append(run_job(settings, force, cache))
+            print(format_report(reports[-1], len(reports), len(jobs)), flush=True)
+    else:
+        with ProcessPoolExecutor(max_workers=nb_process, mp_context=mp.get_context('spawn')) as pool:
+            futures = [pool.submit(run_job, settings, force, cache) for settings in jobs]
+            for future in as_completed(futures):
+                reports.append(future.result())
+                print(format_report(reports[-1], len(reports), len(jobs)), flush=True)
+
+    print(format_summary(reports, time.perf_counter()-start), flush=True)
+    return reports
+
+def format_summary(reports: list, duration: float) -> str:
+    nb_done = sum(report['status'] == 'done' for report in reports)
+    nb_skipped = sum(report['status'] == 'skipped' for report in reports)
+    return f'{nb_done} done, {nb_skipped} skipped, {len(reports)-nb_done-nb_skipped} failed in {duration:.2f} s'
+
+# Convert the images in batches of the same size, each batch on one process so that its renderer is prepared once
+def run_images(images: list, settings: dict, nb_process: int =1, force: bool =False, output_dir: str ='outputs', image_format: str ='png') -> list:
+    reports = []
+    start = time.perf_counter()
+
+    # Smaller batches keep every process busy until the end
+    batch_size = max(1, min(32, len(images)//max(1, 4*nb_process)))
+    batches = plan_batches(images, settings.get('resolution'), batch_size)
+
+    if nb_process <= 1:
+        for batch in batches:
+            for report in convert_batch(settings, batch, output_dir, image_format, force):
+                reports.append(report)
+                print(format_report(report, len(reports), len(images)), flush=True)
+    else:
+        with ProcessPoolExecutor(max_workers=nb_process, mp_context=mp.get_context('spawn')) as pool:
+            futures = [pool.submit(convert_batch, settings, batch, output_dir, image_format, force) for batch in batches]
+            for future in as_completed(futures):
+                for report in future.result():
+                    reports.append(report)
+                    print(format_report(report, len(reports), len(images)), flush=True)
+
+    print(format_summary(reports, time.perf_counter()-start), flush=True)
+    return reports
+
+
+##### Command Line #####
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='Convert videos with ASCIIXEL without the GUI.')
+    parser.add_argument('inputs', nargs='*', help='videos, images, folders of images, patterns of images, camera indices or stream URLs to convert')
+    parser.add_argument('--manifest', help='JSON or CSV list of jobs, each with a path and its own settings')
+    parser.add_argument('--jobs', type=int, default=1, help='number of jobs rendered at the same time')
+    parser.add_argument('--force', action='store_true', help='render the jobs even if their output is up to date')
+    parser.add_argument('--cache-mb', dest='cache_mb', type=int, default=0, help='memory budget in MB of the cache of cells and rendered frames, shared by the jobs of a process')
+    parser.add_argument('--cache-dir', dest='cache_dir', help='folder keeping the cache between runs')
+    parser.add_argument('--output-dir', dest='output_dir', default='outputs', help='folder of the converted images, mirroring the folders given')
+    parser.add_argument('--image-format', dest='image_format', choices=list(IMAGE_FORMATS), default='png', help='format of the converted images')
+    parser.add_argument('--recursive', action='store_true', help='also convert the images in the subfolders of the folders given')
+    parser.add_argument('--cache-disk-mb', dest='cache_disk_mb', type=int, default=4096, help='disk budget of the cache folder in MB')
+    add_settings_arguments(parser)
+    return parser
+
+# Flags of the ASCIIXEL settings, shared with the render farm
+# Defaults are left to ASCIIXEL, or to the manifest entries, when a flag is not given
+def add_settings_arguments(parser: argparse.ArgumentParser) -> None:
+    settings = parser.add_argument_group('settings')
+    settings.add_argument('--ascii-set', dest='ascii_set', type=SETTINGS_PARSERS['ascii_set'])
+    settings.add_argument('--element-size', dest='element_size', type=SETTINGS_PARSERS['element_size'])
+    settings.add_argument('--resolution', type=SETTINGS_PARSERS['resolution'], help='output resolution as WIDTHxHEIGHT')
+    settings.add_argument('--output-type', dest='output_type', type=SETTINGS_PARSERS['output_type'], help=', '.join(el.name for el in OutputType))
+    settings.add_argument('--colour-lvl', dest='colour_lvl', type=SETTINGS_PARSERS['colour_lvl'])
+    settings.add_argument('--quantise', type=SETTINGS_PARSERS['quantise'], help=', '.join(el.name for el in QuantiseMode))
+    settings.add_argument('--palette', type=SETTINGS_PARSERS['palette'], choices=list(PALETTES), help='palette of the PALETTE quantisation')
+    settings.add_argument('--nb-colours', dest='nb_colours', type=SETTINGS_PARSERS['nb_colours'], help='size of the palettes fitted by KMEANS and MEDIAN_CUT')
+    settings.add_argument('--reverse-colour', dest='reverse_colour', action='store_const', const=True)
+    settings.add_argument('--calibrated-glyphs', dest='calibrated_glyphs', action='store_const', const=True, help='pick the glyphs by their measured ink rather than by their order in the set')
+    settings.add_argument('--shape-matching', dest='shape_matching', action='store_const', const=True, help='pick the glyphs matching the shapes in the cells rather than their luma alone')
+    settings.add_argument('--display-original', dest='display_original', action='store_const', const=True)
+    settings.add_argument('--no-record', dest='record', action='store_const', const=False, help='render without writing any output')
+    settings.add_argument('--engine', type=SETTINGS_PARSERS['engine'], help=', '.join(el.name for el in RenderEngine))
+    settings.add_argument('--record-backend', dest='record_backend', type=SETTINGS_PARSERS['record_backend'], help=', '.join(el.name for el in RecordBackend))
+    settings.add_argument('--workers', dest='nb_workers', type=SETTINGS_PARSERS['nb_workers'], help='render processes per job')
+    settings.add_argument('--incremental', action='store_const', const=True, help='only redraw the cells that changed since the previous frame')
+    settings.add_argument('--prefetch', type=SETTINGS_PARSERS['prefetch'], help='frames decoded ahead on a background thread, 0 to turn it off')
+    settings.add_argument('--prefetch-mb', dest='prefetch_mb', type=SETTINGS_PARSERS['prefetch_mb'], help='memory budget of the prefetched frames in MB')
+    settings.add_argument('--start', type=SETTINGS_PARSERS['start'], help='time in seconds to start rendering from')
+    settings.add_argument('--end', type=SETTINGS_PARSERS['end'], help='time in seconds to stop rendering at, the duration of the capture for a camera or a stream')
+    settings.add_argument('--segment-frames', dest='segment_frames', type=SETTINGS_PARSERS['segment_frames'], help='record in segments of this many frames, an interrupted recording resumes after the segments done')
+    settings.add_argument('--memory-mb', dest='memory_mb', type=SETTINGS_PARSERS['memory_mb'], help='memory budget of the frame buffers in MB, the recorded frames are drawn in strips to stay within it')
+    settings.add_argument('--full-redraw-ratio', dest='full_redraw_ratio', type=SETTINGS_PARSERS['full_redraw_ratio'], help='share of changed cells above which the whole frame is redrawn')
+
+# Settings given by flags, on top of the defaults
+def settings_from_args(args: argparse.Namespace, defaults: dict =None) -> dict:
+    settings = dict(defaults or {})
+    for key in SETTINGS_PARSERS:
+        if getattr(args, key, None) is not None:
+            settings[key] = getattr(args, key)
+    return settings
+
+def main(argv: list =None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    defaults = settings_from_args(args, {'record': True})
+
+    # Images, folders and patterns go to the image batches, the videos and the manifest to the jobs
+    image_inputs = [path for path in args.inputs if not is_live(path) and (is_image(path) or os.path.isdir(path) or is_pattern(path))]
+    raw_jobs = [{'path': path} for path in args.inputs if path not in image_inputs]
+    if args.manifest:
+        raw_jobs += load_manifest(args.manifest)
+    images = collect_images(image_inputs, args.recursive)
+    if not raw_jobs and not images:
+        parser.error('no input given' if not image_inputs else 'no image found')
+
+    reports = []
+    if images:
+        reports += run_images(images, defaults, args.jobs, args.force, args.output_dir, args.image_format)
+    if raw_jobs:
+        jobs = [{**defaults, **parse_settings(raw)} for raw in raw_jobs]
+        cache = {'cache_mb': args.cache_mb or (512 if args.cache_dir else 0), 'cache_dir': args.cache_dir, 'cache_disk_mb': args.cache_disk_mb}
+        reports += run_jobs(jobs, args.jobs, args.force, cache)
+    return int(any(report['status'] == 'failed' for report in reports))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,453 @@
+from cli import add_settings_arguments, parse_settings, settings_from_args
+from segments import plan_segments, concat_segments
+from profiling import peak_rss_mb
+from utils import GRID_BACKENDS, RecordBackend
+from ASCIIXEL import ASCIIXEL
+from enum import Enum
+import threading
+import argparse
+import socket
+import sqlite3
+import shutil
+import json
+import time
+import sys
+import os
+import re
+import cv2
+
+
+# Frames per segment by default, 10 s at 25 fps
+SEGMENT_FRAMES = 250
+
+# Renders of a segment before it is marked as failed
+MAX_ATTEMPTS = 3
+
+# Seconds without news from a worker after which its segment is given to another worker
+STALE_TIMEOUT = 120
+
+# Seconds between the heartbeats of a worker
+HEARTBEAT = 10
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT NOT NULL,
+    settings TEXT NOT NULL,
+    output TEXT NOT NULL,
+    fps REAL NOT NULL,
+    first INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    submitted REAL NOT NULL,
+    finished REAL,
+    open_ended INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS segments (
+    job INTEGER NOT NULL,
+    idx INTEGER NOT NULL,
+    first INTEGER NOT NULL,
+    last INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    worker TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    heartbeat REAL,
+    started REAL,
+    finished REAL,
+    frames INTEGER,
+    error TEXT,
+    PRIMARY KEY (job, idx)
+);
+'''
+
+
+##### Job Queue #####
+
+# Render queue kept in a SQLite file, shared by the coordinator and the workers of every node through the filesystem
+# A job is a video split into segments of frames, the segments go from pending to running to done,
+# a segment that fails or whose worker stops sending heartbeats goes back to pending until MAX_ATTEMPTS renders
+# The segments are encoded in the folder next to the queue, the coordinator joins them into the output of the job
+class RenderQueue:
+    def __init__(self, path: str) -> None:
+        self.path = os.path.abspath(path)
+        self.folder = f'{os.path.splitext(self.path)[0]}_segments'
+
+        # Transactions are opened explicitly, so that claiming a segment locks the queue for the whole check
+        self.db = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        with self.lock:
+            self.db.executescript(SCHEMA)
+            # Queues made before the jobs could be open-ended
+            if 'open_ended' not in [row['name'] for row in self.db.execute('PRAGMA table_info(jobs)')]:
+                self.db.execute('ALTER TABLE jobs ADD COLUMN open_ended INTEGER NOT NULL DEFAULT 0')
+
+    def close(self) -> None:
+        self.db.close()
+
+    # Run queries in one transaction holding the write lock of the queue
+    def transaction(self, queries) -> object:
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                result = queries(self.db)
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+            self.db.execute('COMMIT')
+            return result
+
+    def segment_path(self, job: int, index: int) -> str:
+        return os.path.join(self.folder, f'job_{job:05d}', f'segment_{index:05d}.mp4')
+
+    # Split a video into segments and add them to the queue, return the id of the job
+    def submit(self, settings: dict, segment_frames: int =SEGMENT_FRAMES) -> int:
+        settings = {key: value for key, value in settings.items() if key not in ('record', 'segment_frames')}
+        if settings.get('record_backend', RecordBackend.PIPE) in GRID_BACKENDS:
+            raise ValueError('Only the video backends can be rendered in segments')
+        settings['path'] = os.path.abspath(settings['path'])
+
+        # The range is found the way a single render finds it, so that the joined output has the same frames
+        app = ASCIIXEL(**settings)
+        if not app.setup():
+            raise ValueError(f'Can not read the video {settings["path"]}')
+        first = app.source_index
+        # Without an end, the frame count of the container is only an estimate: the last segment reads on to the end
+        # of the video, so that the frames past an underestimated count are still rendered
+        open_ended = app.end_frame is None
+        last = app.end_frame if not open_ended else max(first+1, int(app.cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+        output = os.path.abspath(app.output_path())
+        fps = app.rec_fps
+        app.stop_prefetch()
+        app.cap.release()
+
+        segments = plan_segments(first, last, segment_frames)
+        if not segments:
+            raise ValueError(f'No frame to render in {settings["path"]}')
+
+        def insert(db):
+            job = db.execute(
+                'INSERT INTO jobs (path, settings, output, fps, first, status, submitted, open_ended) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (settings['path'], json.dumps(format_settings(settings)), output, fps, first, 'rendering', time.time(), int(open_ended))
+            ).lastrowid
+            db.executemany(
+                'INSERT INTO segments (job, idx, first, last, status) VALUES (?, ?, ?, ?, ?)',
+                [(job, index, start, end, 'pending') for index, (start, end) in enumerate(segments)]
+            )
+            return job
+        return self.transaction(insert)
+
+    # Take the next segment to render, a pending one or one whose worker went silent, None if there is none
+    def claim(self, worker: str, max_attempts: int =MAX_ATTEMPTS, stale_timeout: float =STALE_TIMEOUT) -> dict:
+        def take(db):
+            now = time.time()
+            rows = db.execute(
+                'SELECT segments.*, jobs.settings, jobs.open_ended, (SELECT MAX(idx) FROM segments AS others WHERE others.job = segments.job) AS last_idx '
+                'FROM segments JOIN jobs ON jobs.id = segments.job '
+                "WHERE jobs.status = 'rendering' AND (segments.status = 'pending' OR (segments.status = 'running' AND segments.heartbeat < ?)) "
+                'ORDER BY segments.job, segments.idx',
+                (now-stale_timeout,)
+            ).fetchall()
+
+            for row in rows:
+                # A segment whose workers kept dying is not given again
+                if row['status'] == 'running' and row['attempts'] >= max_attempts:
+                    self.fail_segment(db, row['job'], row['idx'], f'worker {row["worker"]} stopped responding')
+                    continue
+
+                db.execute(
+                    "UPDATE segments SET status = 'running', worker = ?, attempts = attempts + 1, heartbeat = ?, started = ?, error = NULL WHERE job = ? AND idx = ?",
+                    (worker, now, now, row['job'], row['idx'])
+                )
+                # The last segment of an open-ended job is rendered up to the end of the video
+                last = None if row['open_ended'] and row['idx'] == row['last_idx'] else row['last']
+                return {'job': row['job'], 'index': row['idx'], 'first': row['first'], 'last': last, 'attempt': row['attempts']+1, 'settings': json.loads(row['settings'])}
+            return None
+        return self.transaction(take)
+
+    # Tell the queue the worker is still rendering its segment
+    def heartbeat(self, worker: str, job: int, index: int) -> None:
+        self.transaction(lambda db: db.execute(
+            "UPDATE segments SET heartbeat = ? WHERE job = ? AND idx = ? AND worker = ? AND status = 'running'",
+            (time.time(), job, index, worker)
+        ))
+
+    # File a render of a segment is encoded into, its own to the worker and the attempt
+    # A segment given to another worker can still be rendering on the first one, the two renders never share a file
+    def render_path(self, job: int, index: int, worker: str, attempt: int) -> str:
+        root, extention = os.path.splitext(self.segment_path(job, index))
+        worker = re.sub(r'\W+', '_', worker)
+        return f'{root}.{worker}.{attempt}{extention}'
+
+    # Mark a segment as done with the file rendered by the worker, None for a segment without frames
+    # The file only replaces the segment while the worker still holds its claim, and is removed otherwise
+    # Return False if the segment was given to another worker in the meantime
+    def complete(self, worker: str, job: int, index: int, attempt: int, nb_frame: int, rendered: str =None) -> bool:
+        def update(db):
+            row = db.execute(
+                "SELECT 1 FROM segments WHERE job = ? AND idx = ? AND worker = ? AND attempts = ? AND status = 'running'",
+                (job, index, worker, attempt)
+            ).fetchone()
+            if row is None:
+                if rendered is not None and os.path.exists(rendered):
+                    os.remove(rendered)
+                return False
+
+            # Renamed while the queue is locked, so that no other render of the segment is taken at the same time
+            if rendered is not None:
+                os.replace(rendered, self.segment_path(job, index))
+            db.execute(
+                "UPDATE segments SET status = 'done', finished = ?, frames = ? WHERE job = ? AND idx = ?",
+                (time.time(), nb_frame, job, index)
+            )
+            return True
+        return self.transaction(update)
+
+    # Record a failed render, the segment goes back to pending while it has attempts left
+    def fail(self, worker: str, job: int, index: int, error: str, max_attempts: int =MAX_ATTEMPTS) -> None:
+        def update(db):
+            row = db.execute('SELECT attempts FROM segments WHERE job = ? AND idx = ? AND worker = ?', (job, index, worker)).fetchone()
+            if row is None: return
+            if row['attempts'] >= max_attempts:
+                self.fail_segment(db, job, index, error)
+            else:
+                db.execute("UPDATE segments SET status = 'pending', error = ? WHERE job = ? AND idx = ?", (error, job, index))
+        self.transaction(update)
+
+    # Mark a segment and its job as failed
+    def fail_segment(self, db: sqlite3.Connection, job: int, index: int, error: str) -> None:
+        db.execute("UPDATE segments SET status = 'failed', error = ? WHERE job = ? AND idx = ?", (error, job, index))
+        db.execute("UPDATE jobs SET status = 'failed', error = ?, finished = ? WHERE id = ?", (f'segment {index} failed: {error}', time.time(), job))
+
+    # Give the failed segments of the failed jobs another MAX_ATTEMPTS renders, return the number of segments requeued
+    def retry(self, job: int =None) -> int:
+        def update(db):
+            if job is None:
+                count = db.execute("UPDATE segments SET status = 'pending', attempts = 0 WHERE status = 'failed'").rowcount
+                db.execute("UPDATE jobs SET status = 'rendering', error = NULL, finished = NULL WHERE status = 'failed'")
+            else:
+                count = db.execute("UPDATE segments SET status = 'pending', attempts = 0 WHERE status = 'failed' AND job = ?", (job,)).rowcount
+                db.execute("UPDATE jobs SET status = 'rendering', error = NULL, finished = NULL WHERE status = 'failed' AND id = ?", (job,))
+            return count
+        return self.transaction(update)
+
+    def jobs(self) -> list:
+        with self.lock:
+            return [dict(row) for row in self.db.execute('SELECT * FROM jobs ORDER BY id')]
+
+    def segments(self, job: int =None) -> list:
+        with self.lock:
+            if job is None:
+                return [dict(row) for row in self.db.execute('SELECT * FROM segments ORDER BY job, idx')]
+            return [dict(row) for row in self.db.execute('SELECT * FROM segments WHERE job = ? ORDER BY idx', (job,))]
+
+    # Check if some segments are still to render
+    def has_work(self) -> bool:
+        with self.lock:
+            row = self.db.execute(
+                "SELECT COUNT(*) FROM segments JOIN jobs ON jobs.id = segments.job WHERE jobs.status = 'rendering' AND segments.status IN ('pending', 'running')"
+            ).fetchone()
+        return row[0] > 0
+
+    # Join the segments of the jobs whose segments are all done, muxing the audio of the source
+    # Return the ids of the jobs finished
+    def stitch(self) -> list:
+        finished = []
+        for job in self.jobs():
+            # A job left stitching was being joined by a coordinator that stopped, it is joined again
+            if job['status'] not in ('rendering', 'stitching'): continue
+            segments = self.segments(job['id'])
+            if any(segment['status'] != 'done' for segment in segments): continue
+
+            self.transaction(lambda db: db.execute("UPDATE jobs SET status = 'stitching' WHERE id = ?", (job['id'],)))
+            paths = [self.segment_path(job['id'], segment['idx']) for segment in segments if segment['frames']]
+            os.makedirs(os.path.dirname(job['output']), exist_ok=True)
+            # The audio is only offset for a time range, as in a single render
+            settings = json.loads(job['settings'])
+            audio_start = job['first']/job['fps'] if settings.get('start') is not None or settings.get('end') is not None else None
+            code, message = concat_segments(paths, job['output'], job['path'], audio_start)
+
+            if code:
+                self.transaction(lambda db: db.execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, finished = ? WHERE id = ?",
+                    (f'joining the segments failed: {message}', time.time(), job['id'])
+                ))
+                continue
+
+            self.transaction(lambda db: db.execute("UPDATE jobs SET status = 'done', finished = ? WHERE id = ?", (time.time(), job['id'])))
+            shutil.rmtree(os.path.dirname(self.segment_path(job['id'], 0)), ignore_errors=True)
+            finished.append(job['id'])
+        return finished
+
+
+# Settings stored in the queue as JSON, the enums by name
+def format_settings(settings: dict) -> dict:
+    return {key: value.name if isinstance(value, Enum) else value for key, value in settings.items()}
+
+
+##### Workers #####
+
+# Render one segment of a job into a file of its own to the worker and the attempt
+# Return the number of frames rendered and the file, None when the segment has no frame
+def render_segment(queue: RenderQueue, segment: dict, worker: str, nb_workers: int =None) -> tuple:
+    settings = parse_settings(segment['settings'])
+    if nb_workers:
+        settings['nb_workers'] = nb_workers
+    app = ASCIIXEL(**settings)
+    if not app.setup():
+        raise RuntimeError(f'Can not read the video {settings["path"]}')
+
+    path = queue.render_path(segment['job'], segment['index'], worker, segment['attempt'])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    code = app.record_segment(segment['first'], segment['last'], path)
+
+    # A segment past the end of the video, when its frame count was overestimated, has no frame
+    nb_frame = app.recorder.nb_frame
+    if nb_frame == 0:
+        if os.path.exists(path):
+            os.remove(path)
+        return 0, None
+    if code:
+        raise RuntimeError(f'ffmpeg exited with status {code}: {app.recorder.error_message()}')
+    return nb_frame, path
+
+# Render segments of the queue until it is empty, or forever when watching it
+# A thread sends the heartbeats while a segment renders, return the number of segments rendered
+def run_worker(queue: RenderQueue, name: str, watch: bool =False, nb_workers: int =None, poll: float =2.0, max_attempts: int =MAX_ATTEMPTS, stale_timeout: float =STALE_TIMEOUT) -> int:
+    nb_done = 0
+    while True:
+        segment = queue.claim(name, max_attempts, stale_timeout)
+        if segment is None:
+            if not watch and not queue.has_work(): return nb_done
+            time.sleep(poll)
+            continue
+
+        rendering = threading.Event()
+        rendering.set()
+        def beat():
+            while rendering.is_set():
+                time.sleep(min(HEARTBEAT, stale_timeout/4))
+                if rendering.is_set():
+                    queue.heartbeat(name, segment['job'], segment['index'])
+        heart = threading.Thread(target=beat, daemon=True)
+        heart.start()
+
+        start = time.perf_counter()
+        try:
+            nb_frame, rendered = render_segment(queue, segment, name, nb_workers)
+        except Exception as error:
+            rendering.clear()
+            queue.fail(name, segment['job'], segment['index'], str(error) or type(error).__name__, max_attempts)
+            print(f'{name}: job {segment["job"]} segment {segment["index"]} failed ({error})', flush=True)
+            continue
+        rendering.clear()
+
+        if not queue.complete(name, segment['job'], segment['index'], segment['attempt'], nb_frame, rendered):
+            print(f'{name}: job {segment["job"]} segment {segment["index"]} was given to another worker, its render is dropped', flush=True)
+            continue
+        duration = time.perf_counter()-start
+        line = f'{name}: job {segment["job"]} segment {segment["index"]}, {nb_frame} frames in {duration:.2f} s ({nb_frame/duration:.1f} fps)'
+        if peak_rss_mb() is not None:
+            line += f', peak memory {peak_rss_mb():.0f} MB'
+        print(line, flush=True)
+        nb_done += 1
+
+# Join the jobs as their segments are done until no job is rendering, return True if all of them succeeded
+def run_coordinator(queue: RenderQueue, poll: float =2.0) -> bool:
+    while True:
+        for job in queue.stitch():
+            print(f'job {job} done', flush=True)
+        if not any(job['status'] in ('rendering', 'stitching') for job in queue.jobs()): break
+        time.sleep(poll)
+    return all(job['status'] == 'done' for job in queue.jobs())
+
+
+##### Status #####
+
+# Progress of the jobs and of the workers of the queue
+def format_status(queue: RenderQueue) -> str:
+    lines = []
+    segments = queue.segments()
+    for job in queue.jobs():
+        parts = [segment for segment in segments if segment['job'] == job['id']]
+        counts = {status: sum(segment['status'] == status for segment in parts) for status in ('done', 'running', 'pending', 'failed')}
+        nb_frame = sum(segment['frames'] or 0 for segment in parts)
+        line = f'job {job["id"]} {job["status"]:<9} {counts["done"]}/{len(parts)} segments ({counts["running"]} running, {counts["pending"]} pending, {counts["failed"]} failed), {nb_frame} frames: {job["path"]} -> {job["output"]}'
+        if job['error']:
+            line += f'\n    {job["error"]}'
+        lines.append(line)
+
+    workers = {}
+    for segment in segments:
+        if segment['worker'] is None: continue
+        worker = workers.setdefault(segment['worker'], {'done': 0, 'frames': 0, 'time': 0.0, 'current': None, 'heartbeat': 0.0})
+        if segment['status'] == 'done':
+            worker['done'] += 1
+            worker['frames'] += segment['frames'] or 0
+            worker['time'] += segment['finished']-segment['started']
+        elif segment['status'] == 'running':
+            worker['current'] = f'job {segment["job"]} segment {segment["idx"]}'
+            worker['heartbeat'] = segment['heartbeat']
+
+    now = time.time()
+    for name, worker in sorted(workers.items()):
+        fps = worker['frames']/worker['time'] if worker['time'] else 0.0
+        line = f'worker {name}: {worker["done"]} segments, {worker["frames"]} frames ({fps:.1f} fps)'
+        if worker['current']:
+            line += f', rendering {worker["current"]} (last seen {now-worker["heartbeat"]:.0f} s ago)'
+        lines.append(line)
+    return '\n'.join(lines) if lines else 'empty queue'
+
+
+##### Command Line #####
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='Render videos in segments on several machines sharing a queue file.')
+    parser.add_argument('--queue', default='farm.db', help='queue file, on a filesystem shared by the nodes')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    submit = commands.add_parser('submit', help='split videos into segments and add them to the queue')
+    submit.add_argument('inputs', nargs='+', help='videos to render, at the same path on every node')
+    submit.add_argument('--wait', action='store_true', help='join the segments as the workers finish them')
+    add_settings_arguments(submit)
+
+    worker = commands.add_parser('worker', help='render segments of the queue')
+    worker.add_argument('--name', default=f'{socket.gethostname()}-{os.getpid()}', help='name of the worker in the status')
+    worker.add_argument('--workers', dest='nb_workers', type=int, help='render processes of this node, instead of the ones of the jobs')
+    worker.add_argument('--watch', action='store_true', help='wait for new segments instead of exiting when the queue is empty')
+    worker.add_argument('--max-attempts', dest='max_attempts', type=int, default=MAX_ATTEMPTS, help='renders of a segment before it fails')
+    worker.add_argument('--stale-timeout', dest='stale_timeout', type=float, default=STALE_TIMEOUT, help='seconds without heartbeat before a segment is given to another worker')
+
+    commands.add_parser('coordinate', help='join the segments of the jobs as the workers finish them')
+    commands.add_parser('status', help='show the progress of the jobs and of the workers')
+
+    retry = commands.add_parser('retry', help='render the failed segments again')
+    retry.add_argument('--job', type=int, help='only retry this job')
+    return parser
+
+def main(argv: list =None) -> int:
+    args = build_parser().parse_args(argv)
+    queue = RenderQueue(args.queue)
+
+    if args.command == 'submit':
+        # --segment-frames sets the size of the segments shared between the workers
+        settings = settings_from_args(args)
+        segment_frames = settings.pop('segment_frames', None) or SEGMENT_FRAMES
+        for path in args.inputs:
+            job = queue.submit({**settings, 'path': path}, segment_frames)
+            print(f'job {job}: {path}, {len(queue.segments(job))} segments', flush=True)
+        if args.wait:
+            return int(not run_coordinator(queue))
+    elif args.command == 'worker':
+        run_worker(queue, args.name, args.watch, args.nb_workers, max_attempts=args.max_attempts, stale_timeout=args.stale_timeout)
+    elif args.command == 'coordinate':
+        return int(not run_coordinator(queue))
+    elif args.command == 'status':
+        print(format_status(queue))
+    elif args.command == 'retry':
+        print(f'{queue.retry(args.job)} segments requeued')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,152 @@
+from utils import GRID_BACKENDS, RECORD_EXTENTIONS, is_image, read_image, warm_up_kernels
+from textoutput import grid_recorder
+from ASCIIXEL import ASCIIXEL
+from collections import OrderedDict
+from typing import Callable, Tuple
+from PIL import Image
+import glob
+import time
+import os
+
+
+##### Image Collection #####
+
+# Formats the converted images can be saved in, with the options given to PIL
+IMAGE_FORMATS = {
+    'png': {},
+    'jpg': {'quality': 90},
+    'webp': {'quality': 90}
+}
+
+# Check if an input is a pattern to expand rather than a path
+def is_pattern(path: str) -> bool:
+    return any(char in path for char in '*?[')
+
+# Expand the images, folders and patterns given, return (image path, folder it was found in) sorted by path
+# The folder is kept so that the outputs mirror the tree below it
+def collect_images(inputs: list, recursive: bool =False) -> list:
+    images = {}
+    for path in inputs:
+        if os.path.isdir(path):
+            pattern = os.path.join(glob.escape(path), '**', '*') if recursive else os.path.join(glob.escape(path), '*')
+            for found in glob.glob(pattern, recursive=recursive):
+                if is_image(found) and os.path.isfile(found):
+                    images.setdefault(found, path)
+        elif is_pattern(path):
+            for found in glob.glob(path, recursive=recursive):
+                if is_image(found) and os.path.isfile(found):
+                    images.setdefault(found, os.path.dirname(found))
+        else:
+            images.setdefault(path, os.path.dirname(path))
+    return sorted(images.items())
+
+# Size of an image read from its header, without decoding it, None if it can not be read
+def image_size(path: str) -> Tuple[int, int]:
+    try:
+        with Image.open(path) as image:
+            return image.size
+    except OSError:
+        return None
+
+# Split the images into batches of the same size, so that each batch is converted by one prepared renderer
+def plan_batches(images: list, resolution: Tuple[int, int] =None, batch_size: int =32) -> list:
+    sizes = OrderedDict()
+    for path, root in images:
+        size = resolution or image_size(path)
+        sizes.setdefault(size, []).append((path, root))
+
+    batches = []
+    for group in sizes.values():
+        for start in range(0, len(group), batch_size):
+            batches.append(group[start:start+batch_size])
+    return batches
+
+
+##### Image Conversion #####
+
+# Renderers prepared by this process, by settings and size, the least recently used is dropped first
+process_renderers = OrderedDict()
+MAX_RENDERERS = 8
+
+def get_renderer(settings: dict, size: Tuple[int, int]) -> ASCIIXEL:
+    key = (tuple(sorted((name, value) for name, value in settings.items() if name != 'path')), size)
+    if key in process_renderers:
+        process_renderers.move_to_end(key)
+        return process_renderers[key]
+
+    # Each image is converted on its own: no incremental drawing, strips, prefetching or workers
+    app = ASCIIXEL(**{**settings, 'path': '', 'incremental': False, 'memory_mb': 0, 'prefetch': 0, 'nb_workers': 1})
+    app.rasterise = not (app.record and app.record_backend in GRID_BACKENDS)
+    app.setup_render(size)
+    process_renderers[key] = app
+    if len(process_renderers) > MAX_RENDERERS:
+        process_renderers.popitem(last=False)
+    return app
+
+# Path of the converted image, named as the single conversions are, in the output folder mirroring the input tree
+def image_output_path(app: ASCIIXEL, path: str, root: str, output_dir: str, image_format: str) -> str:
+    app.path = path
+    app.setup_output_name()
+    folder = os.path.join(output_dir, os.path.relpath(os.path.dirname(path), root) if root else '')
+    extention = RECORD_EXTENTIONS[app.record_backend] if app.record_backend in GRID_BACKENDS else f'.{image_format}'
+    return os.path.normpath(os.path.join(folder, app.output_name + extention))
+
+# Convert one image with the renderer of its size and save it, return its report
+# cancelled is asked before the image is decoded and before it is saved, the image is left unsaved once it returns True
+def convert_image(settings: dict, path: str, output: str, image_format: str ='png', force: bool =False, cancelled: Callable[[], bool] =None) -> dict:
+    report = {'path': path, 'output': output, 'status': 'done', 'frames': 0, 'time': 0.0, 'fps': 0.0, 'image': True}
+    if not force and os.path.exists(output) and os.path.exists(path) and os.path.getmtime(output) >= os.path.getmtime(path):
+        report['status'] = 'skipped'
+        return report
+
+    if cancelled is not None and cancelled():
+        report['status'] = 'cancelled'
+        return report
+
+    start = time.perf_counter()
+    frame = read_image(path) if os.path.exists(path) else None
+    if frame is None:
+        report['status'] = 'failed'
+        report['error'] = 'input not found' if not os.path.exists(path) else 'image can not be read'
+        return report
+
+    app = get_renderer(settings, settings.get('resolution') or (frame.shape[1], frame.shape[0]))
+
+    app.quantiser.scene = None
+    app.prepare_image(frame)
+    app.draw_frame()
+
+    if cancelled is not None and cancelled():
+        report['status'] = 'cancelled'
+        report['time'] = time.perf_counter()-start
+        return report
+
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    if app.rasterise:
+        app.frame_image().save(output, **IMAGE_FORMATS[image_format])
+    else:
+        # Opened once the image is converted, so that a frame sequence stores the palette fitted on the image
+        app.recorder = grid_recorder(app.record_backend, output, app.WIDTH, app.HEIGHT, 0.0, app.ASCII_CHARS, app.output_type, app.colour_lvl, app.quantiser.colours)
+        app.recorder.start()
+        app.record_grids()
+        app.recorder.close()
+        app.recorder = None
+
+    report['time'] = time.perf_counter()-start
+    report['frames'] = 1
+    return report
+
+# Convert a batch of images on this process, return their reports
+def convert_batch(settings: dict, batch: list, output_dir: str ='outputs', image_format: str ='png', force: bool =False) -> list:
+    warm_up_kernels()
+
+    # The outputs only depend on the settings and the paths, so they are named before any image is decoded
+    namer = ASCIIXEL(**settings)
+    reports = []
+    for path, root in batch:
+        output = image_output_path(namer, path, root, output_dir, image_format)
+        try:
+            reports.append(convert_image(settings, path, output, image_format, force))
+        except Exception as error:
+            reports.append({'path': path, 'output': output, 'status': 'failed', 'error': str(error), 'image': True})
+    return reports
@@ -0,0 +1,190 @@
+from urllib.parse import urlparse
+from collections import deque
+import numpy as np
+import threading
+import weakref
+import atexit
+import time
+import math
+import os
+import re
+import cv2
+
+
+##### Live Sources #####
+
+# Frame rate of the recordings of the live sources that do not report one
+LIVE_FPS = 30.0
+
+# Seconds to wait for a frame of a camera or a stream before ending it
+FRAME_TIMEOUT = 10.0
+
+# Schemes of the stream URLs, the other URLs such as file:// are read as files
+LIVE_SCHEMES = ('rtsp', 'rtmp', 'http', 'https', 'udp', 'tcp')
+
+# Check if a path is a capture device index or a stream URL rather than a file, an existing file always is a file
+def is_live(path: str) -> bool:
+    if os.path.exists(path): return False
+    return path.isdigit() or urlparse(path).scheme.lower() in LIVE_SCHEMES
+
+# Name of the outputs of a live source: camera0, or the host and path of the stream
+def live_name(path: str) -> str:
+    if path.isdigit(): return f'camera{path}'
+    url = urlparse(path)
+    return re.sub(r'\W+', '_', url.netloc+url.path).strip('_') or 'stream'
+
+
+##### Live Capture #####
+
+# Captures still reading, released before the interpreter exits
+# A daemon thread left inside a read of OpenCV while the interpreter finalises aborts the process
+running_captures = weakref.WeakSet()
+
+def release_captures() -> None:
+    for capture in list(running_captures):
+        capture.release()
+
+atexit.register(release_captures)
+
+# Newest frames of a camera or a stream, read on a background thread into a ring of a few frames
+# The reader overwrites the oldest frames rather than queueing them, so the renderer always gets the newest frame
+# and the frames it was too slow for are dropped; the slot of the frame last given out is never overwritten
+# Has the methods of cv2.VideoCapture used on the videos, a live source can not seek
+class LiveCapture:
+    def __init__(self, path: str, nb_slots: int =3, duration: float =None) -> None:
+        self.path = path
+        self.cap = cv2.VideoCapture(int(path) if path.isdigit() else path)
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self.nb_slots = max(3, nb_slots)
+        self.duration = duration
+
+        self.condition = threading.Condition()
+        self.slots = [None]*self.nb_slots
+        self.times = [0.0]*self.nb_slots
+        self.newest = -1
+        self.in_use = -1
+        self.sequence = 0
+        self.taken = 0
+        self.closed = False
+        self.start_time = None
+
+        # Capture time of the frame last given out
+        self.frame_time = None
+
+        self.nb_captured = 0
+        self.nb_dropped = 0
+        self.latencies = {}
+
+        self.thread = threading.Thread(target=self.read_frames, name='live-capture', daemon=True)
+        running_captures.add(self)
+        self.thread.start()
+
+    # Reader thread: decode into the oldest slot that is neither the newest frame nor the frame in use
+    def read_frames(self) -> None:
+        while not self.closed:
+            with self.condition:
+                slot = next(index for index in ((self.newest+step) % self.nb_slots for step in range(1, self.nb_slots+1)) if index not in (self.newest, self.in_use))
+
+            ret, frame = self.cap.read(self.slots[slot])
+            captured = time.perf_counter()
+            with self.condition:
+                if not ret or self.closed:
+                    self.closed = True
+                    self.condition.notify_all()
+                    return
+                self.slots[slot] = frame
+                self.times[slot] = captured
+                self.newest = slot
+                self.sequence += 1
+                self.nb_captured += 1
+                self.condition.notify_all()
+
+    # Newest frame not given out yet, waiting for it if needed, False once the source ended or its duration passed
+    def read(self) -> tuple:
+        with self.condition:
+            self.condition.wait_for(lambda: self.closed or self.sequence > self.taken, FRAME_TIMEOUT)
+            if self.sequence <= self.taken: return False, None
+
+            if self.start_time is None:
+                self.start_time = self.times[self.newest]
+            elif self.duration is not None and self.times[self.newest]-self.start_time > self.duration:
+                return False, None
+
+            # The frames captured since the previous read were never rendered
+            if self.taken:
+                self.nb_dropped += self.sequence-self.taken-1
+            self.taken = self.sequence
+            self.in_use = self.newest
+            self.frame_time = self.times[self.newest]
+            return True, self.slots[self.newest]
+
+    def grab(self) -> bool:
+        return self.read()[0]
+
+    def set(self, prop: int, value: float) -> bool:
+        return False
+
+    def get(self, prop: int) -> float:
+        if prop == cv2.CAP_PROP_FPS: return self.cap.get(cv2.CAP_PROP_FPS) or LIVE_FPS
+        if prop == cv2.CAP_PROP_FRAME_COUNT: return 0.0
+        return self.cap.get(prop)
+
+    def release(self) -> None:
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join(timeout=FRAME_TIMEOUT)
+        self.cap.release()
+        running_captures.discard(self)
+
+    # Time from the capture of a frame to a stage, such as its display or its recording
+    def add_latency(self, stage: str, capture_time: float) -> None:
+        if stage not in self.latencies:
+            self.latencies[stage] = deque(maxlen=256)
+        self.latencies[stage].append(time.perf_counter()-capture_time)
+
+    # Counts of the frames and latencies in milliseconds over the last frames, as a median and a 95th percentile
+    def stats(self) -> dict:
+        stats = {'captured': self.nb_captured, 'dropped': self.nb_dropped}
+        for stage, latencies in list(self.latencies.items()):
+            if not latencies: continue
+            values = np.array(latencies)*1000
+            stats[f'{stage}_ms'] = float(np.median(values))
+            stats[f'{stage}_p95_ms'] = float(np.percentile(values, 95))
+        return stats
+
+    def summary(self) -> str:
+        stats = self.stats()
+        lines = [f'live       {stats["captured"]} captured, {stats["dropped"]} dropped']
+        for stage in list(self.latencies):
+            if f'{stage}_ms' in stats:
+                lines.append(f'latency    {stage:<9} {stats[f"{stage}_ms"]:7.1f} ms  p95 {stats[f"{stage}_p95_ms"]:7.1f} ms')
+        return '\n'.join(lines)
+
+
+##### Live Recording #####
+
+# Number of times each rendered frame is recorded so that a live recording plays in real time:
+# a frame lasts until the capture of the next one, slot k of the recording shows the last frame captured by k/fps
+# and the frames captured faster than fps are left out
+# A frame is only recorded once the next one is captured, the last one when the recording closes
+class LiveClock:
+    def __init__(self, fps: float) -> None:
+        self.fps = fps
+        self.start = None
+        self.nb_written = 0
+
+    # Number of slots of the previous frame, elapsed before the capture of a new frame
+    def frames_due(self, capture_time: float) -> int:
+        if self.start is None:
+            self.start = capture_time
+        # Rounded so that a capture on the time of a slot starts that slot
+        due = math.ceil(round((capture_time-self.start)*self.fps, 6))-self.nb_written
+        self.nb_written += max(0, due)
+        return max(0, due)
+
+    # Number of slots of the last frame when the recording closes, its own slot
+    def frames_left(self) -> int:
+        if self.start is None: return 0
+        self.nb_written += 1
+        return 1
@@ -0,0 +1,188 @@
+from multiprocessing import shared_memory
+from utils import warm_up_kernels
+from typing import Tuple
+import multiprocessing as mp
+import numpy as np
+import traceback
+import threading
+import queue
+import os
+
+
+##### Shared Frame Buffers #####
+
+# Fixed number of frames of the same shape stored in shared memory
+class SharedFrames:
+    def __init__(self, nb_frame: int, shape: Tuple[int, int, int], name: str =None) -> None:
+        self.shape = shape
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=max(1, nb_frame*int(np.prod(shape))))
+        self.frames = np.ndarray((nb_frame,)+shape, dtype=np.uint8, buffer=self.shm.buf)
+
+    def close(self) -> None:
+        del self.frames
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+##### Frame-Parallel Recording #####
+
+# Render process: converts the frames of the input slots it is given into the matching output slots
+def render_worker(app_class: type, settings: dict, size: Tuple[int, int], nb_slots: int, in_name: str, in_shape: tuple, out_name: str, out_shape: tuple, tasks, results) -> None:
+    warm_up_kernels()
+
+    app = app_class(**settings)
+    app.record = False
+    app.setup_render(size)
+
+    inputs = SharedFrames(nb_slots, in_shape, in_name)
+    outputs = SharedFrames(nb_slots, out_shape, out_name)
+
+    while True:
+        task = tasks.get()
+        if task is None: break
+
+        frame_index, slot = task
+        try:
+            app.prepare_image(inputs.frames[slot])
+            app.draw_frame()
+            outputs.frames[slot] = app.frame_array()
+            results.put((frame_index, slot, None))
+        except Exception:
+            results.put((frame_index, slot, traceback.format_exc()))
+
+    inputs.close()
+    outputs.close()
+
+# Record a video with a reader thread, a pool of render processes and an ordered writer
+# Frames go through shared memory slots, the output is the same as the serial recording
+class ParallelRecorder:
+    def __init__(self, app, nb_workers: int =None, nb_slots: int =None) -> None:
+        self.app = app
+        self.nb_workers = nb_workers or os.cpu_count()
+        self.nb_slots = nb_slots or 2*self.nb_workers
+
+        self.stopped = threading.Event()
+        self.workers = []
+        self.nb_read = 0
+        self.nb_written = 0
+
+    # Ask the recording to stop, the partial output is removed
+    def stop(self) -> None:
+        self.stopped.set()
+
+    # Record the rest of the video of an ASCIIXEL already set up, return the ffmpeg exit status
+    def run(self) -> int:
+        app = self.app
+        ctx = mp.get_context('spawn')
+
+        # The frames decoded can differ from the size the container reports, the first one was decoded by setup
+        in_shape = app.frame.shape
+        out_shape = (app.ORIGHEIGHT, app.ORIGWIDTH, 3)
+        inputs = SharedFrames(self.nb_slots, in_shape)
+        outputs = SharedFrames(self.nb_slots, out_shape)
+
+        tasks = ctx.Queue()
+        results = ctx.Queue()
+        free_slots = queue.Queue()
+        for slot in range(self.nb_slots):
+            free_slots.put(slot)
+
+        settings = app.settings()
+        self.workers = workers = [
+            ctx.Process(
+                target=render_worker,
+                args=(type(app), settings, (app.ORIGWIDTH, app.ORIGHEIGHT), self.nb_slots, inputs.shm.name, in_shape, outputs.shm.name, out_shape, tasks, results),
+                daemon=True
+            )
+            for _ in range(self.nb_workers)
+        ]
+        for worker in workers:
+            worker.start()
+
+        reader = threading.Thread(target=self.read_frames, args=(inputs, free_slots, tasks, results), daemon=True)
+        reader.start()
+
+        try:
+            completed = self.write_frames(outputs, free_slots, results)
+        except BaseException:
+            # ffmpeg is stopped and the partial output removed before the error goes up
+            app.finish = True
+            app.cancel_record()
+            raise
+        finally:
+            self.stopped.set()
+            free_slots.put(None)
+            reader.join()
+            for worker in workers:
+                tasks.put(None)
+            for worker in workers:
+                worker.join(timeout=5)
+                if worker.is_alive():
+                    worker.terminate()
+            inputs.close()
+            outputs.close()
+
+        app.finish = True
+        if not completed:
+            app.cancel_record()
+            return app.recorder.returncode if app.recorder else None
+        return app.record_video()
+
+    # Reader stage: decode frames into free input slots and hand them to the workers
+    def read_frames(self, inputs: SharedFrames, free_slots: queue.Queue, tasks, results) -> None:
+        frame_index = 0
+        error = None
+        try:
+            while not self.stopped.is_set():
+                ret, frame = self.app.read_frame()
+                if not ret: break
+
+                slot = free_slots.get()
+                if slot is None: break
+
+                inputs.frames[slot] = frame
+                tasks.put((frame_index, slot))
+                frame_index += 1
+        except Exception:
+            error = traceback.format_exc()
+
+        self.nb_read = frame_index
+        results.put((None, frame_index, error))
+
+    # Writer stage: record the rendered frames in order as they come back, return True if all were written
+    def write_frames(self, outputs: SharedFrames, free_slots: queue.Queue, results) -> bool:
+        pending = {}
+        nb_frame = None
+
+        while nb_frame is None or self.nb_written < nb_frame:
+            if self.stopped.is_set(): return False
+
+            try:
+                frame_index, slot, error = results.get(timeout=0.1)
+            except queue.Empty:
+                if not all(worker.is_alive() for worker in self.workers):
+                    raise RuntimeError('A render process stopped unexpectedly')
+                continue
+
+            if frame_index is None:
+                if error:
+                    raise RuntimeError(f'Frames could not be read:\n{error}')
+                nb_frame = slot
+                continue
+            if error:
+                raise RuntimeError(f'Frame {frame_index} failed to render:\n{error}')
+
+            pending[frame_index] = slot
+            while self.nb_written in pending:
+                slot = pending.pop(self.nb_written)
+
+                self.app.nb_frame = self.nb_written
+                if not self.app.record_frame(outputs.frames[slot]): return False
+
+                free_slots.put(slot)
+                self.nb_written += 1
+
+        self.app.nb_frame = self.nb_written
+        return True
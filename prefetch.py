@@ -0,0 +1,140 @@
+from collections import deque
+import traceback
+import threading
+import weakref
+import atexit
+import time
+
+
+##### Frame Prefetching #####
+
+# Prefetchers still reading, stopped before the interpreter exits
+# A daemon thread left inside a decode of OpenCV while the interpreter finalises aborts the process
+running_prefetchers = weakref.WeakSet()
+
+def stop_prefetchers() -> None:
+    for prefetcher in list(running_prefetchers):
+        prefetcher.stop()
+
+atexit.register(stop_prefetchers)
+
+# Decode and preprocess the next frames on a background thread, into a queue bounded in frames and in bytes
+# OpenCV releases the GIL while it decodes and converts, so this overlaps with the rendering of the current frame
+class FramePrefetcher:
+    def __init__(self, read, prepare, depth: int =8, max_bytes: int =256*2**20) -> None:
+        # read() returns (ret, frame) like VideoCapture.read, prepare(frame) returns a tuple of arrays and other values, only the arrays count in the budget
+        self.read = read
+        self.prepare = prepare
+        self.depth = max(1, depth)
+        self.max_bytes = max_bytes
+
+        self.items = deque()
+        self.nb_bytes = 0
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.done = False
+        self.error = None
+        self.thread = None
+
+        # Time spent by each side of the queue working and waiting for the other one, in seconds
+        self.decode_time = 0.0
+        self.prepare_time = 0.0
+        self.full_wait = 0.0
+        self.empty_wait = 0.0
+        self.nb_decoded = 0
+        self.nb_taken = 0
+        self.fill_total = 0
+        self.peak_bytes = 0
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.run, name='frame-prefetch', daemon=True)
+        running_prefetchers.add(self)
+        self.thread.start()
+
+    # Stop the reading thread, the frames left in the queue are dropped
+    def stop(self) -> None:
+        with self.condition:
+            self.stopped = True
+            self.items.clear()
+            self.nb_bytes = 0
+            self.condition.notify_all()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        running_prefetchers.discard(self)
+
+    def run(self) -> None:
+        try:
+            while not self.stopped:
+                start = time.perf_counter()
+                ret, frame = self.read()
+                decoded = time.perf_counter()
+                if not ret: break
+
+                item = self.prepare(frame)
+                prepared = time.perf_counter()
+                size = sum(getattr(value, 'nbytes', 0) for value in item)
+                self.decode_time += decoded-start
+                self.prepare_time += prepared-decoded
+                self.nb_decoded += 1
+
+                # Wait for room in the queue, a single frame larger than the budget is still let through
+                with self.condition:
+                    while not self.stopped and self.items and (len(self.items) >= self.depth or self.nb_bytes+size > self.max_bytes):
+                        self.condition.wait()
+                    self.full_wait += time.perf_counter()-prepared
+                    if self.stopped: break
+
+                    self.items.append((item, size))
+                    self.nb_bytes += size
+                    self.peak_bytes = max(self.peak_bytes, self.nb_bytes)
+                    self.condition.notify_all()
+        except Exception:
+            self.error = traceback.format_exc()
+        finally:
+            with self.condition:
+                self.done = True
+                self.condition.notify_all()
+
+    # Next prepared frame, None at the end of the video
+    def get(self) -> tuple:
+        with self.condition:
+            start = time.perf_counter()
+            while not self.items and not self.done:
+                self.condition.wait()
+            self.empty_wait += time.perf_counter()-start
+
+            if not self.items:
+                if self.error:
+                    raise RuntimeError(f'Frames could not be read:\n{self.error}')
+                return None
+
+            self.fill_total += len(self.items)
+            item, size = self.items.popleft()
+            self.nb_bytes -= size
+            self.nb_taken += 1
+            self.condition.notify_all()
+            return item
+
+    # Averages per frame in milliseconds, and which side of the queue holds the other one back
+    # Decode-bound when the renderer waits for frames more than the reader waits for room, render-bound otherwise
+    def stats(self) -> dict:
+        nb_decoded, nb_taken = max(1, self.nb_decoded), max(1, self.nb_taken)
+        return {
+            'frames': self.nb_taken,
+            'decode_ms': self.decode_time/nb_decoded*1000,
+            'prepare_ms': self.prepare_time/nb_decoded*1000,
+            'reader_wait_ms': self.full_wait/nb_decoded*1000,
+            'render_wait_ms': self.empty_wait/nb_taken*1000,
+            'mean_fill': self.fill_total/nb_taken,
+            'depth': self.depth,
+            'peak_mb': self.peak_bytes/2**20,
+            'bound': 'decode-bound' if self.empty_wait > self.full_wait else 'render-bound'
+        }
+
+    def summary(self) -> str:
+        stats = self.stats()
+        return (
+            f'prefetch   {stats["mean_fill"]:.1f}/{stats["depth"]} frames, {stats["peak_mb"]:.0f} MB peak, {stats["bound"]}\n'
+            f'decode     {stats["decode_ms"]:7.2f} ms  preprocess {stats["prepare_ms"]:7.2f} ms\n'
+            f'waits      reader {stats["reader_wait_ms"]:7.2f} ms  render {stats["render_wait_ms"]:7.2f} ms'
+        )
@@ -0,0 +1,108 @@
+from collections import deque
+import threading
+import time
+
+
+##### Preview Pacing #####
+
+# Pace the preview to the frame rate of the source
+# Frame i is due at start + i/fps: the preview sleeps when it is early and drops the frames it is too late for
+# When not paced, or without a valid frame rate, the frames are shown as fast as they are rendered
+class FramePacer:
+    def __init__(self, fps: float, paced: bool =True, window: int =30) -> None:
+        self.fps = fps if fps and fps > 0 else None
+        self.paced = paced and self.fps is not None
+        self.start = None
+        self.index = 0
+        self.nb_shown = 0
+        self.nb_skipped = 0
+        self.shown_times = deque(maxlen=window)
+
+    def due_time(self, index: int) -> float:
+        return self.start + index/self.fps
+
+    # Number of frames whose time has already passed, to drop before rendering the next one
+    def frames_late(self) -> int:
+        if not self.paced: return 0
+
+        if self.start is None:
+            self.start = time.perf_counter()
+        return max(0, int((time.perf_counter()-self.start)*self.fps) - self.index)
+
+    def skip(self, nb_frame: int) -> None:
+        self.index += nb_frame
+        self.nb_skipped += nb_frame
+
+    # Sleep until the current frame is due
+    def wait(self) -> None:
+        if not self.paced or self.start is None: return
+
+        delay = self.due_time(self.index) - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+    # The current frame was shown
+    def tick(self) -> None:
+        self.shown_times.append(time.perf_counter())
+        self.index += 1
+        self.nb_shown += 1
+
+    # Frame rate of the frames shown, over the last frames
+    def achieved_fps(self) -> float:
+        if len(self.shown_times) < 2: return 0.0
+        elapsed = self.shown_times[-1]-self.shown_times[0]
+        return (len(self.shown_times)-1)/elapsed if elapsed > 0 else 0.0
+
+    def summary(self) -> str:
+        target = f'{self.fps:.1f}' if self.fps else '-'
+        return f'{self.achieved_fps():.1f} / {target} fps, {self.nb_skipped} skipped'
+
+
+##### Frame Coalescing #####
+
+# Hold only the latest frame for the GUI: a frame published while the previous one was not taken replaces it,
+# so at most one notification is queued in the event loop and stale frames are never shown
+# A frame can borrow one of the output buffers of the renderer: the buffer stays in use from take() to release(),
+# while the GUI copies it, and the worker waits in acquire() before drawing into it again
+class LatestFrame:
+    def __init__(self) -> None:
+        self.condition = threading.Condition()
+        self.frame = None
+        self.buffer = None
+        self.pending = False
+        self.displaying = None
+
+    # Store a frame, return True if the GUI has to be notified
+    def publish(self, frame, buffer: int =None) -> bool:
+        with self.condition:
+            self.frame = frame
+            self.buffer = buffer
+            if self.pending: return False
+            self.pending = True
+            return True
+
+    # Latest frame, None if it was already taken
+    def take(self):
+        with self.condition:
+            frame = self.frame
+            self.displaying = self.buffer
+            self.frame = None
+            self.buffer = None
+            self.pending = False
+            return frame
+
+    # The GUI is done with the buffer of the frame it took
+    def release(self) -> None:
+        with self.condition:
+            self.displaying = None
+            self.condition.notify_all()
+
+    # Wait until the GUI is not reading a buffer, before drawing into it
+    def acquire(self, buffer: int) -> None:
+        with self.condition:
+            while self.displaying is not None and self.displaying == buffer:
+                self.condition.wait()
+            # A frame still waiting in this buffer would be overwritten, drop it
+            if self.buffer == buffer:
+                self.frame = None
+                self.buffer = None
@@ -0,0 +1,151 @@
+import numpy as np
+import threading
+import json
+import time
+import sys
+import os
+
+# Only available on Unix, the peak memory is not reported elsewhere
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# Stages of a frame, in the order they happen
+STAGES = ('decode', 'preprocess', 'kernel', 'draw', 'save', 'qt')
+
+
+##### Stage Profiler #####
+
+# Per-frame, per-stage durations kept in a ring buffer
+# Each mark closes the stage that started at the previous mark, so timing a stage costs a single clock read
+class StageProfiler:
+    def __init__(self, capacity: int =512, stages: tuple =STAGES) -> None:
+        self.capacity = capacity
+        self.stages = stages
+        self.stage_index = {stage: index for index, stage in enumerate(stages)}
+
+        # Frame start times and stage start offsets/durations in seconds, NaN when a stage did not run
+        self.frame_starts = np.zeros(capacity)
+        self.frame_ends = np.zeros(capacity)
+        self.offsets = np.full((capacity, len(stages)), np.nan)
+        self.durations = np.full((capacity, len(stages)), np.nan)
+
+        self.nb_frame = 0
+        self.current = None
+        self.last_mark = 0.0
+        self.thread_ids = {}
+        self.thread_names = {}
+
+    def reset(self) -> None:
+        self.frame_starts[:] = 0
+        self.frame_ends[:] = 0
+        self.offsets[:] = np.nan
+        self.durations[:] = np.nan
+        self.nb_frame = 0
+        self.current = None
+
+    # Start a new frame, the previous one is committed
+    def start_frame(self) -> None:
+        self.end_frame()
+
+        self.current = self.nb_frame % self.capacity
+        self.offsets[self.current] = np.nan
+        self.durations[self.current] = np.nan
+        self.last_mark = time.perf_counter()
+        self.frame_starts[self.current] = self.last_mark
+        self.frame_ends[self.current] = self.last_mark
+
+    # Attribute the time since the previous mark to a stage of the current frame
+    def mark(self, stage: str) -> None:
+        if self.current is None: return
+
+        now = time.perf_counter()
+        index = self.stage_index[stage]
+        self.offsets[self.current, index] = self.last_mark-self.frame_starts[self.current]
+        self.durations[self.current, index] = now-self.last_mark
+        self.frame_ends[self.current] = now
+        self.last_mark = now
+
+        # Remember which thread ran each stage for the trace
+        self.thread_ids[stage] = threading.get_ident()
+        self.thread_names[stage] = threading.current_thread().name
+
+    def end_frame(self) -> None:
+        if self.current is None: return
+        self.current = None
+        self.nb_frame += 1
+
+    # Rows of the committed frames, oldest first, leaving out the row of the frame in progress
+    def window(self) -> np.ndarray:
+        nb_valid = min(self.nb_frame, self.capacity-1)
+        first = self.nb_frame - nb_valid
+        return np.arange(first, self.nb_frame) % self.capacity
+
+    # Rolling p50/p95/p99 of every stage and of the whole frame in milliseconds, and the frame rate
+    def stats(self) -> dict:
+        rows = self.window()
+        stats = {'frames': len(rows), 'fps': 0.0, 'stages': {}}
+        if not len(rows): return stats
+
+        if len(rows) > 1:
+            elapsed = self.frame_starts[rows[-1]]-self.frame_starts[rows[0]]
+            stats['fps'] = (len(rows)-1)/elapsed if elapsed > 0 else 0.0
+
+        totals = (self.frame_ends[rows]-self.frame_starts[rows])*1000
+        durations = self.durations[rows]*1000
+        columns = [(stage, durations[:, index]) for stage, index in self.stage_index.items()] + [('frame', totals)]
+        for stage, values in columns:
+            values = values[~np.isnan(values)]
+            if not len(values): continue
+            p50, p95, p99 = np.percentile(values, (50, 95, 99))
+            stats['stages'][stage] = {'p50': p50, 'p95': p95, 'p99': p99, 'mean': values.mean()}
+        return stats
+
+    # Short text of the stats, one line per stage
+    def summary(self) -> str:
+        stats = self.stats()
+        lines = [f'{stats["fps"]:.1f} fps over {stats["frames"]} frames']
+        for stage, values in stats['stages'].items():
+            lines.append(f'{stage:<10} p50 {values["p50"]:7.2f}  p95 {values["p95"]:7.2f}  p99 {values["p99"]:7.2f} ms')
+        return '\n'.join(lines)
+
+    # Write the frames of the ring buffer as Chrome trace events, viewable in chrome://tracing or Perfetto
+    def dump_trace(self, path: str) -> None:
+        pid = os.getpid()
+        rows = self.window()
+        events = []
+        if len(rows):
+            origin = self.frame_starts[rows[0]]
+
+            threads = {self.thread_ids[stage]: name for stage, name in self.thread_names.items()}
+            for thread_id, thread_name in threads.items():
+                events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread_id, 'args': {'name': thread_name}})
+
+            for frame, row in zip(range(self.nb_frame-len(rows), self.nb_frame), rows):
+                start = self.frame_starts[row]
+                events.append({
+                    'name': 'frame', 'cat': 'frame', 'ph': 'X', 'pid': pid, 'tid': 0,
+                    'ts': (start-origin)*1e6, 'dur': (self.frame_ends[row]-start)*1e6, 'args': {'frame': frame}
+                })
+                for stage, index in self.stage_index.items():
+                    if np.isnan(self.durations[row, index]): continue
+                    events.append({
+                        'name': stage, 'cat': 'stage', 'ph': 'X', 'pid': pid, 'tid': self.thread_ids.get(stage, 0),
+                        'ts': (start-origin+self.offsets[row, index])*1e6, 'dur': self.durations[row, index]*1e6, 'args': {'frame': frame}
+                    })
+
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+
+
+##### Memory #####
+
+# Peak resident memory of the process in MB, None where the platform does not tell it
+def peak_rss_mb() -> float:
+    if resource is None: return None
+
+    # Linux counts in kB, macOS in bytes
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak/2**20 if sys.platform == 'darwin' else peak/2**10
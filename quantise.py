@@ -0,0 +1,149 @@
+from utils import QuantiseMode, accelerate_quantisation_lut3d, colour_lut
+import numpy as np
+import time
+
+
+# Bits kept per channel to index the nearest colour table, 5 bits give a 96 KB table
+LUT_BITS = 5
+
+# Share of the colour histogram that has to change between two frames to start a new scene
+SCENE_THRESHOLD = 0.5
+
+# Fixed palettes, as hexadecimal RGB colours
+PALETTES = {
+    'cga': ['000000', '55ffff', 'ff55ff', 'ffffff'],
+    'gameboy': ['0f380f', '306230', '8bac0f', '9bbc0f'],
+    'ega': ['000000', '0000aa', '00aa00', '00aaaa', 'aa0000', 'aa00aa', 'aa5500', 'aaaaaa', '555555', '5555ff', '55ff55', '55ffff', 'ff5555', 'ff55ff', 'ffff55', 'ffffff'],
+    'c64': ['000000', 'ffffff', '880000', 'aaffee', 'cc44cc', '00cc55', '0000aa', 'eeee77', 'dd8855', '664400', 'ff7777', '333333', '777777', 'aaff66', '0088ff', 'bbbbbb'],
+    'pico8': ['000000', '1d2b53', '7e2553', '008751', 'ab5236', '5f574f', 'c2c3c7', 'fff1e8', 'ff004d', 'ffa300', 'ffec27', '00e436', '29adff', '83769c', 'ff77a8', 'ffccaa'],
+    'grey16': [f'{value:02x}'*3 for value in range(0, 256, 17)],
+    'websafe': [f'{r:02x}{g:02x}{b:02x}' for r in range(0, 256, 51) for g in range(0, 256, 51) for b in range(0, 256, 51)]
+}
+
+
+##### Palettes #####
+
+# (K, 3) colours of a named palette
+def palette_colours(name: str) -> np.ndarray:
+    if name not in PALETTES:
+        raise ValueError(f'Unknown palette: {name}, expected one of {", ".join(PALETTES)}')
+    return np.array([[int(colour[i:i+2], 16) for i in (0, 2, 4)] for colour in PALETTES[name]], dtype=np.uint8)
+
+# Index of the nearest colour of every pixel, by squared distance in RGB
+def nearest_colours(pixels: np.ndarray, colours: np.ndarray) -> np.ndarray:
+    pixels = pixels.astype(np.float32)
+    colours = colours.astype(np.float32)
+    distances = (colours*colours).sum(axis=1) - 2*pixels @ colours.T
+    return distances.argmin(axis=1)
+
+# Table of the nearest palette colour of every bin of the colour cube, each bin being represented by its centre
+def nearest_lut(colours: np.ndarray, bits: int =LUT_BITS) -> np.ndarray:
+    shift = 8-bits
+    centres = (np.arange(2**bits) << shift) + (1 << shift)//2
+    cube = np.stack(np.meshgrid(centres, centres, centres, indexing='ij'), axis=-1).reshape(-1, 3)
+
+    lut = np.empty_like(cube, dtype=np.uint8)
+    for start in range(0, len(cube), 8192):
+        lut[start:start+8192] = colours[nearest_colours(cube[start:start+8192], colours)]
+    return lut
+
+# Random sample of at most max_samples pixels of an image
+def sample_pixels(image: np.ndarray, max_samples: int, seed: int =0) -> np.ndarray:
+    pixels = image.reshape(-1, 3)
+    if len(pixels) <= max_samples: return pixels
+    return pixels[np.random.default_rng(seed).choice(len(pixels), max_samples, replace=False)]
+
+# Palette of the nb_colours centres found by k-means, seeded with k-means++ on a sample of the pixels
+def kmeans_palette(image: np.ndarray, nb_colours: int, iterations: int =10, max_samples: int =4096, seed: int =0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    pixels = sample_pixels(image, max_samples, seed).astype(np.float32)
+
+    centres = [pixels[rng.integers(len(pixels))]]
+    distances = ((pixels-centres[0])**2).sum(axis=1)
+    while len(centres) < nb_colours and distances.sum() > 0:
+        centres.append(pixels[rng.choice(len(pixels), p=distances/distances.sum())])
+        distances = np.minimum(distances, ((pixels-centres[-1])**2).sum(axis=1))
+    centres = np.array(centres)
+
+    for _ in range(iterations):
+        labels = nearest_colours(pixels, centres)
+        counts = np.bincount(labels, minlength=len(centres))
+        sums = np.stack([np.bincount(labels, weights=pixels[:, channel], minlength=len(centres)) for channel in range(3)], axis=1)
+
+        # Empty clusters keep their centre
+        moved = centres.copy()
+        moved[counts > 0] = sums[counts > 0]/counts[counts > 0, None]
+        if np.abs(moved-centres).max() < 0.5: break
+        centres = moved
+    return np.unique(np.rint(centres).clip(0, 255).astype(np.uint8), axis=0)
+
+# Palette of the mean colours of nb_colours boxes, the box with the widest channel being split at its median
+def median_cut_palette(image: np.ndarray, nb_colours: int, max_samples: int =16384) -> np.ndarray:
+    boxes = [sample_pixels(image, max_samples)]
+    while len(boxes) < nb_colours:
+        ranges = [np.ptp(box, axis=0).max() if len(box) > 1 else -1 for box in boxes]
+        index = int(np.argmax(ranges))
+        if ranges[index] <= 0: break
+
+        box = boxes.pop(index)
+        channel = np.ptp(box, axis=0).argmax()
+        box = box[box[:, channel].argsort(kind='stable')]
+        boxes += [box[:len(box)//2], box[len(box)//2:]]
+    return np.unique(np.rint([box.mean(axis=0) for box in boxes]).astype(np.uint8), axis=0)
+
+# Normalised histogram of the colours in 4 levels per channel, compared to detect the changes of scene
+def colour_histogram(image: np.ndarray) -> np.ndarray:
+    channels = (image.reshape(-1, 3) >> 6).astype(np.intp)
+    histogram = np.bincount((channels[:, 0] << 4) | (channels[:, 1] << 2) | channels[:, 2], minlength=64)
+    return histogram/max(1, len(channels))
+
+
+##### Quantiser #####
+
+# Quantise the (width, height, 3) cells of the frames before the conversion kernels
+# UNIFORM is done by the kernels themselves through the lookup table per channel,
+# the other modes replace the colours through the nearest colour table and give the kernels an identity table
+class Quantiser:
+    def __init__(self, mode: QuantiseMode =QuantiseMode.UNIFORM, colour_lvl: int =8, palette: str ='pico8', nb_colours: int =16, scene_threshold: float =SCENE_THRESHOLD, bits: int =LUT_BITS) -> None:
+        self.mode = mode
+        self.colour_lvl = colour_lvl
+        self.nb_colours = nb_colours
+        self.scene_threshold = scene_threshold
+        self.bits = bits
+        self.adaptive = mode in (QuantiseMode.KMEANS, QuantiseMode.MEDIAN_CUT)
+
+        self.lut = colour_lut(colour_lvl) if mode == QuantiseMode.UNIFORM else np.arange(256, dtype=np.uint8)
+        self.colours = palette_colours(palette) if mode == QuantiseMode.PALETTE else None
+        self.nearest = nearest_lut(self.colours, bits) if self.colours is not None else None
+        self.out = None
+
+        # Histogram of the frame the adaptive palette was fitted on
+        self.scene = None
+        self.nb_fit = 0
+        self.fit_time = 0.0
+
+    # Fit a new palette when the frame starts a new scene
+    def update(self, image: np.ndarray) -> bool:
+        histogram = colour_histogram(image)
+        if self.scene is not None and np.abs(histogram-self.scene).sum()/2 < self.scene_threshold: return False
+
+        start = time.perf_counter()
+        if self.mode == QuantiseMode.KMEANS:
+            self.colours = kmeans_palette(image, self.nb_colours)
+        else:
+            self.colours = median_cut_palette(image, self.nb_colours)
+        self.nearest = nearest_lut(self.colours, self.bits)
+        self.scene = histogram
+        self.nb_fit += 1
+        self.fit_time += time.perf_counter()-start
+        return True
+
+    # Image given to the conversion kernels, along with self.lut
+    def apply(self, image: np.ndarray) -> np.ndarray:
+        if self.mode == QuantiseMode.UNIFORM: return image
+
+        if self.adaptive:
+            self.update(image)
+        if self.out is None or self.out.shape != image.shape:
+            self.out = np.empty_like(image)
+        return accelerate_quantisation_lut3d(image, self.nearest, self.bits, self.out)
@@ -0,0 +1,135 @@
+import numpy as np
+import subprocess
+import tempfile
+import os
+
+
+# Executable used to encode the videos
+FFMPEG = 'ffmpeg'
+
+
+##### Recording Backends #####
+
+# Encode frames on the fly by streaming them as raw RGB into a long-lived ffmpeg process
+class FFmpegRecorder:
+    def __init__(self, output_path: str, width: int, height: int, fps: float, audio_path: str =None, crf: int =25, audio_start: float =None) -> None:
+        self.output_path = output_path
+
+        # The video is encoded under a temporary name and only takes its name once ffmpeg finished it,
+        # so that a recording cut short is never taken for a done one
+        root, extention = os.path.splitext(output_path)
+        self.part_path = f'{root}.part{extention}'
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.audio_path = audio_path
+        self.crf = crf
+
+        # Time of the source the first frame comes from, the audio starts there too and stops with the frames
+        # None keeps the whole audio
+        self.audio_start = audio_start
+
+        self.process = None
+        self.log = None
+        self.message = ''
+        self.returncode = None
+        self.nb_frame = 0
+        self.row = 0
+
+    def command(self) -> list:
+        command = [
+            FFMPEG, '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{self.width}x{self.height}', '-r', str(self.fps), '-i', '-'
+        ]
+        if self.audio_path and self.audio_start is not None:
+            command += ['-ss', str(self.audio_start), '-i', self.audio_path, '-map', '0:v', '-map', '1:a?', '-shortest']
+        elif self.audio_path:
+            command += ['-i', self.audio_path, '-map', '0:v', '-map', '1:a?']
+        command += ['-crf', str(self.crf), '-vcodec', 'libx264', '-pix_fmt', 'yuv420p', self.part_path]
+        return command
+
+    # Start the ffmpeg process, its messages go to a temporary file so that a full stderr pipe never blocks it
+    def start(self) -> None:
+        self.close_log()
+        self.log = tempfile.TemporaryFile()
+        self.message = ''
+        self.process = subprocess.Popen(self.command(), stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=self.log)
+        self.returncode = None
+        self.nb_frame = 0
+        self.row = 0
+
+    # Write one frame, blocking while ffmpeg is behind so that frames never pile up in memory
+    def write(self, frame: np.ndarray) -> bool:
+        if frame.shape != (self.height, self.width, 3):
+            raise ValueError(f'Frame of shape {frame.shape} does not match the {self.width}x{self.height} recording')
+        return self.write_rows(frame)
+
+    # Write the next rows of the frame being streamed, so that a frame can be sent in strips without ever being whole
+    # The frame is counted once its last row is written
+    def write_rows(self, rows: np.ndarray) -> bool:
+        if self.process is None: return False
+
+        if rows.shape[1:] != (self.width, 3) or self.row+rows.shape[0] > self.height:
+            raise ValueError(f'Rows of shape {rows.shape} do not fit in the {self.width}x{self.height} frame from row {self.row}')
+
+        try:
+            self.process.stdin.write(np.ascontiguousarray(rows, dtype=np.uint8).data)
+        except (BrokenPipeError, OSError):
+            # ffmpeg stopped on its own, its exit status tells why
+            self.close()
+            return False
+
+        self.row += rows.shape[0]
+        if self.row == self.height:
+            self.row = 0
+            self.nb_frame += 1
+        return True
+
+    # Flush the last frames and wait for ffmpeg to finish the file, return its exit status
+    def close(self) -> int:
+        if self.process is None: return self.returncode
+
+        try:
+            self.process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        self.returncode = self.process.wait()
+        self.process = None
+        self.close_log()
+
+        if self.returncode == 0:
+            os.replace(self.part_path, self.output_path)
+        elif os.path.exists(self.part_path):
+            os.remove(self.part_path)
+        return self.returncode
+
+    # Stop ffmpeg without finishing the file and remove the partial output
+    def abort(self) -> int:
+        if self.process is None: return self.returncode
+
+        self.process.kill()
+        try:
+            self.process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        self.returncode = self.process.wait()
+        self.process = None
+        self.close_log()
+
+        if os.path.exists(self.part_path):
+            os.remove(self.part_path)
+        return self.returncode
+
+    # Keep the messages of ffmpeg once it exited and close its log, so that long-lived processes do not pile up open files
+    def close_log(self) -> None:
+        if self.log is None: return
+        self.log.seek(0)
+        self.message = self.log.read().decode(errors='replace').strip()
+        self.log.close()
+        self.log = None
+
+    # Messages written by ffmpeg, useful when it exits with an error
+    def error_message(self) -> str:
+        if self.log is None: return self.message
+        self.log.seek(0)
+        return self.log.read().decode(errors='replace').strip()
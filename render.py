@@ -0,0 +1,475 @@
+from PIL import Image, ImageDraw, ImageFont
+import numpy as np
+import cv2
+
+
+##### Glyph Atlas #####
+
+# Atlases already rasterised, keyed by (font, characters, element size)
+# The font is stored alongside its atlas so that its id can not be reused
+_ATLAS_CACHE = {}
+
+# Stack of glyph coverage tiles, one per character of an ASCII set
+class GlyphAtlas:
+    def __init__(self, font, chars: str, element_size: int) -> None:
+        self.font = font
+        self.chars = chars
+        self.element_size = element_size
+
+        # Cells covered by the glyphs around their own cell, as they can spill over their neighbours
+        bboxes = [font.getbbox(char) for char in chars]
+        self.cell_left = min(0, min(bbox[0] for bbox in bboxes)//element_size)
+        self.cell_top = min(0, min(bbox[1] for bbox in bboxes)//element_size)
+        self.cell_right = max(0, -(-max(bbox[2] for bbox in bboxes)//element_size)-1)
+        self.cell_bottom = max(0, -(-max(bbox[3] for bbox in bboxes)//element_size)-1)
+        self.fits = self.cell_left == self.cell_top == self.cell_right == self.cell_bottom == 0
+
+        # The last tile is left blank and used for the cells that must not be drawn
+        self.blank = len(chars)
+        tile_width = (self.cell_right-self.cell_left+1)*element_size
+        tile_height = (self.cell_bottom-self.cell_top+1)*element_size
+        self.tiles = np.zeros((len(chars)+1, tile_height, tile_width), dtype=np.uint8)
+
+        # Rasterise each character once, the same way ImageDraw.text draws it in a cell
+        for char_index, char in enumerate(chars):
+            tile = Image.new('L', (tile_width, tile_height), 0)
+            ImageDraw.Draw(tile).text((-self.cell_left*element_size, -self.cell_top*element_size), char, fill=255, font=font)
+            self.tiles[char_index] = np.asarray(tile)
+
+        # Split the tiles into one pass per neighbouring cell, skipping the empty ones
+        # Passes are ordered so that every pixel is blended in the order PIL draws the cells
+        self.passes = []
+        for dx in range(self.cell_right, self.cell_left-1, -1):
+            for dy in range(self.cell_bottom, self.cell_top-1, -1):
+                x, y = (dx-self.cell_left)*element_size, (dy-self.cell_top)*element_size
+                sub_tiles = np.ascontiguousarray(self.tiles[:, y:y+element_size, x:x+element_size])
+                if sub_tiles.any():
+                    self.passes.append((dx, dy, sub_tiles))
+
+        # Share of a cell inked by each glyph, the ink spilling over the neighbouring cells included
+        self.ink = self.tiles.reshape(len(self.tiles), -1).sum(axis=1, dtype=np.int64)/(255*element_size*element_size)
+        self.char_luts = {}
+        self.shape_matchers = {}
+
+    # Table from the luma of a cell to the index of its glyph, blank for the cells left empty
+    # The linear table spreads the luma evenly over the glyphs in the order of the set, skipping the glyph at skip_index,
+    # the calibrated one picks the glyph whose ink is nearest to the luma, the ink being rescaled to the range of the set
+    def char_lut(self, skip_index: int, calibrated: bool =False, reverse: bool =False) -> np.ndarray:
+        key = (skip_index, calibrated, reverse)
+        if key in self.char_luts: return self.char_luts[key]
+
+        nb_char = len(self.chars)
+        luma = np.arange(256)
+        if not calibrated:
+            char_index = (luma*((nb_char-1)/255)).astype(np.int64)
+            lut = np.where(char_index != skip_index, char_index, self.blank)
+        else:
+            ink = self.ink[:nb_char]
+            span = ink.max()-ink.min()
+            level = (ink-ink.min())/span if span > 0 else np.linspace(0, 1, nb_char)
+
+            # Dark glyphs on a light background: the more ink, the darker the cell
+            if reverse: level = 1-level
+            char_index = np.abs(level[None, :]-luma[:, None]/255).argmin(axis=1)
+            lut = np.where(ink[char_index] > 0, char_index, self.blank)
+
+        self.char_luts[key] = np.ascontiguousarray(lut, dtype=np.uint8)
+        return self.char_luts[key]
+
+    # Matcher of the cells to the shapes of the glyphs, built once per atlas
+    def shape_matcher(self, reverse: bool =False) -> 'ShapeMatcher':
+        if reverse not in self.shape_matchers:
+            self.shape_matchers[reverse] = ShapeMatcher(self, reverse)
+        return self.shape_matchers[reverse]
+
+    # Neighbouring cells whose glyphs can reach a cell, as (left, top, right, bottom) counts of cells
+    def context(self) -> tuple:
+        return self.cell_right, self.cell_bottom, -self.cell_left, -self.cell_top
+
+    # Build the coverage mask of a frame from a (width, height) grid of character indices
+    # Only valid when the glyphs fit in their cell
+    def coverage(self, char_grid: np.ndarray) -> np.ndarray:
+        width, height = char_grid.shape
+        tiles = self.tiles[char_grid.T]
+        return tiles.swapaxes(1, 2).reshape(height*self.element_size, width*self.element_size)
+
+    # Composite a single colour frame into out
+    # The atlas is shared, the scratch canvas of the glyphs spilling over their neighbours is given by the caller
+    def compose(self, char_grid: np.ndarray, fg: tuple, bg: tuple, out: np.ndarray, canvas: np.ndarray =None) -> None:
+        if not self.fits:
+            width, height = char_grid.shape
+            colours = np.broadcast_to(np.array(fg, dtype=np.uint8), (width, height, 3))
+            self.compose_passes(char_grid, colours, bg, out, canvas)
+            return
+
+        coverage = self.coverage(char_grid)
+        lut = blend_lut(fg, bg)
+        out[:coverage.shape[0], :coverage.shape[1]] = lut[coverage]
+
+    # Composite a frame where each cell has its own colour from a (width, height, 3) grid
+    def compose_colour(self, char_grid: np.ndarray, colour_grid: np.ndarray, bg: tuple, out: np.ndarray, canvas: np.ndarray =None) -> None:
+        if not self.fits:
+            self.compose_passes(char_grid, colour_grid, bg, out, canvas)
+            return
+
+        width, height = char_grid.shape
+        size = self.element_size
+
+        coverage = self.coverage(char_grid).reshape(height, size, width, size, 1)
+        colours = colour_grid.transpose(1, 0, 2).reshape(height, 1, width, 1, 3)
+
+        blended = blend(colours, np.array(bg, dtype=np.uint16), coverage)
+        out[:height*size, :width*size] = blended.reshape(height*size, width*size, 3)
+
+    # Composite glyphs spilling over their neighbours, blending one neighbouring cell offset at a time
+    # The blending works on a canvas made of whole cells covering the output: out itself when it is made of whole cells,
+    # else the canvas given, allocated when it is missing or of another size
+    def compose_passes(self, char_grid: np.ndarray, colour_grid: np.ndarray, bg: tuple, out: np.ndarray, canvas: np.ndarray =None) -> None:
+        width, height = char_grid.shape
+        size = self.element_size
+
+        cells_width, cells_height = -(-out.shape[1]//size), -(-out.shape[0]//size)
+        shape = (cells_height*size, cells_width*size, 3)
+        if out.shape == shape:
+            canvas = out
+        elif canvas is None or canvas.shape != shape:
+            canvas = np.empty(shape, dtype=np.uint8)
+        canvas[:] = bg
+
+        for dx, dy, sub_tiles in self.passes:
+            # Source cells landing inside the canvas once shifted by (dx, dy)
+            x0, x1 = max(0, -dx), min(width, cells_width-dx)
+            y0, y1 = max(0, -dy), min(height, cells_height-dy)
+            if x0 >= x1 or y0 >= y1: continue
+            nb_x, nb_y = x1-x0, y1-y0
+
+            coverage = sub_tiles[char_grid[x0:x1, y0:y1].T].swapaxes(1, 2).reshape(nb_y, size, nb_x, size, 1)
+            colours = colour_grid[x0:x1, y0:y1].transpose(1, 0, 2).reshape(nb_y, 1, nb_x, 1, 3)
+
+            region = canvas[(y0+dy)*size:(y1+dy)*size, (x0+dx)*size:(x1+dx)*size]
+            region[:] = blend(colours, region.reshape(nb_y, size, nb_x, size, 3), coverage).reshape(nb_y*size, nb_x*size, 3)
+
+        if canvas is not out:
+            out[:] = canvas[:out.shape[0], :out.shape[1]]
+
+# Default font of the process, loaded once so that the renderers set up one after the other share its atlases
+_DEFAULT_FONT = None
+
+def default_font() -> ImageFont.FreeTypeFont:
+    global _DEFAULT_FONT
+    if _DEFAULT_FONT is None:
+        _DEFAULT_FONT = ImageFont.load_default()
+    return _DEFAULT_FONT
+
+# Get the atlas of a set of characters, rasterising it only the first time
+def get_glyph_atlas(font, chars: str, element_size: int) -> GlyphAtlas:
+    key = (id(font), chars, element_size)
+    if key not in _ATLAS_CACHE:
+        _ATLAS_CACHE[key] = (font, GlyphAtlas(font, chars, element_size))
+    return _ATLAS_CACHE[key][1]
+
+
+##### Shape Matching #####
+
+# Side of the block of luma samples describing the shape of a cell
+SHAPE_BLOCK = 4
+
+# Cells matched per matrix product, so that their distances to the glyphs stay a few MB
+SHAPE_CHUNK = 16384
+
+# Glyph of every cell nearest to its shape: the luma of the cell sampled on a block of block x block
+# is compared with the ink of each glyph in its own cell, sampled the same way
+class ShapeMatcher:
+    def __init__(self, atlas: GlyphAtlas, reverse: bool =False, block: int =SHAPE_BLOCK) -> None:
+        size = atlas.element_size
+        nb_char = len(atlas.chars)
+        self.block = min(block, size)
+
+        # Ink of each glyph in its own cell, rescaled so that the densest glyph is as bright as a white cell on average
+        # The samples brighter than white are clipped, a cell can not be matched above white
+        x, y = -atlas.cell_left*size, -atlas.cell_top*size
+        tiles = atlas.tiles[:nb_char, y:y+size, x:x+size].astype(np.float32)/255
+        ink = np.stack([cv2.resize(tile, (self.block, self.block), interpolation=cv2.INTER_AREA) for tile in tiles]).reshape(nb_char, -1)
+        ink = np.minimum(ink/max(float(ink.mean(axis=1).max()), 1e-6), 1)
+
+        # Dark glyphs on a light background: the more ink, the darker the cell
+        shapes = 1-ink if reverse else ink
+
+        # Nearest glyph by argmin of |shape|^2 - 2 cell.shape, the norm of the cell being the same for every glyph
+        self.weights = np.ascontiguousarray(-2*shapes.T, dtype=np.float32)
+        self.bias = (shapes**2).sum(axis=1).astype(np.float32)
+
+        # The glyphs without ink are left blank, those only inking their neighbours are never picked
+        empty = ink.sum(axis=1) == 0
+        self.bias[empty & (atlas.ink[:nb_char] > 0)] = np.inf
+        self.indices = np.where(empty, atlas.blank, np.arange(nb_char)).astype(np.uint8)
+
+    # Fill out, a (width, height) grid, with the glyphs matching the (height*block, width*block) luma samples
+    def match(self, luma: np.ndarray, out: np.ndarray) -> np.ndarray:
+        width, height = out.shape
+        block = self.block
+        cells = luma[:height*block, :width*block].reshape(height, block, width, block).transpose(2, 0, 1, 3).reshape(width*height, block*block)
+
+        flat = out.reshape(-1)
+        for start in range(0, len(cells), SHAPE_CHUNK):
+            distances = (cells[start:start+SHAPE_CHUNK].astype(np.float32)*(1/255)) @ self.weights
+            distances += self.bias
+            flat[start:start+SHAPE_CHUNK] = self.indices[distances.argmin(axis=1)]
+        return out
+
+
+##### Pixel Blocks #####
+
+# Composite pixel art from a (width, height, 3) grid of colours, drawing only the drawn cells
+# ImageDraw.rectangle includes its last row and column, so every block overlaps the first
+# row and column of the next cells: those are resolved in the order PIL draws the cells
+def compose_pixels(colour_grid: np.ndarray, drawn: np.ndarray, element_size: int, bg: tuple, out: np.ndarray) -> None:
+    width, height = drawn.shape
+    size = element_size
+    cells_width, cells_height = -(-out.shape[1]//size), -(-out.shape[0]//size)
+
+    # Cell grids in (row, column) order, with a leading undrawn cell to look back from the first ones
+    colours = np.zeros((cells_height+1, cells_width+1, 3), dtype=np.uint8)
+    mask = np.zeros((cells_height+1, cells_width+1), dtype=bool)
+    colours[1:height+1, 1:width+1] = colour_grid.transpose(1, 0, 2)
+    mask[1:height+1, 1:width+1] = drawn.T
+
+    bg = np.array(bg, dtype=np.uint8)
+
+    # Write straight into out when it is made of whole cells
+    if out.shape[:2] == (cells_height*size, cells_width*size) and out.flags.c_contiguous:
+        canvas = out
+    else:
+        canvas = np.empty((cells_height*size, cells_width*size, 3), dtype=np.uint8)
+
+    # Scale the blocks up by nearest neighbour
+    blocks = resolve_cells(bg, (colours[1:, 1:], mask[1:, 1:]))
+    cv2.resize(blocks, (cells_width*size, cells_height*size), dst=canvas, interpolation=cv2.INTER_NEAREST)
+
+    # Fix the first row and column of the cells that are not drawn, the only ones showing their neighbours
+    rows = np.flatnonzero(~mask[1:, 1:].all(axis=1))
+    columns = np.flatnonzero(~mask[1:, 1:].all(axis=0))
+    if len(rows):
+        row_cells = resolve_cells(bg, (colours[rows, 1:], mask[rows, 1:]), (colours[rows+1, 1:], mask[rows+1, 1:]))
+        canvas[rows*size] = np.repeat(row_cells, size, axis=1)
+
+        column_cells = resolve_cells(bg, (colours[1:, columns], mask[1:, columns]), (colours[1:, columns+1], mask[1:, columns+1]))
+        canvas[:, columns*size] = np.repeat(column_cells, size, axis=0)
+
+        rows, columns = rows[:, None], columns[None, :]
+        corner_cells = resolve_cells(
+            bg,
+            (colours[rows, columns], mask[rows, columns]),
+            (colours[rows+1, columns], mask[rows+1, columns]),
+            (colours[rows, columns+1], mask[rows, columns+1]),
+            (colours[rows+1, columns+1], mask[rows+1, columns+1])
+        )
+        canvas[rows*size, columns*size] = corner_cells
+
+    if canvas is not out:
+        out[:] = canvas[:out.shape[0], :out.shape[1]]
+
+# Colour of the last drawn cell among (colours, mask) candidates given in drawing order, bg if none is drawn
+def resolve_cells(bg: np.ndarray, *candidates: tuple) -> np.ndarray:
+    colours, mask = candidates[-1]
+    result = colours.copy()
+    missing = ~mask
+
+    # Walk back through the earlier cells only where the later ones are not drawn
+    for colours, mask in candidates[-2::-1]:
+        found = missing & mask
+        result[found] = colours[found]
+        missing &= ~mask
+
+    result[missing] = bg
+    return result
+
+# Pixel blocks overlap the first row and column of the next cells, so a cell shows its left and top neighbours
+PIXEL_CONTEXT = (1, 1, 0, 0)
+
+
+##### Delta Rendering #####
+
+# Redraw only the cells that changed since the previous frame onto a persistent output
+# The grids are copied into padded grids covering every cell of the output plus the context cells around them,
+# the changed cells are spread to the cells they can reach, and dirty tiles are redrawn by horizontal runs
+class DeltaRenderer:
+    def __init__(self, out_shape: tuple, element_size: int, context: tuple, fills: tuple, tile_size: int =8) -> None:
+        self.element_size = element_size
+        self.left, self.top, self.right, self.bottom = context
+        self.fills = fills
+        self.tile_size = tile_size
+
+        # Cells of the output, including the partial ones on the right and bottom edges
+        self.out_shape = out_shape[:2]
+        self.cells_width, self.cells_height = -(-out_shape[1]//element_size), -(-out_shape[0]//element_size)
+        self.tiles_width, self.tiles_height = -(-self.cells_width//tile_size), -(-self.cells_height//tile_size)
+
+        self.current = None
+        self.previous = None
+        self.nb_frame = 0
+        self.nb_full = 0
+        self.changed_ratio = 1.0
+        self.changed_total = 0.0
+
+    def reset(self) -> None:
+        self.previous = None
+
+    # Average share of the cells that changed between two frames
+    def mean_changed_ratio(self) -> float:
+        return self.changed_total/self.nb_frame if self.nb_frame else 0.0
+
+    def allocate(self, grids: tuple) -> list:
+        width = self.tiles_width*self.tile_size + self.left + self.right
+        height = self.tiles_height*self.tile_size + self.top + self.bottom
+        return [np.full((width, height)+grid.shape[2:], fill, dtype=grid.dtype) for grid, fill in zip(grids, self.fills)]
+
+    # Redraw the cells of the (width, height, ...) grids that changed into out, return the share of the cells that changed
+    # compose(*grids, out) draws grids of cells into an output of whole cells
+    # Everything is redrawn on the first frame and when more than full_redraw_ratio of the cells changed
+    def render(self, grids: tuple, compose, out: np.ndarray, full_redraw_ratio: float =0.5) -> float:
+        width, height = grids[0].shape[:2]
+        if self.current is None:
+            self.current, self.previous = self.allocate(grids), None
+        for padded, grid in zip(self.current, grids):
+            padded[self.left:self.left+width, self.top:self.top+height] = grid
+
+        changed = None
+        if self.previous is not None:
+            changed = np.zeros((width, height), dtype=bool)
+            for current, previous in zip(self.current, self.previous):
+                different = current[self.left:self.left+width, self.top:self.top+height] != previous[self.left:self.left+width, self.top:self.top+height]
+                changed |= different.reshape(width, height, -1).any(axis=2)
+            self.changed_ratio = float(changed.mean()) if changed.size else 0.0
+        else:
+            self.changed_ratio = 1.0
+
+        if changed is None or self.changed_ratio > full_redraw_ratio:
+            compose(*grids, out)
+            self.nb_full += 1
+        elif self.changed_ratio:
+            self.render_tiles(self.dirty_tiles(changed), compose, out)
+
+        # The grids of this frame become the reference of the next one
+        if self.previous is None:
+            self.previous = self.allocate(grids)
+        self.current, self.previous = self.previous, self.current
+
+        self.nb_frame += 1
+        self.changed_total += self.changed_ratio
+        return self.changed_ratio
+
+    # Tiles holding a changed cell or a cell reached by the glyphs of a changed cell
+    def dirty_tiles(self, changed: np.ndarray) -> np.ndarray:
+        size = self.tile_size
+        width, height = changed.shape
+
+        # A change at cell c shows on the cells from c-right to c+left, and from c-bottom to c+top
+        spread = np.zeros((self.tiles_width*size + self.right + self.left, self.tiles_height*size + self.bottom + self.top), dtype=bool)
+        for dx in range(-self.right, self.left+1):
+            for dy in range(-self.bottom, self.top+1):
+                x, y = self.right+dx, self.bottom+dy
+                spread[x:x+width, y:y+height] |= changed
+
+        affected = spread[self.right:self.right+self.tiles_width*size, self.bottom:self.bottom+self.tiles_height*size]
+        return affected.reshape(self.tiles_width, size, self.tiles_height, size).any(axis=(1, 3))
+
+    # Draw the runs of dirty tiles of each row of tiles with their context, and copy them into out
+    def render_tiles(self, tiles: np.ndarray, compose, out: np.ndarray) -> None:
+        size, element_size = self.tile_size, self.element_size
+        out_height, out_width = self.out_shape
+
+        for tile_y in np.flatnonzero(tiles.any(axis=0)):
+            row = np.concatenate(([False], tiles[:, tile_y], [False]))
+            edges = np.flatnonzero(row[1:] != row[:-1])
+            for tile_x0, tile_x1 in zip(edges[::2], edges[1::2]):
+                x0, x1 = tile_x0*size, tile_x1*size
+                y0, y1 = tile_y*size, (tile_y+1)*size
+
+                # Padded grids start self.left cells before the cells of the output, so the context is already in place
+                sub_grids = [padded[x0:x1+self.left+self.right, y0:y1+self.top+self.bottom] for padded in self.current]
+                canvas = np.empty(((y1-y0+self.top+self.bottom)*element_size, (x1-x0+self.left+self.right)*element_size, 3), dtype=np.uint8)
+                compose(*sub_grids, canvas)
+
+                # Keep the cells of the tiles, cropped to the output
+                px0, px1 = x0*element_size, min(x1*element_size, out_width)
+                py0, py1 = y0*element_size, min(y1*element_size, out_height)
+                if px0 >= px1 or py0 >= py1: continue
+                cx, cy = self.left*element_size, self.top*element_size
+                out[py0:py1, px0:px1] = canvas[cy:cy+py1-py0, cx:cx+px1-px0]
+
+
+##### Strip Rendering #####
+
+# Bytes used per pixel of the strip canvas while it is composed: the canvas, the rows of the output and the blending temporaries
+STRIP_PIXEL_BYTES = 32
+
+# Bytes kept per cell of a frame: the cells and their colours and luma, the grids, their padded copies and the quantised colours
+FRAME_CELL_BYTES = 20
+
+# Decoded frames held at once, by the decoder for its own use and by the conversion
+DECODED_FRAMES = 4
+
+# Draw frames in horizontal strips of strip_cells rows of cells, for outputs too large to be held in memory
+# The grids are copied into padded grids holding the context cells around the output, so that each strip
+# is composed with the cells whose glyphs reach it and gets the same pixels as a frame drawn at once
+# Every strip is composed on a canvas of the same size, the last one being padded with empty cells
+class StripRenderer:
+    def __init__(self, out_shape: tuple, element_size: int, context: tuple, fills: tuple, strip_cells: int) -> None:
+        self.element_size = element_size
+        self.left, self.top, self.right, self.bottom = context
+        self.fills = fills
+
+        # Cells of the output, including the partial ones on the right and bottom edges
+        self.out_shape = out_shape[:2]
+        self.cells_width, self.cells_height = -(-out_shape[1]//element_size), -(-out_shape[0]//element_size)
+
+        # Strips of the same height, so that the last one does not compose a mostly empty canvas
+        self.nb_strip = -(-self.cells_height//max(1, min(strip_cells, self.cells_height)))
+        self.strip_cells = -(-self.cells_height//self.nb_strip)
+
+        self.padded = None
+        self.canvas = np.empty(((self.strip_cells+self.top+self.bottom)*element_size, (self.cells_width+self.left+self.right)*element_size, 3), dtype=np.uint8)
+        self.strip = np.empty((self.strip_cells*element_size, out_shape[1], 3), dtype=np.uint8)
+
+    def allocate(self, grids: tuple) -> list:
+        width = self.cells_width + self.left + self.right
+        height = self.nb_strip*self.strip_cells + self.top + self.bottom
+        return [np.full((width, height)+grid.shape[2:], fill, dtype=grid.dtype) for grid, fill in zip(grids, self.fills)]
+
+    # Draw the (width, height, ...) grids strip after strip, handing the rows of the output of each strip to write
+    # compose(*grids, out) draws grids of cells into an output of whole cells, write(rows) returns False to stop
+    def render(self, grids: tuple, compose, write) -> bool:
+        width, height = grids[0].shape[:2]
+        if self.padded is None:
+            self.padded = self.allocate(grids)
+        for padded, grid in zip(self.padded, grids):
+            padded[self.left:self.left+width, self.top:self.top+height] = grid
+
+        size = self.element_size
+        out_height, out_width = self.out_shape
+        cx, cy = self.left*size, self.top*size
+        for y0 in range(0, self.cells_height, self.strip_cells):
+            y1 = y0+self.strip_cells
+
+            # Padded grids start self.top cells before the cells of the output, so the context is already in place
+            compose(*[padded[:, y0:y1+self.top+self.bottom] for padded in self.padded], self.canvas)
+
+            rows = self.strip[:min(y1*size, out_height)-y0*size]
+            rows[:] = self.canvas[cy:cy+len(rows), cx:cx+out_width]
+            if not write(rows): return False
+        return True
+
+
+##### Blending Functions #####
+
+# Blend ink over bg with coverage alpha, with the same rounding as PIL draw_bitmap
+def blend(ink: np.ndarray, bg: np.ndarray, alpha: np.ndarray) -> np.ndarray:
+    alpha = alpha.astype(np.uint16)
+    tmp = ink.astype(np.uint16)*alpha + bg.astype(np.uint16)*(255-alpha) + 128
+    return ((tmp + (tmp >> 8)) >> 8).astype(np.uint8)
+
+# Lookup table of the colour obtained for every coverage value of a glyph
+def blend_lut(fg: tuple, bg: tuple) -> np.ndarray:
+    alpha = np.arange(256, dtype=np.uint16).reshape(256, 1)
+    return blend(np.array(fg, dtype=np.uint16), np.array(bg, dtype=np.uint16), alpha)
@@ -0,0 +1,202 @@
+from recorder import FFMPEG, FFmpegRecorder
+import subprocess
+import tempfile
+import shutil
+import json
+import os
+
+
+# Version of the manifest, a manifest of another version is started again
+MANIFEST_VERSION = 1
+
+
+##### Segment Manifest #####
+
+# Frame ranges [first, last) of segment_frames frames covering [first, last), the last one can be shorter
+def plan_segments(first: int, last: int, segment_frames: int) -> list:
+    return [(start, min(start+segment_frames, last)) for start in range(first, last, segment_frames)]
+
+# Record of the segments already encoded, kept next to them and written atomically after every segment
+# The key covers everything the frames depend on, a manifest with another key is from another recording
+class SegmentManifest:
+    def __init__(self, folder: str, key: str) -> None:
+        self.folder = folder
+        self.path = os.path.join(folder, 'manifest.json')
+        self.key = key
+        self.segments = []
+        self.complete = False
+
+    # Read the manifest of the folder, return False if there is none for this key
+    def load(self) -> bool:
+        try:
+            with open(self.path) as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return False
+        if data.get('version') != MANIFEST_VERSION or data.get('key') != self.key: return False
+
+        # Only the segments whose file is still there are kept
+        self.segments = [segment for segment in data['segments'] if os.path.exists(self.segment_path(segment['index']))]
+        self.complete = data.get('complete', False) and len(self.segments) == len(data['segments'])
+        return True
+
+    def save(self) -> None:
+        data = {'version': MANIFEST_VERSION, 'key': self.key, 'complete': self.complete, 'segments': self.segments}
+        with open(f'{self.path}.tmp', 'w') as file:
+            json.dump(data, file, indent=1)
+        os.replace(f'{self.path}.tmp', self.path)
+
+    def segment_path(self, index: int) -> str:
+        return os.path.join(self.folder, f'segment_{index:05d}.mp4')
+
+    def add(self, index: int, first: int, nb_frame: int) -> None:
+        self.segments = [segment for segment in self.segments if segment['index'] != index]
+        self.segments.append({'index': index, 'first': first, 'frames': nb_frame})
+        self.segments.sort(key=lambda segment: segment['index'])
+        self.save()
+
+    # Number of segments done from the first one without a gap
+    def nb_done(self) -> int:
+        indices = {segment['index'] for segment in self.segments}
+        nb_done = 0
+        while nb_done in indices:
+            nb_done += 1
+        return nb_done
+
+    def paths(self) -> list:
+        return [self.segment_path(segment['index']) for segment in self.segments if segment['frames']]
+
+# Join encoded segments without encoding them again, adding the audio of the source from audio_start seconds, the whole audio when None
+# Return the ffmpeg exit status and its messages
+def concat_segments(paths: list, output_path: str, audio_path: str =None, audio_start: float =None) -> tuple:
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as file:
+        for path in paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            file.write(f"file '{escaped}'\n")
+        list_path = file.name
+
+    command = [FFMPEG, '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', list_path]
+    if audio_path and audio_start is not None:
+        command += ['-ss', str(audio_start), '-i', audio_path, '-map', '0:v', '-map', '1:a?', '-shortest']
+    elif audio_path:
+        command += ['-i', audio_path, '-map', '0:v', '-map', '1:a?']
+    # Joined under a temporary name, so that a join cut short is never taken for the output
+    root, extention = os.path.splitext(output_path)
+    part_path = f'{root}.part{extention}'
+    command += ['-c:v', 'copy', part_path]
+
+    process = None
+    try:
+        process = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    finally:
+        os.remove(list_path)
+        if (process is None or process.returncode) and os.path.exists(part_path):
+            os.remove(part_path)
+    if process.returncode == 0:
+        os.replace(part_path, output_path)
+    return process.returncode, process.stderr.decode(errors='replace').strip()
+
+
+##### Segmented Recording #####
+
+# Record into segments of segment_frames frames encoded on their own, with the same interface as FFmpegRecorder
+# Segment i holds the frames from first + i*segment_frames, the frames have to be written in order without gaps
+# The segments done are kept when the recording is cancelled or crashes, the next recording resumes after them,
+# and closing the recording joins them into the output
+class SegmentedRecorder:
+    def __init__(self, output_path: str, width: int, height: int, fps: float, audio_path: str, segment_frames: int, first: int, key: str, audio_start: float =None) -> None:
+        self.output_path = output_path
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.audio_path = audio_path
+        self.segment_frames = segment_frames
+        self.first = first
+
+        # Time of the source the audio starts from, None keeps the whole audio, as FFmpegRecorder does
+        self.audio_start = audio_start
+
+        self.manifest = SegmentManifest(f'{os.path.splitext(output_path)[0]}.segments', key)
+        self.segment = None
+        self.index = 0
+        self.returncode = None
+        self.message = ''
+        self.nb_frame = 0
+
+    def start(self) -> None:
+        os.makedirs(self.manifest.folder, exist_ok=True)
+        if not self.manifest.load():
+            # Segments of another recording, they can not be reused
+            shutil.rmtree(self.manifest.folder, ignore_errors=True)
+            os.makedirs(self.manifest.folder)
+            self.manifest.save()
+
+        self.index = self.manifest.nb_done()
+        self.segment = None
+        self.returncode = None
+        self.nb_frame = 0
+
+    # Frame of the video the recording goes on from, None if all the frames are already encoded
+    def resume_frame(self) -> int:
+        if self.manifest.complete: return None
+        return self.first + self.index*self.segment_frames
+
+    def open_segment(self) -> None:
+        # The segment is encoded under a temporary name and only takes its name once finished
+        self.segment = FFmpegRecorder(self.manifest.segment_path(self.index), self.width, self.height, self.fps)
+        self.segment.start()
+
+    # Finish the segment being written and record it in the manifest
+    def close_segment(self) -> bool:
+        segment, self.segment = self.segment, None
+        if segment.close():
+            self.returncode = segment.returncode
+            self.message = segment.error_message()
+            return False
+
+        self.manifest.add(self.index, self.first + self.index*self.segment_frames, segment.nb_frame)
+        self.index += 1
+        return True
+
+    def write(self, frame) -> bool:
+        if frame.shape != (self.height, self.width, 3):
+            raise ValueError(f'Frame of shape {frame.shape} does not match the {self.width}x{self.height} recording')
+        return self.write_rows(frame)
+
+    # Write the next rows of the frame being streamed, a new segment is only started between two frames
+    def write_rows(self, rows) -> bool:
+        if self.segment is not None and self.segment.nb_frame >= self.segment_frames and self.segment.row == 0:
+            if not self.close_segment(): return False
+        if self.segment is None:
+            self.open_segment()
+
+        if not self.segment.write_rows(rows):
+            self.returncode = self.segment.returncode
+            self.message = self.segment.error_message()
+            return False
+        if self.segment.row == 0:
+            self.nb_frame += 1
+        return True
+
+    # Encode the last segment and join all of them into the output, the segments are removed once joined
+    def close(self) -> int:
+        if self.segment is not None and not self.close_segment():
+            return self.returncode
+
+        self.manifest.complete = True
+        self.manifest.save()
+
+        self.returncode, self.message = concat_segments(self.manifest.paths(), self.output_path, self.audio_path, self.audio_start)
+        if self.returncode == 0:
+            shutil.rmtree(self.manifest.folder, ignore_errors=True)
+        return self.returncode
+
+    # Stop the segment being written, the segments already done are kept for the next recording
+    def abort(self) -> int:
+        if self.segment is not None:
+            self.returncode = self.segment.abort()
+            self.segment = None
+        return self.returncode
+
+    def error_message(self) -> str:
+        return self.message
@@ -0,0 +1,493 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from cli import is_up_to_date, parse_settings
+from images import convert_image
+from utils import EXTENTIONS, IMAGE_EXTENTIONS, RecordBackend, is_image, warm_up_kernels
+from ASCIIXEL import ASCIIXEL
+from live import is_live
+from urllib.parse import urlsplit, parse_qsl
+import multiprocessing as mp
+import threading
+import mimetypes
+import shutil
+import signal
+import argparse
+import asyncio
+import json
+import time
+import sys
+import os
+import cv2
+
+
+# Jobs waiting for a worker before new jobs are refused
+MAX_QUEUED = 64
+
+# Size of an uploaded video or image
+MAX_UPLOAD_MB = 1024
+
+# Seconds between the progress events of a job
+PROGRESS_INTERVAL = 0.25
+
+# Jobs over, kept to be listed and to serve their result, the oldest are forgotten first
+MAX_FINISHED = 256
+
+# Size of the chunks of the uploads and the results
+CHUNK_BYTES = 2**20
+
+HTTP_REASONS = {
+    200: 'OK',
+    202: 'Accepted',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    409: 'Conflict',
+    411: 'Length Required',
+    413: 'Payload Too Large',
+    500: 'Internal Server Error',
+    503: 'Service Unavailable'
+}
+
+
+##### Workers #####
+
+# Queue of the progress events and jobs to stop, shared with the service by the workers of the pool
+worker_events = None
+worker_cancelled = None
+
+# Stop the rendering of a job, raised between two frames
+class JobCancelled(Exception):
+    pass
+
+# Prepare a process of the pool once: the kernels compiled or loaded, the font and the atlas of the default settings
+# rasterised, so that the jobs it runs afterwards start on their first frame
+def init_worker(events, cancelled) -> None:
+    global worker_events, worker_cancelled
+    worker_events = events
+    worker_cancelled = cancelled
+    warm_up_kernels(background=False)
+    ASCIIXEL(prefetch=0).setup_render((256, 256))
+
+# Frames left to render once an ASCIIXEL is set up, None when it is not known
+def expected_frames(app: ASCIIXEL) -> int:
+    if app.live is not None: return None
+    count = int(app.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    if count <= 0: return None
+    if app.end_frame is not None:
+        count = min(count, app.end_frame)
+    return max(0, count-app.source_index)
+
+# Render a job on a worker, sending its progress and stopping between two frames when it is cancelled, return its report
+def render_job(job: int, settings: dict, output: str) -> dict:
+    report = {'status': 'done', 'frames': 0, 'time': 0.0, 'fps': 0.0}
+    start = time.perf_counter()
+
+    # The images reuse the renderers the worker already prepared for their size and settings
+    # A cancelled image is not saved
+    if is_image(settings['path']):
+        report.update(convert_image(settings, settings['path'], output, os.path.splitext(output)[1][1:], force=True, cancelled=lambda: job in worker_cancelled))
+        report.pop('image')
+        return report
+
+    app = ASCIIXEL(**settings)
+    app.output_dir = os.path.dirname(output)
+    if not app.setup():
+        raise RuntimeError(f'Can not read {settings["path"]}')
+    total = expected_frames(app)
+
+    last_event = time.perf_counter()
+    def on_frame() -> None:
+        nonlocal last_event
+        if time.perf_counter()-last_event < PROGRESS_INTERVAL: return
+        last_event = time.perf_counter()
+        if job in worker_cancelled:
+            raise JobCancelled()
+        worker_events.put({'job': job, 'status': 'running', 'frames': app.nb_frame, 'total': total, 'fps': app.nb_frame/(last_event-start)})
+
+    try:
+        code = app.render(on_frame)
+    except JobCancelled:
+        app.cancel_record()
+        app.close_live()
+        report['status'] = 'cancelled'
+        code = None
+
+    report['time'] = time.perf_counter()-start
+    report['frames'] = app.nb_frame
+    report['fps'] = app.nb_frame/report['time'] if report['time'] else 0.0
+    if app.delta is not None:
+        report['changed'] = app.delta.mean_changed_ratio()
+    if app.prefetcher is not None:
+        report['prefetch'] = app.prefetcher.stats()
+    if app.live is not None:
+        report['live'] = app.live.stats()
+    if code:
+        report['status'] = 'failed'
+        report['error'] = f'ffmpeg exited with status {code}'
+    return report
+
+
+##### Render Service #####
+
+# Error answered to a request, with its HTTP status
+class ServiceError(Exception):
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+# Jobs given over HTTP, rendered on a pool of warm worker processes
+# The jobs wait in the service until a worker is free, so that a job waiting can be cancelled without touching the pool
+class RenderService:
+    def __init__(self, nb_workers: int =2, max_queued: int =MAX_QUEUED, upload_dir: str ='uploads', max_upload_mb: int =MAX_UPLOAD_MB) -> None:
+        self.nb_workers = max(1, nb_workers)
+        self.max_queued = max_queued
+        self.upload_dir = upload_dir
+        self.max_upload = max_upload_mb*2**20
+
+        self.context = mp.get_context('spawn')
+        self.manager = self.context.Manager()
+        self.events = self.manager.Queue()
+        self.cancelled = self.manager.dict()
+        self.pool = None
+
+        self.jobs = {}
+        self.next_id = 1
+        self.slots = None
+        self.loop = None
+
+    def new_pool(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.nb_workers, mp_context=self.context, initializer=init_worker, initargs=(self.events, self.cancelled))
+
+    # Start the workers, warming them up all at once rather than on the first jobs
+    async def start(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.slots = asyncio.Semaphore(self.nb_workers)
+        self.pool = self.new_pool()
+        await asyncio.gather(*(self.loop.run_in_executor(self.pool, time.sleep, 0) for _ in range(self.nb_workers)))
+
+        # The events of the workers are read on a thread and handed to the loop
+        self.reader = threading.Thread(target=self.read_events, name='service-events', daemon=True)
+        self.reader.start()
+
+    def close(self) -> None:
+        for job in self.jobs.values():
+            if job['status'] == 'running':
+                self.cancelled[job['id']] = True
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        self.events.put(None)
+        self.reader.join()
+        self.manager.shutdown()
+
+    def read_events(self) -> None:
+        while True:
+            event = self.events.get()
+            if event is None: return
+            self.loop.call_soon_threadsafe(self.publish, event)
+
+    # Record an event of a job and wake up the clients following it
+    def publish(self, event: dict) -> None:
+        job = self.jobs.get(event['job'])
+        if job is None or (job['finished'] is not None and event['status'] == 'running'): return
+        job.update({key: value for key, value in event.items() if key != 'job'})
+        job['events'].append(event)
+        changed, job['changed'] = job['changed'], asyncio.Event()
+        changed.set()
+
+    # Settings of a job, refused when they are invalid or when the queue is full
+    def check(self, raw: dict) -> dict:
+        try:
+            settings = {'record': True, **parse_settings(raw)}
+        except (ValueError, KeyError) as error:
+            raise ServiceError(400, f'invalid settings: {error}')
+        if sum(job['status'] == 'queued' for job in self.jobs.values()) >= self.max_queued:
+            raise ServiceError(503, f'{self.max_queued} jobs already queued')
+        return settings
+
+    # Add a job, return it
+    # The output of an uploaded file goes in the folder of the upload, so that uploads of the same name never share it
+    def submit(self, raw: dict, upload: str =None) -> dict:
+        settings = self.check(raw)
+        path = settings.get('path')
+        if not path:
+            raise ServiceError(400, 'the job has no path')
+        if not is_live(path) and not os.path.isfile(path):
+            raise ServiceError(404, f'input not found: {path}')
+        if is_live(path) and settings.get('end') is None:
+            raise ServiceError(400, 'a camera or a stream needs an end, the duration of its capture')
+
+        # Every worker renders a single job, nothing shows the frames
+        # The PNG backend encodes through a frames folder shared by the process, the pipe gives the same video
+        settings.update({'nb_workers': 1, 'display_original': False})
+        if settings.get('record_backend') == RecordBackend.PNG:
+            settings['record_backend'] = RecordBackend.PIPE
+
+        app = ASCIIXEL(**settings)
+        if upload is not None:
+            app.output_dir = upload
+        app.setup_output_name()
+        output = app.output_path()
+        for job in self.jobs.values():
+            if job['output'] == output and job['status'] in ('queued', 'running'):
+                raise ServiceError(409, f'job {job["id"]} is already rendering {output}')
+
+        job = {'id': self.next_id, 'path': path, 'settings': raw, 'output': output, 'status': 'queued', 'frames': 0, 'total': None,
+               'error': None, 'report': None, 'submitted': time.time(), 'started': None, 'finished': None,
+               'upload': upload, 'events': [], 'changed': asyncio.Event(), 'task': None}
+        self.next_id += 1
+        self.jobs[job['id']] = job
+        self.publish({'job': job['id'], 'status': 'queued'})
+
+        # Outputs newer than their input are served as they are
+        if not is_live(path) and not is_image(path) and is_up_to_date(app):
+            self.finish(job, {'status': 'skipped', 'frames': 0, 'time': 0.0, 'fps': 0.0})
+        else:
+            job['task'] = asyncio.create_task(self.run(job, settings))
+        return job
+
+    async def run(self, job: dict, settings: dict) -> None:
+        async with self.slots:
+            job['started'] = time.time()
+            self.publish({'job': job['id'], 'status': 'running', 'frames': 0})
+            pool = self.pool
+            try:
+                report = await self.loop.run_in_executor(pool, render_job, job['id'], settings, job['output'])
+            except BrokenProcessPool:
+                # A worker died, the jobs it took down fail and the next ones get a new pool
+                if pool is self.pool:
+                    self.pool = self.new_pool()
+                report = {'status': 'failed', 'error': 'the worker rendering the job stopped'}
+            except Exception as error:
+                report = {'status': 'failed', 'error': str(error) or type(error).__name__}
+            self.cancelled.pop(job['id'], None)
+        self.finish(job, report)
+
+    def finish(self, job: dict, report: dict) -> None:
+        job['finished'] = time.time()
+        job['report'] = report
+        job['error'] = report.get('error')
+        self.publish({'job': job['id'], **{key: value for key, value in report.items() if key in ('status', 'frames', 'error')}})
+        self.forget()
+
+    def forget(self) -> None:
+        finished = [job for job in self.jobs.values() if job['finished'] is not None]
+        for job in finished[:max(0, len(finished)-MAX_FINISHED)]:
+            del self.jobs[job['id']]
+            if job['upload'] is not None:
+                shutil.rmtree(job['upload'], ignore_errors=True)
+
+    # Cancel a job: a job waiting is dropped, a job rendering stops after its current frame without keeping its output
+    def cancel(self, job: dict) -> None:
+        if job['status'] == 'queued' and job['task'] is not None:
+            job['task'].cancel()
+            self.finish(job, {'status': 'cancelled', 'frames': 0})
+        elif job['status'] == 'running':
+            self.cancelled[job['id']] = True
+
+    # Events of a job from its submission, then as they come until it is over
+    async def follow(self, job: dict):
+        index = 0
+        while True:
+            changed = job['changed']
+            while index < len(job['events']):
+                index += 1
+                yield job['events'][index-1]
+            if job['finished'] is not None: return
+            await changed.wait()
+
+    # State of a job, without its events
+    def describe(self, job: dict) -> dict:
+        return {key: value for key, value in job.items() if key not in ('upload', 'events', 'changed', 'task')}
+
+    def health(self) -> dict:
+        statuses = [job['status'] for job in self.jobs.values()]
+        return {'workers': self.nb_workers, 'running': statuses.count('running'), 'queued': statuses.count('queued'), 'max_queued': self.max_queued}
+
+
+##### HTTP API #####
+
+# Minimal HTTP/1.1 server of the service, one request per connection:
+#   GET    /health               workers and jobs waiting
+#   POST   /jobs                 a JSON job with a path and settings, or an uploaded file with ?name=video.mp4&setting=value
+#   GET    /jobs                 all the jobs
+#   GET    /jobs/<id>            one job
+#   GET    /jobs/<id>/events     progress events of the job as JSON lines, until it is over
+#   GET    /jobs/<id>/result     output of the job once done
+#   DELETE /jobs/<id>            cancel the job
+class ServiceServer:
+    def __init__(self, service: RenderService) -> None:
+        self.service = service
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            try:
+                method, target, headers = await self.read_head(reader)
+                url = urlsplit(target)
+                await self.route(method, url.path.rstrip('/') or '/', dict(parse_qsl(url.query)), headers, reader, writer)
+            except ServiceError as error:
+                await self.send_json(writer, error.status, {'error': str(error)})
+            except (ConnectionError, asyncio.IncompleteReadError):
+                raise
+            except Exception as error:
+                await self.send_json(writer, 500, {'error': str(error) or type(error).__name__})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            # The client left, there is no one to answer
+            pass
+        finally:
+            writer.close()
+
+    async def read_head(self, reader: asyncio.StreamReader) -> tuple:
+        try:
+            method, target, _ = (await reader.readline()).decode('latin-1').split()
+        except ValueError:
+            raise ServiceError(400, 'malformed request line')
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''): break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return method.upper(), target, headers
+
+    async def route(self, method: str, path: str, query: dict, headers: dict, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        parts = path.strip('/').split('/')
+        if parts == ['health'] and method == 'GET':
+            return await self.send_json(writer, 200, self.service.health())
+
+        if parts[0] != 'jobs':
+            raise ServiceError(404, f'no route {path}')
+        if len(parts) == 1:
+            if method == 'GET':
+                return await self.send_json(writer, 200, [self.service.describe(job) for job in self.service.jobs.values()])
+            if method == 'POST':
+                raw, upload = await self.read_job(query, headers, reader)
+                try:
+                    job = self.service.submit(raw, upload)
+                except ServiceError:
+                    if upload is not None:
+                        shutil.rmtree(upload, ignore_errors=True)
+                    raise
+                return await self.send_json(writer, 202, self.service.describe(job))
+            raise ServiceError(405, f'{method} not allowed on {path}')
+
+        job = self.service.jobs.get(int(parts[1])) if parts[1].isdigit() else None
+        if job is None:
+            raise ServiceError(404, f'no job {parts[1]}')
+        if len(parts) == 2 and method == 'GET':
+            return await self.send_json(writer, 200, self.service.describe(job))
+        if len(parts) == 2 and method == 'DELETE':
+            self.service.cancel(job)
+            return await self.send_json(writer, 202, self.service.describe(job))
+        if parts[2:] == ['events'] and method == 'GET':
+            return await self.send_events(writer, job)
+        if parts[2:] == ['result'] and method == 'GET':
+            return await self.send_result(writer, job)
+        raise ServiceError(404, f'no route {method} {path}')
+
+    # Settings of a job sent as JSON, or of an uploaded file given in the query, the file saved in a folder of its own
+    # Return the settings and the folder of the upload, the settings of an upload are checked before its file is read
+    async def read_job(self, query: dict, headers: dict, reader: asyncio.StreamReader) -> dict:
+        if 'content-length' not in headers:
+            raise ServiceError(411, 'the body needs a Content-Length')
+        length = int(headers['content-length'])
+
+        if headers.get('content-type', '').startswith('application/json'):
+            try:
+                raw = json.loads(await reader.readexactly(length))
+            except ValueError as error:
+                raise ServiceError(400, f'invalid JSON: {error}')
+            if not isinstance(raw, dict):
+                raise ServiceError(400, 'the job has to be a JSON object')
+            return raw, None
+
+        name = os.path.basename(query.pop('name', ''))
+        if os.path.splitext(name)[1].lower() not in EXTENTIONS+IMAGE_EXTENTIONS:
+            raise ServiceError(400, f'the upload needs a name with one of the extentions {", ".join(EXTENTIONS+IMAGE_EXTENTIONS)}')
+        if length > self.service.max_upload:
+            raise ServiceError(413, f'uploads are limited to {self.service.max_upload//2**20} MB')
+        self.service.check(query)
+
+        folder = os.path.join(self.service.upload_dir, f'{time.time_ns():x}')
+        os.makedirs(folder)
+        path = os.path.join(folder, name)
+        try:
+            with open(path, 'wb') as file:
+                while length > 0:
+                    chunk = await reader.read(min(CHUNK_BYTES, length))
+                    if not chunk: raise ServiceError(400, 'upload shorter than its Content-Length')
+                    file.write(chunk)
+                    length -= len(chunk)
+        except BaseException:
+            # A partial upload is never rendered
+            shutil.rmtree(folder, ignore_errors=True)
+            raise
+        return {**query, 'path': path}, folder
+
+    async def send_head(self, writer: asyncio.StreamWriter, status: int, content_type: str, length: int =None) -> None:
+        head = f'HTTP/1.1 {status} {HTTP_REASONS[status]}\r\nContent-Type: {content_type}\r\nConnection: close\r\n'
+        if length is not None:
+            head += f'Content-Length: {length}\r\n'
+        writer.write((head+'\r\n').encode('latin-1'))
+
+    async def send_json(self, writer: asyncio.StreamWriter, status: int, value: object) -> None:
+        body = json.dumps(value, default=str).encode()
+        await self.send_head(writer, status, 'application/json', len(body))
+        writer.write(body)
+        await writer.drain()
+
+    # Stream the events as JSON lines, the end of the stream is the end of the connection
+    async def send_events(self, writer: asyncio.StreamWriter, job: dict) -> None:
+        await self.send_head(writer, 200, 'application/x-ndjson')
+        async for event in self.service.follow(job):
+            writer.write(json.dumps(event, default=str).encode()+b'\n')
+            await writer.drain()
+
+    async def send_result(self, writer: asyncio.StreamWriter, job: dict) -> None:
+        if job['status'] not in ('done', 'skipped'):
+            raise ServiceError(409, f'job {job["id"]} is {job["status"]}')
+        if not os.path.isfile(job['output']):
+            raise ServiceError(404, f'output not found: {job["output"]}')
+
+        await self.send_head(writer, 200, mimetypes.guess_type(job['output'])[0] or 'application/octet-stream', os.path.getsize(job['output']))
+        with open(job['output'], 'rb') as file:
+            while chunk := file.read(CHUNK_BYTES):
+                writer.write(chunk)
+                await writer.drain()
+
+
+##### Command Line #####
+
+async def serve(host: str, port: int, service: RenderService) -> None:
+    await service.start()
+    server = await asyncio.start_server(ServiceServer(service).handle, host, port)
+    print(f'ASCIIXEL service on http://{host}:{port} with {service.nb_workers} workers', flush=True)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='Render jobs given over a local HTTP API on a pool of warm workers.')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on, local only by default')
+    parser.add_argument('--port', type=int, default=8750, help='port to listen on')
+    parser.add_argument('--workers', dest='nb_workers', type=int, default=2, help='worker processes, each rendering one job at a time')
+    parser.add_argument('--max-queued', dest='max_queued', type=int, default=MAX_QUEUED, help='jobs waiting for a worker before new jobs are refused')
+    parser.add_argument('--upload-dir', dest='upload_dir', default='uploads', help='folder of the uploaded files')
+    parser.add_argument('--max-upload-mb', dest='max_upload_mb', type=int, default=MAX_UPLOAD_MB, help='size limit of an uploaded file')
+    return parser
+
+def main(argv: list =None) -> int:
+    args = build_parser().parse_args(argv)
+    service = RenderService(args.nb_workers, args.max_queued, args.upload_dir, args.max_upload_mb)
+
+    # Terminated as on Ctrl+C: the jobs rendering are cancelled and the workers stopped
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        asyncio.run(serve(args.host, args.port, service))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
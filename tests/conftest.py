@@ -0,0 +1,55 @@
+import sys
+import os
+
+# The modules of the repository are imported from its root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import recorder
+import segments
+import pytest
+import stat
+import cv2
+
+
+# Stand-in for ffmpeg: the raw frames streamed to it, or the segments it joins, are copied as they are into its output
+FAKE_FFMPEG = '''
+import shutil
+import sys
+
+output = sys.argv[-1]
+if 'concat' in sys.argv:
+    paths = [line.strip()[len("file '"):-1] for line in open(sys.argv[sys.argv.index('-i')+1]) if line.strip()]
+    with open(output, 'wb') as file:
+        for path in paths:
+            with open(path, 'rb') as segment:
+                shutil.copyfileobj(segment, file)
+else:
+    with open(output, 'wb') as file:
+        shutil.copyfileobj(sys.stdin.buffer, file)
+'''
+
+
+@pytest.fixture
+def fake_ffmpeg(tmp_path, monkeypatch) -> str:
+    path = tmp_path / 'ffmpeg'
+    path.write_text(f'#!{sys.executable}\n{FAKE_FFMPEG}')
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setattr(recorder, 'FFMPEG', str(path))
+    monkeypatch.setattr(segments, 'FFMPEG', str(path))
+    # Found first on the path by the processes started by the test, which import their own recorder
+    monkeypatch.setenv('PATH', f'{tmp_path}{os.pathsep}{os.environ["PATH"]}')
+    return str(path)
+
+# Small video of nb_frame frames of a gradient moving from one frame to the next
+@pytest.fixture
+def video(tmp_path) -> str:
+    path = str(tmp_path / 'clip.avi')
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 10, (96, 72))
+    x = np.arange(96, dtype=np.uint8)
+    for index in range(12):
+        frame = np.empty((72, 96, 3), dtype=np.uint8)
+        frame[:] = (x[None, :, None]*2 + index*16).astype(np.uint8)
+        writer.write(frame)
+    writer.release()
+    return path
@@ -0,0 +1,70 @@
+from utils import OutputType, QuantiseMode
+from cache import RenderCache
+from ASCIIXEL import ASCIIXEL
+import numpy as np
+import pytest
+
+
+def render_frames(app: ASCIIXEL) -> list:
+    assert app.setup()
+    frames = []
+    while True:
+        app.draw()
+        if app.finish: return frames
+        frames.append(app.frame_array().copy())
+
+# Run a preview the way the GUI does: the same renderer set up again and stepped until the end
+def preview_frames(app: ASCIIXEL) -> list:
+    app.reset()
+    app.record = False
+    assert app.setup()
+    frames = []
+    while not app.finish:
+        app.runStep()
+        if app.finish: break
+        frames.append(app.frame_array().copy())
+    return frames
+
+
+@pytest.mark.parametrize('quantise', [QuantiseMode.UNIFORM, QuantiseMode.KMEANS])
+def test_second_run_takes_the_frames_from_the_cache(video, quantise):
+    cache = RenderCache()
+    first = render_frames(ASCIIXEL(path=video, quantise=quantise, prefetch=0, cache=cache))
+    hits = cache.hits
+
+    app = ASCIIXEL(path=video, quantise=quantise, prefetch=0, cache=cache)
+    second = render_frames(app)
+    assert app.caches_frames()
+    assert cache.hits-hits == len(second) == 11
+    for cached, rendered in zip(second, first):
+        np.testing.assert_array_equal(cached, rendered)
+
+
+def test_frames_quantised_per_scene_are_not_cached(video):
+    app = ASCIIXEL(path=video, output_type=OutputType.ASCII_COLOUR, quantise=QuantiseMode.KMEANS, prefetch=0, cache=RenderCache())
+    assert app.setup()
+    assert not app.caches_frames()
+
+
+def test_preview_with_new_colours_reuses_the_cells(video, monkeypatch):
+    app = ASCIIXEL(path=video, output_type=OutputType.ASCII_COLOUR, cache=RenderCache())
+    preview_frames(app)
+
+    # Only the palette and the colours change, the grid stays the same
+    app.ascii_set = 1
+    app.colour_lvl = 4
+    app.reverse_colour = True
+
+    decoded = []
+    preprocess = ASCIIXEL.preprocess
+    monkeypatch.setattr(ASCIIXEL, 'preprocess', lambda self, *args: decoded.append(1) or preprocess(self, *args))
+    hits = app.cache.hits
+    frames = preview_frames(app)
+    monkeypatch.undo()
+
+    assert not decoded
+    assert app.cache.hits-hits == len(frames) == 11
+
+    expected = render_frames(ASCIIXEL(path=video, output_type=OutputType.ASCII_COLOUR, ascii_set=1, colour_lvl=4, reverse_colour=True, prefetch=0))
+    for reused, rendered in zip(frames, expected):
+        np.testing.assert_array_equal(reused, rendered)
@@ -0,0 +1,76 @@
+from cli import load_manifest, main, parse_settings, run_job
+from utils import OutputType, RenderEngine
+import pytest
+import json
+import os
+
+
+def test_settings_are_parsed_and_unknown_keys_rejected():
+    settings = parse_settings({'path': 'clip.mp4', 'output_type': 'ascii_colour', 'engine': '1', 'resolution': '320x240',
+                               'reverse_colour': 'yes', 'incremental': '0', 'element_size': '', 'start': '1.5'})
+    assert settings == {'path': 'clip.mp4', 'output_type': OutputType.ASCII_COLOUR, 'engine': RenderEngine.NUMPY, 'resolution': (320, 240),
+                        'reverse_colour': True, 'incremental': False, 'start': 1.5}
+
+    with pytest.raises(ValueError, match='Unknown setting: colour'):
+        parse_settings({'path': 'clip.mp4', 'colour': 3})
+    with pytest.raises(ValueError, match='Invalid boolean'):
+        parse_settings({'record': 'maybe'})
+
+
+def test_manifests_list_the_jobs_with_their_settings(tmp_path):
+    path = tmp_path / 'jobs.json'
+    path.write_text(json.dumps([{'path': 'a.mp4', 'element_size': 12}, {'path': 'b.mp4'}]))
+    assert load_manifest(str(path)) == [{'path': 'a.mp4', 'element_size': 12}, {'path': 'b.mp4'}]
+
+    # The empty cells of a CSV keep the defaults
+    path = tmp_path / 'jobs.csv'
+    path.write_text('path,element_size,reverse_colour\na.mp4,12,\nb.mp4,,true\n')
+    jobs = load_manifest(str(path))
+    assert [parse_settings(job) for job in jobs] == [{'path': 'a.mp4', 'element_size': 12}, {'path': 'b.mp4', 'reverse_colour': True}]
+
+    path.write_text('path,element_size\na.mp4,12\n,8\n')
+    with pytest.raises(ValueError, match='Job without path'):
+        load_manifest(str(path))
+
+
+def test_up_to_date_outputs_are_skipped_unless_forced(video, fake_ffmpeg, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    settings = {'path': video, 'record': True, 'element_size': 8, 'prefetch': 0}
+
+    report = run_job(settings)
+    assert report['status'] == 'done'
+    assert report['frames'] == 11
+    assert os.path.getsize(report['output']) == 11*96*72*3
+
+    assert run_job(settings)['status'] == 'skipped'
+    assert run_job(settings, force=True)['status'] == 'done'
+
+    # A newer input is rendered again
+    os.utime(video, (os.path.getmtime(report['output'])+10,)*2)
+    assert run_job(settings)['status'] == 'done'
+
+    report = run_job({**settings, 'path': str(tmp_path / 'missing.avi')})
+    assert (report['status'], report['error']) == ('failed', 'input not found')
+
+
+def test_command_line_runs_the_inputs_and_the_manifest(video, fake_ffmpeg, tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    manifest = tmp_path / 'jobs.json'
+    manifest.write_text(json.dumps([{'path': video, 'reverse_colour': True}]))
+
+    assert main([video, '--manifest', str(manifest), '--element-size', '8', '--prefetch', '0']) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 3
+    assert all('11 frames in' in line for line in lines[:2])
+    assert lines[2].startswith('2 done, 0 skipped, 0 failed')
+    assert len(os.listdir(tmp_path / 'outputs')) == 2
+
+    # Run again, the outputs are up to date, a missing input fails the run
+    assert main([video, str(tmp_path / 'missing.avi'), '--element-size', '8']) == 1
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].endswith('skipped (up to date)')
+    assert lines[1].endswith('failed (input not found)')
+    assert lines[2].startswith('0 done, 1 skipped, 1 failed')
+
+    with pytest.raises(SystemExit):
+        main([])
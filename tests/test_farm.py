@@ -0,0 +1,62 @@
+from farm import RenderQueue, run_worker
+import cv2
+import os
+
+
+def test_segment_taken_over_keeps_the_render_of_its_new_worker(video, tmp_path):
+    queue = RenderQueue(str(tmp_path / 'farm.db'))
+    job = queue.submit({'path': video}, segment_frames=100)
+
+    # The first worker goes silent and its segment is given to a second one
+    first = queue.claim('first')
+    second = queue.claim('second', stale_timeout=-1)
+    assert (second['job'], second['index']) == (first['job'], first['index'])
+    assert (first['attempt'], second['attempt']) == (1, 2)
+
+    paths = []
+    for worker, segment in (('first', first), ('second', second)):
+        path = queue.render_path(job, segment['index'], worker, segment['attempt'])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as file:
+            file.write(worker)
+        paths.append(path)
+    assert paths[0] != paths[1]
+
+    # The late render of the first worker is dropped, the one of the worker holding the claim is kept
+    assert not queue.complete('first', job, first['index'], first['attempt'], 12, paths[0])
+    assert not os.path.exists(paths[0])
+    assert queue.complete('second', job, second['index'], second['attempt'], 12, paths[1])
+    with open(queue.segment_path(job, second['index'])) as file:
+        assert file.read() == 'second'
+    assert queue.segments(job)[0]['status'] == 'done'
+    queue.close()
+
+RealCapture = cv2.VideoCapture
+
+# Capture reporting fewer frames than the video has, as some variable frame rate or badly muxed files do
+class UnderestimatedCapture:
+    def __init__(self, path) -> None:
+        self.cap = RealCapture(path)
+
+    def get(self, prop: int) -> float:
+        if prop == cv2.CAP_PROP_FRAME_COUNT: return 5.0
+        return self.cap.get(prop)
+
+    def __getattr__(self, name: str):
+        return getattr(self.cap, name)
+
+
+def test_underestimated_frame_count_renders_to_the_end(video, fake_ffmpeg, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(cv2, 'VideoCapture', UnderestimatedCapture)
+    queue = RenderQueue(str(tmp_path / 'farm.db'))
+    job = queue.submit({'path': video}, segment_frames=2)
+    assert [(segment['first'], segment['last']) for segment in queue.segments(job)] == [(1, 3), (3, 5)]
+
+    assert run_worker(queue, 'worker', poll=0) == 2
+    assert queue.stitch() == [job]
+
+    # The fake ffmpeg keeps the raw frames, the output holds the 11 frames after the one read by setup, as a single render does
+    output = queue.jobs()[0]['output']
+    assert os.path.getsize(output) == 11*96*72*3
+    queue.close()
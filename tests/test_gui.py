@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('PySide6')
+pytest.importorskip('qdarkstyle')
+
+from MainApplication import array_to_qimage
+
+
+def image_pixels(image) -> np.ndarray:
+    return np.array([[image.pixelColor(x, y).getRgb()[:3] for x in range(image.width())] for y in range(image.height())], dtype=np.uint8)
+
+
+# Rows of 39 and 42 bytes are not aligned on 4 bytes as QImage assumes by default
+@pytest.mark.parametrize('width', [12, 13, 14])
+def test_qimage_wraps_the_array_without_copying_it(width):
+    array = np.random.default_rng(0).integers(0, 256, (9, width, 3), dtype=np.uint8)
+
+    image = array_to_qimage(array)
+    assert (image.width(), image.height()) == (width, 9)
+    assert image.bytesPerLine() == array.strides[0] == width*3
+    np.testing.assert_array_equal(image_pixels(image), array)
+
+    # The image reads the memory of the array, a frame drawn into it shows without a new image
+    array[4, 7] = (1, 2, 3)
+    assert image.pixelColor(7, 4).getRgb()[:3] == (1, 2, 3)
+    array[:] = 255-array
+    np.testing.assert_array_equal(image_pixels(image), array)
@@ -0,0 +1,19 @@
+from live import LiveClock
+
+
+def test_frames_last_until_the_capture_of_the_next_one():
+    clock = LiveClock(10)
+
+    # Slot k at k/10 s shows the last frame captured by then
+    assert clock.frames_due(100.0) == 0    # nothing held before the first frame
+    assert clock.frames_due(100.05) == 1   # the first frame fills slot 0
+    assert clock.frames_due(100.25) == 2   # the frame of 100.05 fills slots 1 and 2
+    assert clock.frames_due(100.28) == 0   # the frame of 100.25 is replaced before its slot starts
+    assert clock.frames_due(100.3) == 0    # so is the frame of 100.28, the frame of 100.3 starts slot 3 exactly
+    assert clock.frames_due(100.41) == 2   # the frame of 100.3 fills slots 3 and 4
+    assert clock.frames_left() == 1        # the last frame fills its own slot
+    assert clock.nb_written == 6
+
+
+def test_no_frame_left_without_capture():
+    assert LiveClock(25).frames_left() == 0
@@ -0,0 +1,27 @@
+from parallel import ParallelRecorder
+from ASCIIXEL import ASCIIXEL
+import pytest
+import glob
+import os
+
+
+# Renderer whose render processes fail on the first frame
+class FailingASCIIXEL(ASCIIXEL):
+    def draw_frame(self) -> None:
+        raise ValueError('frame can not be drawn')
+
+
+def test_failed_worker_aborts_the_recording(video, fake_ffmpeg, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    app = FailingASCIIXEL(path=video, record=True, nb_workers=2, prefetch=0)
+    assert app.setup()
+    process = app.recorder.process
+
+    with pytest.raises(RuntimeError, match='failed to render'):
+        ParallelRecorder(app, 2).run()
+
+    # ffmpeg was stopped and its partial output removed
+    assert app.recorder.process is None
+    assert process.poll() is not None
+    assert glob.glob(os.path.join(app.output_dir, '*.part*')) == []
+    assert not os.path.exists(app.output_path())
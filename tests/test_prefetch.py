@@ -0,0 +1,107 @@
+from prefetch import FramePrefetcher, running_prefetchers
+from ASCIIXEL import ASCIIXEL
+import numpy as np
+import pytest
+import time
+
+
+# Source of numbered frames, slowed down at random so that the reader and the renderer take turns waiting
+class NumberedFrames:
+    def __init__(self, nb_frame: int =None, seed: int =0, fail_at: int =None) -> None:
+        self.nb_frame = nb_frame
+        self.fail_at = fail_at
+        self.random = np.random.default_rng(seed)
+        self.index = 0
+
+    def read(self) -> tuple:
+        if self.index == self.fail_at:
+            raise OSError('corrupt frame')
+        if self.nb_frame is not None and self.index >= self.nb_frame:
+            return False, None
+        time.sleep(self.random.random()*0.002)
+        frame = np.full((4, 4, 3), self.index % 256, dtype=np.uint8)
+        self.index += 1
+        return True, frame
+
+def prepare(frame: np.ndarray) -> tuple:
+    return frame, int(frame[0, 0, 0])
+
+
+@pytest.mark.parametrize('depth, max_bytes', [(1, 2**20), (3, 2**20), (8, 100)])
+def test_frames_come_out_in_order(depth, max_bytes):
+    prefetcher = FramePrefetcher(NumberedFrames(40).read, prepare, depth, max_bytes)
+    prefetcher.start()
+
+    indices = []
+    while (item := prefetcher.get()) is not None:
+        assert item[0].shape == (4, 4, 3)
+        indices.append(item[1])
+        time.sleep(0.001*(len(indices) % 3))
+    assert indices == list(range(40))
+    assert prefetcher.get() is None
+
+    # The queue stays within its budget, a frame larger than the budget going through alone
+    assert prefetcher.peak_bytes <= max(max_bytes, 48)
+    prefetcher.thread.join(timeout=5)
+    assert not prefetcher.thread.is_alive()
+
+
+def test_stop_ends_a_reader_waiting_for_room():
+    prefetcher = FramePrefetcher(NumberedFrames().read, prepare, depth=2)
+    prefetcher.start()
+    assert [prefetcher.get()[1] for _ in range(5)] == list(range(5))
+
+    # The reader of an endless source fills the queue and waits for room
+    while len(prefetcher.items) < 2:
+        time.sleep(0.001)
+    prefetcher.stop()
+    assert not prefetcher.thread.is_alive()
+    assert prefetcher not in running_prefetchers
+    assert not prefetcher.items and prefetcher.nb_bytes == 0
+
+
+def test_read_error_follows_the_frames_read_before_it():
+    prefetcher = FramePrefetcher(NumberedFrames(fail_at=3).read, prepare)
+    prefetcher.start()
+    assert [prefetcher.get()[1] for _ in range(3)] == [0, 1, 2]
+    with pytest.raises(RuntimeError, match='corrupt frame'):
+        prefetcher.get()
+
+
+# Render the frames of the video, seeking to a frame after the first ones, return their indices and the frames
+def render_with_seek(video: str, prefetch: int, seek_after: int =None, seek_to: int =None) -> tuple:
+    app = ASCIIXEL(path=video, element_size=8, prefetch=prefetch)
+    assert app.setup()
+    indices, frames, threads = [], [], []
+    while True:
+        if len(indices) == seek_after:
+            if app.prefetcher is not None:
+                threads.append(app.prefetcher.thread)
+            app.seek(seek_to)
+            assert app.prefetcher is None
+
+        app.runStep()
+        if app.finish: break
+        indices.append(app.frame_index)
+        frames.append(app.frame_array().copy())
+
+    if app.prefetcher is not None:
+        threads.append(app.prefetcher.thread)
+    app.stop_prefetch()
+    assert bool(threads) == bool(prefetch)
+    assert not any(thread.is_alive() for thread in threads)
+    return indices, frames
+
+
+@pytest.mark.parametrize('seek_after, seek_to', [(None, None), (3, 8), (6, 2)])
+def test_prefetched_rendering_matches_the_serial_one(video, seek_after, seek_to):
+    serial_indices, serial_frames = render_with_seek(video, 0, seek_after, seek_to)
+    indices, frames = render_with_seek(video, 4, seek_after, seek_to)
+
+    expected = list(range(1, 12))
+    if seek_after is not None:
+        expected = expected[:seek_after] + list(range(seek_to, 12))
+    assert indices == serial_indices == expected
+    for frame, serial_frame in zip(frames, serial_frames):
+        np.testing.assert_array_equal(frame, serial_frame)
+
@@ -0,0 +1,96 @@
+from preview import FramePacer, LatestFrame
+from ASCIIXEL import ASCIIXEL
+import preview
+import pytest
+
+
+# Clock of the pacer, only moved by the test and by the sleeps of the pacer
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+        self.sleeps = []
+
+    def perf_counter(self) -> float:
+        return self.now
+
+    def sleep(self, delay: float) -> None:
+        self.sleeps.append(delay)
+        self.now += delay
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr(preview.time, 'perf_counter', clock.perf_counter)
+    monkeypatch.setattr(preview.time, 'sleep', clock.sleep)
+    return clock
+
+
+def test_pacer_waits_for_early_frames_and_drops_late_ones(clock):
+    pacer = FramePacer(10.0)
+
+    # The first frame starts the clock and is shown at once
+    assert pacer.frames_late() == 0
+    pacer.wait()
+    pacer.tick()
+    assert clock.sleeps == []
+
+    # Rendered early, the second frame waits until it is due
+    clock.now = 0.02
+    assert pacer.frames_late() == 0
+    pacer.wait()
+    pacer.tick()
+    assert clock.sleeps == [pytest.approx(0.08)]
+
+    # Rendered late, the frames due before now are dropped and the next one is shown at once
+    clock.now = 0.55
+    late = pacer.frames_late()
+    assert late == 3
+    pacer.skip(late)
+    pacer.wait()
+    pacer.tick()
+    assert len(clock.sleeps) == 1
+    assert (pacer.index, pacer.nb_shown, pacer.nb_skipped) == (6, 3, 3)
+    assert pacer.summary().endswith('/ 10.0 fps, 3 skipped')
+
+
+@pytest.mark.parametrize('fps, paced', [(10.0, False), (0.0, True), (None, True)])
+def test_unpaced_preview_shows_every_frame_at_once(clock, fps, paced):
+    pacer = FramePacer(fps, paced)
+    for frame in range(5):
+        clock.now = frame*0.5
+        assert pacer.frames_late() == 0
+        pacer.wait()
+        pacer.tick()
+    assert clock.sleeps == []
+    assert pacer.achieved_fps() == pytest.approx(2.0)
+
+
+def test_latest_frame_only_keeps_the_newest_frame():
+    latest = LatestFrame()
+    assert latest.take() is None
+
+    # A single notification for the frames published before the GUI takes one
+    assert latest.publish('frame 1')
+    assert not latest.publish('frame 2')
+    assert latest.take() == 'frame 2'
+    assert latest.take() is None
+
+    assert latest.publish('frame 3')
+    assert latest.take() == 'frame 3'
+
+
+@pytest.mark.parametrize('prefetch', [0, 4])
+def test_skipped_frames_are_not_rendered(video, prefetch):
+    app = ASCIIXEL(path=video, element_size=8, prefetch=prefetch)
+    assert app.setup()
+    app.runStep()
+    assert app.frame_index == 1
+
+    assert app.skip_frames(3) == 3
+    app.runStep()
+    assert app.frame_index == 5
+
+    # Skipping past the end finishes the preview
+    assert app.skip_frames(10) == 6
+    assert app.finish
+    app.stop_prefetch()
@@ -0,0 +1,58 @@
+from quantise import PALETTES, Quantiser, nearest_colours
+from utils import QuantiseMode, colour_lut
+import numpy as np
+import pytest
+
+
+WIDTH, HEIGHT = 40, 30
+
+
+def random_image(seed: int =0) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 256, (WIDTH, HEIGHT, 3), dtype=np.uint8)
+
+# Colours of an image, as a set of RGB tuples
+def colour_set(image: np.ndarray) -> set:
+    return set(map(tuple, image.reshape(-1, 3).tolist()))
+
+
+@pytest.mark.parametrize('mode', [QuantiseMode.PALETTE, QuantiseMode.KMEANS, QuantiseMode.MEDIAN_CUT])
+def test_quantised_colours_are_in_the_palette(mode):
+    quantiser = Quantiser(mode, nb_colours=8)
+    for seed in range(3):
+        out = quantiser.apply(random_image(seed))
+        assert colour_set(out) <= colour_set(quantiser.colours)
+    assert len(quantiser.colours) <= (8 if quantiser.adaptive else len(PALETTES['pico8']))
+
+
+@pytest.mark.parametrize('colour_lvl', [2, 4, 8])
+def test_uniform_levels_are_left_to_the_kernels(colour_lvl):
+    quantiser = Quantiser(QuantiseMode.UNIFORM, colour_lvl)
+    image = random_image()
+    assert quantiser.apply(image) is image
+    assert len(np.unique(quantiser.lut[image])) <= colour_lvl
+    np.testing.assert_array_equal(quantiser.lut, colour_lut(colour_lvl))
+
+
+# The table gives the colour nearest to the centre of the bin of a pixel, which is what a direct search gives for the centres
+@pytest.mark.parametrize('palette', ['cga', 'pico8', 'websafe'])
+@pytest.mark.parametrize('bits', [3, 5])
+def test_lut3d_matches_the_direct_nearest_colour_search(palette, bits):
+    quantiser = Quantiser(QuantiseMode.PALETTE, palette=palette, bits=bits)
+    shift = 8-bits
+    image = ((random_image() >> shift) << shift) + ((1 << shift)//2)
+
+    direct = quantiser.colours[nearest_colours(image.reshape(-1, 3), quantiser.colours)].reshape(image.shape)
+    np.testing.assert_array_equal(quantiser.apply(image), direct)
+
+
+def test_adaptive_palette_is_fitted_per_scene():
+    quantiser = Quantiser(QuantiseMode.KMEANS, nb_colours=4)
+    dark = np.full((WIDTH, HEIGHT, 3), 20, dtype=np.uint8)
+    dark[:WIDTH//2] = 60
+    bright = 255-dark
+
+    quantiser.apply(dark)
+    quantiser.apply(dark.copy())
+    assert quantiser.nb_fit == 1
+    assert colour_set(quantiser.apply(bright)) == {(195, 195, 195), (235, 235, 235)}
+    assert quantiser.nb_fit == 2
@@ -0,0 +1,226 @@
+from utils import ASCII_CHARS_TAB, OutputType, RenderEngine
+from ASCIIXEL import ASCIIXEL
+from render import PIXEL_CONTEXT, DeltaRenderer, StripRenderer, compose_pixels, default_font, get_glyph_atlas
+from PIL import Image, ImageDraw
+import numpy as np
+import threading
+import pytest
+
+
+BG = (0, 0, 0)
+
+# Output of 7x5 cells and a few pixels of partial cells on the right and bottom edges
+WIDTH, HEIGHT = 7, 5
+
+def out_shape(size: int) -> tuple:
+    return (HEIGHT*size+size//2, WIDTH*size+size//3, 3)
+
+def random_grids(nb_char: int, seed: int =0) -> tuple:
+    random = np.random.default_rng(seed)
+    char_grid = random.integers(0, nb_char+1, (WIDTH, HEIGHT)).astype(np.uint8)
+    colour_grid = random.integers(0, 256, (WIDTH, HEIGHT, 3)).astype(np.uint8)
+    drawn_grid = random.random((WIDTH, HEIGHT)) < 0.7
+    return char_grid, colour_grid, drawn_grid
+
+
+# Frames drawn one cell at a time as the PIL engine does
+def draw_glyphs(chars: str, size: int, char_grid: np.ndarray, colour_grid: np.ndarray) -> np.ndarray:
+    height, width = out_shape(size)[:2]
+    image = Image.new('RGB', (width, height), BG)
+    draw = ImageDraw.Draw(image)
+    for x in range(WIDTH):
+        for y in range(HEIGHT):
+            if char_grid[x, y] == len(chars): continue
+            draw.text((x*size, y*size), chars[char_grid[x, y]], fill=tuple(colour_grid[x, y].tolist()), font=default_font(), font_size=size)
+    return np.asarray(image)
+
+def draw_rectangles(size: int, colour_grid: np.ndarray, drawn_grid: np.ndarray) -> np.ndarray:
+    height, width = out_shape(size)[:2]
+    image = Image.new('RGB', (width, height), BG)
+    draw = ImageDraw.Draw(image)
+    for x in range(WIDTH):
+        for y in range(HEIGHT):
+            if drawn_grid[x, y]:
+                draw.rectangle([x*size, y*size, x*size+size, y*size+size], fill=tuple(colour_grid[x, y].tolist()))
+    return np.asarray(image)
+
+# Output filled with the background, as the output arrays of ASCIIXEL are
+def blank_out(size: int) -> np.ndarray:
+    out = np.empty(out_shape(size), dtype=np.uint8)
+    out[:] = BG
+    return out
+
+
+# Renderers of the three output types, with the context and the fills of their grids as set up by ASCIIXEL
+def renderer(output_type: str, size: int, chars: str =ASCII_CHARS_TAB[2]) -> tuple:
+    if output_type == 'pixel':
+        return (lambda colour_grid, drawn_grid, out: compose_pixels(colour_grid, drawn_grid, size, BG, out)), PIXEL_CONTEXT, (0, False)
+
+    atlas = get_glyph_atlas(default_font(), chars, size)
+    if output_type == 'ascii':
+        compose = lambda char_grid, out: atlas.compose(char_grid, (255, 255, 255), BG, out)
+        return compose, atlas.context(), (atlas.blank,)
+    compose = lambda char_grid, colour_grid, out: atlas.compose_colour(char_grid, colour_grid, BG, out)
+    return compose, atlas.context(), (atlas.blank, 0)
+
+def output_grids(output_type: str, grids: tuple) -> tuple:
+    char_grid, colour_grid, drawn_grid = grids
+    if output_type == 'pixel': return colour_grid, drawn_grid
+    if output_type == 'ascii': return (char_grid,)
+    return char_grid, colour_grid
+
+
+@pytest.mark.parametrize('size', [6, 12, 16])
+@pytest.mark.parametrize('chars', ASCII_CHARS_TAB)
+def test_atlas_matches_the_glyphs_drawn_one_by_one(size, chars):
+    char_grid, colour_grid, _ = random_grids(len(chars))
+    atlas = get_glyph_atlas(default_font(), chars, size)
+
+    out = blank_out(size)
+    atlas.compose(char_grid, (255, 255, 255), BG, out)
+    white = np.full_like(colour_grid, 255)
+    np.testing.assert_array_equal(out, draw_glyphs(chars, size, char_grid, white))
+
+    out = blank_out(size)
+    atlas.compose_colour(char_grid, colour_grid, BG, out)
+    np.testing.assert_array_equal(out, draw_glyphs(chars, size, char_grid, colour_grid))
+
+
+@pytest.mark.parametrize('size', [1, 3, 8])
+def test_pixel_blocks_match_the_rectangles_drawn_one_by_one(size):
+    _, colour_grid, drawn_grid = random_grids(1)
+    out = blank_out(size)
+    compose_pixels(colour_grid, drawn_grid, size, BG, out)
+    np.testing.assert_array_equal(out, draw_rectangles(size, colour_grid, drawn_grid))
+
+
+@pytest.mark.parametrize('output_type', ['ascii', 'colour', 'pixel'])
+@pytest.mark.parametrize('size', [4, 12])
+@pytest.mark.parametrize('strip_cells', [1, 2, 3, 10])
+def test_strips_match_the_whole_frame(output_type, size, strip_cells):
+    compose, context, fills = renderer(output_type, size)
+    grids = output_grids(output_type, random_grids(len(ASCII_CHARS_TAB[2])))
+
+    whole = blank_out(size)
+    compose(*grids, whole)
+
+    rows = []
+    strips = StripRenderer(out_shape(size), size, context, fills, strip_cells)
+    assert strips.render(grids, compose, lambda strip: rows.append(strip.copy()) or True)
+    np.testing.assert_array_equal(np.concatenate(rows), whole)
+
+
+@pytest.mark.parametrize('output_type', ['ascii', 'colour', 'pixel'])
+@pytest.mark.parametrize('size', [4, 12])
+def test_delta_matches_the_frames_redrawn_in_full(output_type, size):
+    compose, context, fills = renderer(output_type, size)
+    delta = DeltaRenderer(out_shape(size), size, context, fills, tile_size=2)
+    out = blank_out(size)
+
+    # Each frame changes a few cells of the previous one, and then none
+    random = np.random.default_rng(1)
+    grids = random_grids(len(ASCII_CHARS_TAB[2]))
+    for index in range(8):
+        if index and index != 4:
+            changes = random_grids(len(ASCII_CHARS_TAB[2]), seed=index)
+            mask = random.random((WIDTH, HEIGHT)) < 0.15
+            grids = tuple(np.where(mask.reshape(mask.shape+(1,)*(grid.ndim-2)), change, grid) for grid, change in zip(grids, changes))
+
+        frame_grids = output_grids(output_type, grids)
+        delta.render(frame_grids, compose, out, full_redraw_ratio=1.0)
+
+        whole = blank_out(size)
+        compose(*frame_grids, whole)
+        np.testing.assert_array_equal(out, whole)
+
+    # Only the first frame was drawn in full
+    assert delta.nb_full == 1
+
+
+@pytest.mark.parametrize('output_type', list(OutputType))
+@pytest.mark.parametrize('incremental', [False, True])
+def test_numpy_engine_matches_the_pil_engine(video, output_type, incremental):
+    frames = {}
+    for engine in RenderEngine:
+        app = ASCIIXEL(path=video, output_type=output_type, engine=engine, element_size=8, prefetch=0, incremental=incremental, full_redraw_ratio=1.0)
+        assert app.setup()
+        frames[engine] = []
+        while True:
+            app.draw()
+            if app.finish: break
+            frames[engine].append(app.frame_array().copy())
+
+    assert len(frames[RenderEngine.NUMPY]) == 11
+    for numpy_frame, pil_frame in zip(frames[RenderEngine.NUMPY], frames[RenderEngine.PIL]):
+        np.testing.assert_array_equal(numpy_frame, pil_frame)
+
+
+def test_renderers_sharing_an_atlas_compose_on_their_own_canvas():
+    atlas = get_glyph_atlas(default_font(), ASCII_CHARS_TAB[2], 6)
+    assert not atlas.fits
+
+    # Two renderers composing from threads at the same time into outputs of partial cells
+    grids = [random_grids(len(ASCII_CHARS_TAB[2]), seed) for seed in range(2)]
+    expected = []
+    for char_grid, colour_grid, _ in grids:
+        out = blank_out(6)
+        atlas.compose_colour(char_grid, colour_grid, BG, out)
+        expected.append(out)
+
+    failures = []
+    def render(index: int) -> None:
+        char_grid, colour_grid, _ = grids[index]
+        out = blank_out(6)
+        canvas = np.empty((-(-out.shape[0]//6)*6, -(-out.shape[1]//6)*6, 3), dtype=np.uint8)
+        try:
+            for _ in range(200):
+                atlas.compose_colour(char_grid, colour_grid, BG, out, canvas)
+                if not np.array_equal(out, expected[index]):
+                    failures.append(index)
+        except Exception as error:
+            failures.append(error)
+    threads = [threading.Thread(target=render, args=(index,)) for index in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert failures == []
+
+
+# The brighter the cell, the more ink in its glyph, and the reverse for dark glyphs on a light background
+@pytest.mark.parametrize('size', [6, 12])
+@pytest.mark.parametrize('chars', ASCII_CHARS_TAB)
+@pytest.mark.parametrize('reverse', [False, True])
+def test_calibrated_glyphs_follow_the_luma(size, chars, reverse):
+    atlas = get_glyph_atlas(default_font(), chars, size)
+    lut = atlas.char_lut(len(chars)-1, calibrated=True, reverse=reverse)
+    ink = atlas.ink[lut]
+
+    steps = np.diff(ink)
+    assert (steps <= 0).all() if reverse else (steps >= 0).all()
+    assert ink.max() == atlas.ink[:len(chars)].max()
+    assert lut[255 if reverse else 0] == atlas.blank
+
+
+# Uniform cells of rising luma are matched to glyphs of more and more ink, of less and less for dark glyphs
+@pytest.mark.parametrize('size', [6, 12])
+@pytest.mark.parametrize('chars', ASCII_CHARS_TAB)
+@pytest.mark.parametrize('reverse', [False, True])
+def test_shape_matching_follows_the_luma_of_uniform_cells(size, chars, reverse):
+    atlas = get_glyph_atlas(default_font(), chars, size)
+    matcher = atlas.shape_matcher(reverse)
+    block = matcher.block
+
+    luma = np.repeat(np.repeat(np.arange(256, dtype=np.uint8)[None, :], block, axis=1), block, axis=0)
+    indices = matcher.match(luma, np.empty((256, 1), dtype=np.uint8))[:, 0]
+
+    # Ink of the shape of every glyph the matcher can give, the blank being the glyphs without ink
+    shape_ink = -matcher.weights.sum(axis=0)/2
+    ink = {int(index): float(value) for index, value in zip(matcher.indices, shape_ink)}
+    if reverse: ink = {index: block*block-value for index, value in ink.items()}
+    matched = np.array([ink[index] for index in indices.tolist()])
+
+    steps = np.diff(matched)
+    assert (steps <= 1e-4).all() if reverse else (steps >= -1e-4).all()
+    assert indices[255 if reverse else 0] == atlas.blank
+    assert indices[0 if reverse else 255] != atlas.blank
@@ -0,0 +1,126 @@
+from segments import SegmentManifest, SegmentedRecorder, plan_segments
+from utils import RecordBackend
+from ASCIIXEL import ASCIIXEL
+import numpy as np
+import pytest
+import os
+
+
+def test_plan_segments():
+    assert plan_segments(0, 10, 4) == [(0, 4), (4, 8), (8, 10)]
+    assert plan_segments(3, 11, 4) == [(3, 7), (7, 11)]
+    assert plan_segments(0, 3, 10) == [(0, 3)]
+    assert plan_segments(5, 5, 4) == []
+    assert plan_segments(6, 5, 4) == []
+
+
+def test_nb_done_stops_at_the_first_gap(tmp_path):
+    manifest = SegmentManifest(str(tmp_path), 'key')
+    assert manifest.nb_done() == 0
+    for index in (0, 1, 3):
+        manifest.add(index, index*10, 10)
+    assert manifest.nb_done() == 2
+    manifest.add(2, 20, 10)
+    assert manifest.nb_done() == 4
+
+
+def add_segment(manifest: SegmentManifest, index: int) -> None:
+    with open(manifest.segment_path(index), 'wb') as file:
+        file.write(b'segment')
+    manifest.add(index, index*10, 10)
+
+
+def test_load_discards_a_manifest_of_another_key(tmp_path):
+    manifest = SegmentManifest(str(tmp_path), 'key')
+    add_segment(manifest, 0)
+    manifest.complete = True
+    manifest.save()
+
+    assert not SegmentManifest(str(tmp_path), 'other key').load()
+
+    loaded = SegmentManifest(str(tmp_path), 'key')
+    assert loaded.load()
+    assert loaded.complete and loaded.nb_done() == 1
+
+
+def test_load_drops_the_segments_whose_file_is_missing(tmp_path):
+    manifest = SegmentManifest(str(tmp_path), 'key')
+    for index in range(3):
+        add_segment(manifest, index)
+    manifest.complete = True
+    manifest.save()
+    os.remove(manifest.segment_path(1))
+
+    loaded = SegmentManifest(str(tmp_path), 'key')
+    assert loaded.load()
+    assert [segment['index'] for segment in loaded.segments] == [0, 2]
+    assert not loaded.complete
+    assert loaded.nb_done() == 1
+
+
+def frames(first: int, last: int) -> list:
+    return [np.full((4, 6, 3), index, dtype=np.uint8) for index in range(first, last)]
+
+
+def test_recording_resumes_after_the_segments_done(fake_ffmpeg, tmp_path):
+    output = str(tmp_path / 'out.mp4')
+
+    # Segments of 2 frames from frame 3, cancelled in the third segment
+    recorder = SegmentedRecorder(output, 6, 4, 25.0, None, 2, 3, 'key')
+    recorder.start()
+    assert recorder.resume_frame() == 3
+    for frame in frames(3, 8):
+        assert recorder.write(frame)
+    recorder.abort()
+    assert not os.path.exists(output)
+    assert sorted(os.listdir(recorder.manifest.folder)) == ['manifest.json', 'segment_00000.mp4', 'segment_00001.mp4']
+
+    # A recording with another key starts again
+    other = SegmentedRecorder(output, 6, 4, 25.0, None, 2, 3, 'other key')
+    other.start()
+    assert other.resume_frame() == 3
+    other.abort()
+
+    # Segments of the first recording again, cancelled after its second segment
+    recorder = SegmentedRecorder(output, 6, 4, 25.0, None, 2, 3, 'key')
+    recorder.start()
+    for frame in frames(3, 8):
+        assert recorder.write(frame)
+    recorder.abort()
+
+    # The same recording goes on after the two segments done and joins all of them
+    resumed = SegmentedRecorder(output, 6, 4, 25.0, None, 2, 3, 'key')
+    resumed.start()
+    assert resumed.resume_frame() == 7
+    for frame in frames(7, 10):
+        assert resumed.write(frame)
+    assert resumed.close() == 0
+
+    # The fake ffmpeg keeps the raw frames
+    joined = np.fromfile(output, dtype=np.uint8).reshape(-1, 4, 6, 3)
+    assert [int(frame[0, 0, 0]) for frame in joined] == list(range(3, 10))
+    assert not os.path.exists(resumed.manifest.folder)
+
+
+def test_complete_recording_has_nothing_to_resume(fake_ffmpeg, tmp_path):
+    recorder = SegmentedRecorder(str(tmp_path / 'out.mp4'), 6, 4, 25.0, None, 2, 0, 'key')
+    recorder.start()
+    recorder.manifest.complete = True
+    recorder.manifest.save()
+
+    again = SegmentedRecorder(str(tmp_path / 'out.mp4'), 6, 4, 25.0, None, 2, 0, 'key')
+    again.start()
+    assert again.resume_frame() is None
+
+
+# The PNG frames are joined by ffmpeg once recorded, with the audio of the time range only
+@pytest.mark.parametrize('start, audio', [(None, ' -i {video} -map 0 -map 1:a? -crf'), (0.5, ' -ss 0.5 -i {video} -map 0 -map 1:a? -shortest -crf')])
+def test_png_recording_cuts_the_audio_of_a_time_range(video, tmp_path, monkeypatch, start, audio):
+    monkeypatch.chdir(tmp_path)
+    commands = []
+    monkeypatch.setattr(os, 'system', lambda command: commands.append(command) or 0)
+
+    app = ASCIIXEL(path=video, record=True, record_backend=RecordBackend.PNG, element_size=8, prefetch=0, start=start)
+    assert app.run() == 0
+    assert len(commands) == 1
+    assert audio.format(video=video) in commands[0]
@@ -0,0 +1,141 @@
+from service import RenderService, ServiceServer
+import numpy as np
+import service
+import asyncio
+import json
+import cv2
+import os
+
+
+def test_cancelled_image_job_is_not_saved(tmp_path, monkeypatch):
+    path = str(tmp_path / 'image.png')
+    cv2.imwrite(path, np.full((48, 64, 3), 128, dtype=np.uint8))
+    output = str(tmp_path / 'out' / 'image.png')
+
+    monkeypatch.setattr(service, 'worker_cancelled', {3: True})
+    report = service.render_job(3, {'path': path}, output)
+    assert report['status'] == 'cancelled'
+    assert not os.path.exists(output)
+
+    report = service.render_job(4, {'path': path}, output)
+    assert report['status'] == 'done'
+    assert os.path.exists(output)
+
+
+# Answer of the service to a request as (status, body), the connection is closed after each answer
+async def request(port: int, method: str, target: str, body: bytes =None, content_type: str ='application/json') -> tuple:
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    head = f'{method} {target} HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: {content_type}\r\n'
+    if body is not None:
+        head += f'Content-Length: {len(body)}\r\n'
+    writer.write((head+'\r\n').encode('latin-1') + (body or b''))
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+
+    head, _, body = response.partition(b'\r\n\r\n')
+    return int(head.split()[1]), body
+
+async def request_json(port: int, method: str, target: str, value: object =None) -> tuple:
+    status, body = await request(port, method, target, None if value is None else json.dumps(value).encode())
+    return status, json.loads(body)
+
+# Events of a job until it is over
+async def follow(port: int, job: int) -> list:
+    status, body = await request(port, 'GET', f'/jobs/{job}/events')
+    assert status == 200
+    return [json.loads(line) for line in body.splitlines()]
+
+# Run a scenario against a service listening on a free port, in the folder of the test
+def run_service(tmp_path, monkeypatch, scenario, nb_workers: int =1) -> None:
+    monkeypatch.chdir(tmp_path)
+
+    async def main() -> None:
+        render_service = RenderService(nb_workers)
+        await render_service.start()
+        server = await asyncio.start_server(ServiceServer(render_service).handle, '127.0.0.1', 0)
+        try:
+            async with server:
+                await scenario(render_service, server.sockets[0].getsockname()[1])
+        finally:
+            render_service.close()
+
+    asyncio.run(main())
+
+
+def test_jobs_are_rendered_on_the_warm_pool(video, fake_ffmpeg, tmp_path, monkeypatch):
+    async def scenario(render_service: RenderService, port: int) -> None:
+        workers = set(render_service.pool._processes)
+        assert len(workers) == 1
+
+        status, job = await request_json(port, 'POST', '/jobs', {'path': video, 'element_size': 8})
+        assert status == 202 and job['status'] == 'queued'
+
+        # Nothing to serve, and nothing else to render into the same output, until the job is over
+        status, error = await request_json(port, 'GET', f'/jobs/{job["id"]}/result')
+        assert status == 409
+        status, error = await request_json(port, 'POST', '/jobs', {'path': video, 'element_size': 8})
+        assert status == 409
+
+        events = await follow(port, job['id'])
+        assert events[0]['status'] == 'queued' and events[-1]['status'] == 'done'
+
+        status, state = await request_json(port, 'GET', f'/jobs/{job["id"]}')
+        assert status == 200
+        assert state['status'] == 'done' and state['frames'] == 11
+
+        status, result = await request(port, 'GET', f'/jobs/{job["id"]}/result')
+        assert status == 200
+        with open(state['output'], 'rb') as file:
+            assert result == file.read()
+
+        # An uploaded clip, rendered by the same worker, the container is found from the content of the file
+        with open(video, 'rb') as file:
+            status, body = await request(port, 'POST', '/jobs?name=clip.mkv&reverse_colour=true', file.read(), 'video/x-matroska')
+        upload = json.loads(body)
+        assert status == 202
+        assert (await follow(port, upload['id']))[-1]['status'] == 'done'
+        status, result = await request(port, 'GET', f'/jobs/{upload["id"]}/result')
+        assert status == 200 and len(result) == os.path.getsize(upload['output'])
+        assert set(render_service.pool._processes) == workers
+
+        # The output of the first job is newer than its input, it is served without rendering it again
+        status, again = await request_json(port, 'POST', '/jobs', {'path': video, 'element_size': 8})
+        assert status == 202
+        assert (await follow(port, again['id']))[-1]['status'] == 'skipped'
+
+        status, jobs = await request_json(port, 'GET', '/jobs')
+        assert status == 200 and [job['id'] for job in jobs] == [1, 2, 3]
+
+    run_service(tmp_path, monkeypatch, scenario)
+
+
+def test_bad_requests_are_answered_with_their_error(video, fake_ffmpeg, tmp_path, monkeypatch):
+    async def scenario(render_service: RenderService, port: int) -> None:
+        for job, status in [
+            ({'path': video, 'colour': 3}, 400),
+            ({'path': video, 'output_type': 'SPIRAL'}, 400),
+            ({'path': video, 'element_size': 'large'}, 400),
+            ({'element_size': 8}, 400),
+            ({'path': str(tmp_path / 'missing.avi')}, 404)
+        ]:
+            answer, error = await request_json(port, 'POST', '/jobs', job)
+            assert answer == status, job
+            assert error['error']
+
+        assert (await request(port, 'POST', '/jobs', b'{"path": '))[0] == 400
+        assert (await request(port, 'POST', '/jobs', b'[]'))[0] == 400
+        assert (await request(port, 'POST', '/jobs'))[0] == 411
+        assert (await request(port, 'POST', '/jobs?name=clip.txt', b'text', 'text/plain'))[0] == 400
+        assert (await request(port, 'POST', '/jobs?name=clip.mkv&colour=3', b'video', 'video/x-matroska'))[0] == 400
+        assert (await request(port, 'PUT', '/jobs', b''))[0] == 405
+        assert (await request(port, 'GET', '/jobs/7'))[0] == 404
+        assert (await request(port, 'GET', '/frames'))[0] == 404
+        assert (await request(port, 'GET', 'nonsense'))[0] == 404
+
+        # Nothing was queued, and the uploads refused left nothing behind
+        status, jobs = await request_json(port, 'GET', '/jobs')
+        assert status == 200 and jobs == []
+        assert not os.path.exists('uploads') or not os.listdir('uploads')
+
+    run_service(tmp_path, monkeypatch, scenario)
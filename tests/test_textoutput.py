@@ -0,0 +1,99 @@
+from textoutput import ESC, FLAG_DELTA, FLAG_RLE, AnsiEncoder, FrameSequenceReader, FrameSequenceRecorder
+from utils import OutputType
+import numpy as np
+import pytest
+
+
+CHARS = ' .:-=+*#%@'
+WIDTH, HEIGHT = 13, 7
+
+
+# Frames as (width, height) grids: random, unchanged, fully changed, then with only their colours changed
+# and with runs of equal cells, the colours taken from the palette
+def frame_grids(colours: np.ndarray, seed: int =0) -> list:
+    random = np.random.default_rng(seed)
+    nb_char, nb_colour = len(CHARS)+1, len(colours)
+
+    chars = random.integers(0, nb_char, (WIDTH, HEIGHT))
+    indices = random.integers(0, nb_colour, (WIDTH, HEIGHT))
+    grids = [(chars, indices), (chars.copy(), indices.copy())]
+
+    chars = (chars+1) % nb_char
+    indices = (indices+1) % nb_colour
+    grids.append((chars, indices))
+    grids.append((chars.copy(), random.integers(0, nb_colour, (WIDTH, HEIGHT))))
+
+    runs = np.repeat(random.integers(0, nb_char, (WIDTH, 1)), HEIGHT, axis=1)
+    grids.append((runs, np.zeros((WIDTH, HEIGHT), dtype=np.int64)))
+    return [(chars.astype(np.uint8), colours[indices]) for chars, indices in grids]
+
+# Colours of colour_lvl levels per channel, as left by the uniform quantisation
+def uniform_colours(colour_lvl: int) -> np.ndarray:
+    values = (np.arange(colour_lvl)*255//(colour_lvl-1)).astype(np.uint8)
+    return np.stack(np.meshgrid(values, values, values, indexing='ij'), axis=-1).reshape(-1, 3)
+
+
+@pytest.mark.parametrize('output_type', list(OutputType))
+@pytest.mark.parametrize('flags', [0, FLAG_RLE, FLAG_DELTA, FLAG_RLE | FLAG_DELTA])
+@pytest.mark.parametrize('palette', [None, 'fixed'])
+def test_frame_sequence_round_trip(tmp_path, output_type, flags, palette):
+    colours = uniform_colours(4) if palette is None else np.random.default_rng(1).integers(0, 256, (300, 3), dtype=np.uint8)
+    colours = np.unique(colours, axis=0)
+    grids = frame_grids(colours)
+
+    path = str(tmp_path / 'frames.axl')
+    recorder = FrameSequenceRecorder(path, WIDTH, HEIGHT, 25.0, CHARS, output_type, 4, None if palette is None else colours, flags, keyframe_interval=3)
+    recorder.start()
+    for char_grid, colour_grid in grids:
+        assert recorder.write(char_grid, colour_grid)
+    assert recorder.close() == 0
+
+    reader = FrameSequenceReader(path)
+    assert (reader.width, reader.height, reader.fps, reader.chars, reader.output_type) == (WIDTH, HEIGHT, 25.0, CHARS, output_type)
+
+    frames = list(reader.frames())
+    assert len(frames) == len(grids)
+    for (char_rows, colour_rows), (char_grid, colour_grid) in zip(frames, grids):
+        if output_type == OutputType.PIXEL_ART:
+            assert char_rows is None
+        else:
+            np.testing.assert_array_equal(char_rows, char_grid.T)
+        if output_type == OutputType.ASCII:
+            assert colour_rows is None
+        else:
+            np.testing.assert_array_equal(colour_rows, colour_grid.transpose(1, 0, 2))
+
+
+# Sequence starting the first frame: cursor hidden, attributes reset and screen cleared
+CLEAR = f'{ESC}?25l{ESC}0m{ESC}2J'
+
+
+def test_ansi_plain_ascii_keeps_the_default_foreground():
+    encoder = AnsiEncoder(CHARS, OutputType.ASCII)
+    assert encoder.encode(np.array([[1, 9, 10]]), None) == f'{CLEAR}{ESC}1;1H{ESC}39m.@ '
+
+
+@pytest.mark.parametrize('truecolour, red', [(True, '38;2;255;0;0'), (False, '38;5;196')])
+def test_ansi_colour_ascii_sets_the_foreground(truecolour, red):
+    encoder = AnsiEncoder(CHARS, OutputType.ASCII_COLOUR, truecolour)
+    # The blank character and the black cells keep the default foreground
+    colours = np.array([[[255, 0, 0], [0, 255, 0], [0, 0, 0]]], dtype=np.uint8)
+    assert encoder.encode(np.array([[1, 10, 2]]), colours) == f'{CLEAR}{ESC}1;1H{ESC}{red}m.{ESC}39m :'
+
+
+@pytest.mark.parametrize('truecolour, blue', [(True, '48;2;0;0;255'), (False, '48;5;21')])
+def test_ansi_pixel_art_sets_the_background(truecolour, blue):
+    encoder = AnsiEncoder(CHARS, OutputType.PIXEL_ART, truecolour)
+    colours = np.array([[[0, 0, 255], [0, 0, 0]]], dtype=np.uint8)
+    assert encoder.encode(None, colours) == f'{CLEAR}{ESC}1;1H{ESC}{blue}m {ESC}49m '
+
+
+def test_ansi_only_redraws_the_changed_cells():
+    encoder = AnsiEncoder(CHARS, OutputType.ASCII)
+    char_rows = np.ones((2, 8), dtype=np.uint8)
+    encoder.encode(char_rows, None)
+    assert encoder.encode(char_rows.copy(), None) == ''
+
+    char_rows = char_rows.copy()
+    char_rows[1, 6] = 9
+    assert encoder.encode(char_rows, None) == f'{ESC}2;7H{ESC}39m@'
@@ -0,0 +1,57 @@
+from utils import accelerate_preprocessing
+from ASCIIXEL import ASCIIXEL
+import numpy as np
+import pytest
+import cv2
+
+
+def random_cells(width: int, height: int, seed: int =0) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+def preprocessed(preprocessing, cells: np.ndarray) -> tuple:
+    height, width = cells.shape[:2]
+    image = np.empty((width, height, 3), dtype=np.uint8)
+    grayscale = np.empty((width, height), dtype=np.uint8)
+    preprocessing(cells, image, grayscale)
+    return image, grayscale
+
+
+@pytest.mark.parametrize('preprocessing', [accelerate_preprocessing, accelerate_preprocessing.fallback])
+def test_preprocessing_transposes_to_rgb_with_the_bt601_luma(preprocessing):
+    cells = random_cells(37, 23)
+    image, grayscale = preprocessed(preprocessing, cells)
+
+    rgb = cells.transpose(1, 0, 2)[..., ::-1]
+    np.testing.assert_array_equal(image, rgb)
+
+    # Rounded to nearest, the 14-bit weights being off by less than 0.02 over the whole range
+    luma = rgb.astype(np.float64) @ np.array([0.299, 0.587, 0.114])
+    assert np.abs(grayscale-luma).max() < 0.51
+
+    # Red weighs more than blue, the BGR order of the cells is not mistaken for RGB
+    primaries = np.array([[[0, 0, 255], [0, 255, 0], [255, 0, 0], [255, 255, 255]]], dtype=np.uint8)
+    assert preprocessed(preprocessing, primaries)[1][:, 0].tolist() == [76, 150, 29, 255]
+
+
+def test_compiled_preprocessing_matches_the_numpy_one():
+    cells = random_cells(64, 48, seed=1)
+    for compiled, fallback in zip(preprocessed(accelerate_preprocessing, cells), preprocessed(accelerate_preprocessing.fallback, cells)):
+        np.testing.assert_array_equal(compiled, fallback)
+
+
+# The frame is averaged straight into the cells, whatever the output resolution
+@pytest.mark.parametrize('resolution', [None, (48, 40)])
+@pytest.mark.parametrize('display_original', [False, True])
+def test_frames_are_resampled_once_into_the_cells(resolution, display_original):
+    app = ASCIIXEL(element_size=8, resolution=resolution, display_original=display_original, prefetch=0)
+    app.setup_render(resolution or (96, 72))
+    frame = random_cells(96, 72, seed=2)
+
+    kept, image, grayscale = app.preprocess(frame, app.cell_buffers)
+    assert kept is (frame if display_original else None)
+    assert image is app.cell_buffers[1] and grayscale is app.cell_buffers[2]
+
+    cells = cv2.resize(frame, (app.WIDTH, app.HEIGHT), interpolation=cv2.INTER_AREA)
+    expected_image, expected_grayscale = preprocessed(accelerate_preprocessing.fallback, cells)
+    np.testing.assert_array_equal(image, expected_image)
+    np.testing.assert_array_equal(grayscale, expected_grayscale)
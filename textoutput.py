@@ -0,0 +1,468 @@
+from utils import OutputType, RecordBackend
+import numpy as np
+import argparse
+import struct
+import time
+import sys
+import os
+
+
+##### Cell Encoding #####
+
+# Characters written for the blank cells, and for the drawn cells of the pixel art in plain text
+BLANK_CHAR = ' '
+PIXEL_CHAR = '#'
+
+# Code points of a set of characters, with the blank character at the blank index
+def char_codes(chars: str) -> np.ndarray:
+    return np.array([ord(char) for char in chars + BLANK_CHAR], dtype=np.uint32)
+
+# Text of a (height, width) grid of code points, one line per row
+def grid_text(codes: np.ndarray) -> str:
+    height, width = codes.shape
+    lines = np.empty((height, width+1), dtype='<u4')
+    lines[:, :width] = codes
+    lines[:, width] = ord('\n')
+    return lines.tobytes().decode('utf-32-le')
+
+# Smallest unsigned type holding nb_values indices, keeping its largest value free to mark unchanged cells
+def index_dtype(nb_values: int) -> np.dtype:
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if nb_values < np.iinfo(dtype).max:
+            return np.dtype(dtype).newbyteorder('<')
+    raise ValueError(f'Too many values to index: {nb_values}')
+
+# Levels of the colour cube of the xterm 256 colours, and the nearest level of every channel value
+XTERM_LEVELS = np.array([0, 95, 135, 175, 215, 255])
+XTERM_LUT = np.abs(np.arange(256)[:, None] - XTERM_LEVELS[None, :]).argmin(axis=1)
+
+# Index of the nearest xterm 256 colour of every colour of a (..., 3) grid
+def xterm_colours(colours: np.ndarray) -> np.ndarray:
+    levels = XTERM_LUT[colours]
+    return 16 + 36*levels[..., 0] + 6*levels[..., 1] + levels[..., 2]
+
+# Colours left by the quantisation, in the order of their index: the colour_lvl levels per channel,
+# or the colours of a fixed palette when they are given
+class ColourPalette:
+    def __init__(self, colour_lvl: int, colours: np.ndarray =None) -> None:
+        self.colour_lvl = colour_lvl
+
+        if colours is not None:
+            # Colours sorted by their packed RGB value, found back by a binary search
+            packed = self.pack(colours)
+            order = np.argsort(packed)
+            self.colours = colours[order]
+            self.packed = packed[order]
+        else:
+            # Quantised value of each level, as computed by colour_lut, and level of each quantised value
+            levels = np.arange(colour_lvl)
+            values = (levels*255//(colour_lvl-1)).astype(np.uint8)
+            self.level_lut = np.rint(np.arange(256)*(colour_lvl-1)/255).astype(np.int64)
+
+            cube = np.stack(np.meshgrid(levels, levels, levels, indexing='ij'), axis=-1).reshape(-1, 3)
+            self.colours = values[cube]
+            self.packed = None
+        self.dtype = index_dtype(len(self.colours))
+
+    @staticmethod
+    def pack(colours: np.ndarray) -> np.ndarray:
+        colours = colours.astype(np.int64)
+        return (colours[..., 0] << 16) | (colours[..., 1] << 8) | colours[..., 2]
+
+    # Palette index of every colour of a (..., 3) grid of quantised colours
+    def indices(self, colour_grid: np.ndarray) -> np.ndarray:
+        if self.packed is not None:
+            return np.searchsorted(self.packed, self.pack(colour_grid)).astype(self.dtype)
+
+        levels = self.level_lut[colour_grid]
+        return ((levels[..., 0]*self.colour_lvl + levels[..., 1])*self.colour_lvl + levels[..., 2]).astype(self.dtype)
+
+
+##### Grid Recorders #####
+
+# Record the grids of cells of every frame into a file, with the same interface as FFmpegRecorder
+# The grids are given as filled by the accelerate_conversion_*_grid kernels: (width, height) character indices
+# and (width, height, 3) quantised colours, None when the output type does not use them
+class GridRecorder:
+    mode = 'w'
+
+    def __init__(self, output_path: str) -> None:
+        self.output_path = output_path
+
+        # Written under a temporary name, renamed once the recording is finished
+        self.part_path = f'{output_path}.part'
+        self.file = None
+        self.returncode = None
+        self.nb_frame = 0
+
+    def start(self) -> None:
+        if self.mode == 'wb':
+            self.file = open(self.part_path, 'wb')
+        else:
+            self.file = open(self.part_path, 'w', encoding='utf-8', newline='')
+        self.returncode = None
+        self.nb_frame = 0
+        self.write_header()
+
+    def write_header(self) -> None:
+        pass
+
+    def write_footer(self) -> None:
+        pass
+
+    def encode(self, char_grid: np.ndarray, colour_grid: np.ndarray):
+        raise NotImplementedError
+
+    def write(self, char_grid: np.ndarray, colour_grid: np.ndarray) -> bool:
+        if self.file is None: return False
+
+        self.file.write(self.encode(char_grid, colour_grid))
+        self.nb_frame += 1
+        return True
+
+    def close(self) -> int:
+        if self.file is None: return self.returncode
+
+        self.write_footer()
+        self.file.close()
+        self.file = None
+        os.replace(self.part_path, self.output_path)
+        self.returncode = 0
+        return self.returncode
+
+    # Stop without finishing the file and remove the partial output
+    def abort(self) -> int:
+        if self.file is None: return self.returncode
+
+        self.file.close()
+        self.file = None
+        self.returncode = 0
+        if os.path.exists(self.part_path):
+            os.remove(self.part_path)
+        return self.returncode
+
+    def error_message(self) -> str:
+        return ''
+
+# Plain text, one line per row of cells, the frames separated by a form feed line
+class TextRecorder(GridRecorder):
+    def __init__(self, output_path: str, chars: str, output_type: OutputType) -> None:
+        super().__init__(output_path)
+        self.output_type = output_type
+        self.codes = char_codes(chars)
+        self.pixel_codes = np.array([ord(BLANK_CHAR), ord(PIXEL_CHAR)], dtype=np.uint32)
+
+    def encode(self, char_grid: np.ndarray, colour_grid: np.ndarray) -> str:
+        if self.output_type == OutputType.PIXEL_ART:
+            codes = self.pixel_codes[colour_grid.any(axis=2).T.astype(np.intp)]
+        else:
+            codes = self.codes[char_grid.T]
+
+        separator = '\f\n' if self.nb_frame else ''
+        return separator + grid_text(codes)
+
+# Terminal escape stream, only the cells that changed since the previous frame are redrawn
+class AnsiRecorder(GridRecorder):
+    def __init__(self, output_path: str, chars: str, output_type: OutputType, truecolour: bool =True) -> None:
+        super().__init__(output_path)
+        self.encoder = AnsiEncoder(chars, output_type, truecolour)
+
+    def write_header(self) -> None:
+        self.encoder.reset()
+
+    def encode(self, char_grid: np.ndarray, colour_grid: np.ndarray) -> str:
+        char_rows = None if char_grid is None else char_grid.T
+        colour_rows = None if colour_grid is None else colour_grid.transpose(1, 0, 2)
+        return self.encoder.encode(char_rows, colour_rows)
+
+    def write_footer(self) -> None:
+        self.file.write(self.encoder.footer())
+
+# Open the recorder of a grid backend
+# The palette is given when the colours are not quantised to colour_lvl levels
+def grid_recorder(backend: RecordBackend, output_path: str, width: int, height: int, fps: float, chars: str, output_type: OutputType, colour_lvl: int, palette: np.ndarray =None) -> GridRecorder:
+    if backend == RecordBackend.TEXT:
+        return TextRecorder(output_path, chars, output_type)
+    if backend == RecordBackend.ANSI_256:
+        return AnsiRecorder(output_path, chars, output_type, truecolour=False)
+    if backend == RecordBackend.ANSI_TRUECOLOUR:
+        return AnsiRecorder(output_path, chars, output_type, truecolour=True)
+    if backend == RecordBackend.FRAMES:
+        return FrameSequenceRecorder(output_path, width, height, fps, chars, output_type, colour_lvl, palette)
+    raise ValueError(f'{backend.name} does not record grids')
+
+
+##### ANSI Escape Streams #####
+
+ESC = '\x1b['
+
+# Cursor movements closer than this are replaced by rewriting the unchanged cells in between
+MAX_REWRITE = 4
+
+# Encode frames given as (height, width) grids into escape sequences redrawing the cells that changed
+# Colour ASCII sets the foreground of the characters, pixel art sets the background of spaces
+class AnsiEncoder:
+    def __init__(self, chars: str, output_type: OutputType, truecolour: bool =True) -> None:
+        self.output_type = output_type
+        self.truecolour = truecolour
+        self.codes = char_codes(chars)
+        self.layer = 48 if output_type == OutputType.PIXEL_ART else 38
+        self.sgr_cache = {}
+        self.reset()
+
+    def reset(self) -> None:
+        self.previous_chars = None
+        self.previous_keys = None
+
+    # Key of the colour of every cell, -1 for the default colour
+    def colour_keys(self, colour_rows: np.ndarray) -> np.ndarray:
+        if self.truecolour:
+            colours = colour_rows.astype(np.int64)
+            keys = (colours[..., 0] << 16) | (colours[..., 1] << 8) | colours[..., 2]
+        else:
+            keys = xterm_colours(colour_rows).astype(np.int64)
+        keys[~colour_rows.any(axis=2)] = -1
+        return keys
+
+    # Select Graphic Rendition sequence of a colour key
+    def sgr(self, key: int) -> str:
+        if key not in self.sgr_cache:
+            if key < 0:
+                self.sgr_cache[key] = f'{ESC}{self.layer+1}m'
+            elif self.truecolour:
+                self.sgr_cache[key] = f'{ESC}{self.layer};2;{key >> 16};{(key >> 8) & 255};{key & 255}m'
+            else:
+                self.sgr_cache[key] = f'{ESC}{self.layer};5;{key}m'
+        return self.sgr_cache[key]
+
+    def encode(self, char_rows: np.ndarray, colour_rows: np.ndarray) -> str:
+        if self.output_type == OutputType.PIXEL_ART:
+            chars = np.full(colour_rows.shape[:2], ord(BLANK_CHAR), dtype=np.uint32)
+        else:
+            chars = self.codes[char_rows]
+
+        # The plain ASCII keeps the default foreground of the terminal
+        if self.output_type == OutputType.ASCII:
+            keys = np.full(chars.shape, -1, dtype=np.int64)
+        else:
+            keys = self.colour_keys(colour_rows)
+            # The colour of a blank character does not show
+            if self.output_type == OutputType.ASCII_COLOUR:
+                keys[char_rows == len(self.codes)-1] = -1
+
+        parts = []
+        if self.previous_chars is None or self.previous_chars.shape != chars.shape:
+            parts.append(f'{ESC}?25l{ESC}0m{ESC}2J')
+            changed = np.ones(chars.shape, dtype=bool)
+        else:
+            changed = (chars != self.previous_chars) | (keys != self.previous_keys)
+
+        current_key = None
+        for y in np.flatnonzero(changed.any(axis=1)):
+            # Runs of changed cells, merged when the gap between them is short
+            columns = np.flatnonzero(changed[y])
+            breaks = np.flatnonzero(np.diff(columns) > MAX_REWRITE)
+            starts = np.concatenate(([columns[0]], columns[breaks+1]))
+            ends = np.concatenate((columns[breaks], [columns[-1]])) + 1
+
+            row_chars = chars[y].tolist()
+            row_keys = keys[y].tolist()
+            for x0, x1 in zip(starts.tolist(), ends.tolist()):
+                parts.append(f'{ESC}{y+1};{x0+1}H')
+                for x in range(x0, x1):
+                    if row_keys[x] != current_key:
+                        current_key = row_keys[x]
+                        parts.append(self.sgr(current_key))
+                    parts.append(chr(row_chars[x]))
+
+        self.previous_chars = chars
+        self.previous_keys = keys
+        return ''.join(parts)
+
+    # Restore the terminal after the last frame
+    def footer(self) -> str:
+        height = 0 if self.previous_chars is None else self.previous_chars.shape[0]
+        return f'{ESC}0m{ESC}{height+1};1H{ESC}?25h'
+
+
+##### Frame Sequence Format #####
+
+# Header: magic, version, output type, flags, width and height in cells, fps, key frame interval,
+# then the characters (UTF-8, blank excluded) and the RGB palette, each after its length
+MAGIC = b'AXLF'
+VERSION = 1
+HEADER = struct.Struct('<4sBBBxHHfH')
+
+# Flags of the compression of the planes
+FLAG_RLE = 1
+FLAG_DELTA = 2
+
+# Kinds of frames and encodings of the planes
+KEY_FRAME = 0
+DELTA_FRAME = 1
+RAW_PLANE = 0
+RLE_PLANE = 1
+PLANE = struct.Struct('<BI')
+
+# Run-length encoding of a flat array: the uint32 length of every run, then the value of every run
+def rle_encode(values: np.ndarray) -> bytes:
+    if not len(values): return b''
+    starts = np.flatnonzero(np.concatenate(([True], values[1:] != values[:-1])))
+    counts = np.diff(np.append(starts, len(values))).astype('<u4')
+    return counts.tobytes() + values[starts].tobytes()
+
+def rle_decode(payload: bytes, dtype: np.dtype) -> np.ndarray:
+    nb_runs = len(payload)//(4+dtype.itemsize)
+    counts = np.frombuffer(payload, dtype='<u4', count=nb_runs)
+    values = np.frombuffer(payload, dtype=dtype, offset=4*nb_runs)
+    return np.repeat(values, counts)
+
+# Compact binary sequence of the character and palette indices of every frame
+# Planes are stored row by row, delta frames mark the unchanged cells with the largest value of the plane type
+class FrameSequenceRecorder(GridRecorder):
+    mode = 'wb'
+
+    def __init__(self, output_path: str, width: int, height: int, fps: float, chars: str, output_type: OutputType, colour_lvl: int, palette: np.ndarray =None, flags: int =FLAG_RLE | FLAG_DELTA, keyframe_interval: int =300) -> None:
+        super().__init__(output_path)
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.chars = chars
+        self.output_type = output_type
+        self.flags = flags
+        self.keyframe_interval = keyframe_interval
+
+        self.palette = ColourPalette(colour_lvl, palette) if output_type != OutputType.ASCII else None
+        self.char_dtype = index_dtype(len(chars)+1)
+        self.previous = None
+
+    def write_header(self) -> None:
+        self.previous = None
+        chars = self.chars.encode('utf-8')
+        colours = self.palette.colours if self.palette is not None else np.zeros((0, 3), dtype=np.uint8)
+
+        self.file.write(HEADER.pack(MAGIC, VERSION, self.output_type.value, self.flags, self.width, self.height, self.fps, self.keyframe_interval))
+        self.file.write(struct.pack('<H', len(chars)) + chars)
+        self.file.write(struct.pack('<I', len(colours)) + colours.tobytes())
+
+    # Flat planes of a frame, characters first
+    def planes(self, char_grid: np.ndarray, colour_grid: np.ndarray) -> list:
+        planes = []
+        if self.output_type != OutputType.PIXEL_ART:
+            planes.append(char_grid.T.astype(self.char_dtype).ravel())
+        if self.palette is not None:
+            planes.append(self.palette.indices(colour_grid.transpose(1, 0, 2)).ravel())
+        return planes
+
+    def encode(self, char_grid: np.ndarray, colour_grid: np.ndarray) -> bytes:
+        planes = self.planes(char_grid, colour_grid)
+
+        kind = KEY_FRAME
+        if self.flags & FLAG_DELTA and self.previous is not None and self.nb_frame % self.keyframe_interval:
+            kind = DELTA_FRAME
+
+        parts = [struct.pack('<B', kind)]
+        for plane, previous in zip(planes, self.previous or [None]*len(planes)):
+            values = plane
+            if kind == DELTA_FRAME:
+                values = np.where(plane == previous, np.iinfo(plane.dtype).max, plane).astype(plane.dtype)
+
+            encoding, payload = RAW_PLANE, values.tobytes()
+            if self.flags & FLAG_RLE:
+                rle = rle_encode(values)
+                if len(rle) < len(payload):
+                    encoding, payload = RLE_PLANE, rle
+            parts.append(PLANE.pack(encoding, len(payload)) + payload)
+
+        self.previous = planes
+        return b''.join(parts)
+
+# Read the frames of a frame sequence back into grids of cells
+class FrameSequenceReader:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, 'rb') as file:
+            magic, version, output_type, self.flags, self.width, self.height, self.fps, self.keyframe_interval = HEADER.unpack(file.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f'{path} is not an ASCIIXEL frame sequence')
+            if version != VERSION:
+                raise ValueError(f'Unsupported frame sequence version {version}')
+            self.output_type = OutputType(output_type)
+
+            nb_bytes, = struct.unpack('<H', file.read(2))
+            self.chars = file.read(nb_bytes).decode('utf-8')
+            nb_colours, = struct.unpack('<I', file.read(4))
+            self.palette = np.frombuffer(file.read(3*nb_colours), dtype=np.uint8).reshape(nb_colours, 3)
+            self.data_offset = file.tell()
+
+        self.dtypes = []
+        if self.output_type != OutputType.PIXEL_ART:
+            self.dtypes.append(index_dtype(len(self.chars)+1))
+        if self.output_type != OutputType.ASCII:
+            self.dtypes.append(index_dtype(len(self.palette)))
+
+    # Yield the (height, width) character indices and (height, width, 3) colours of every frame, None when not stored
+    def frames(self):
+        previous = None
+        with open(self.path, 'rb') as file:
+            file.seek(self.data_offset)
+            while True:
+                kind = file.read(1)
+                if not kind: break
+
+                planes = []
+                for index, dtype in enumerate(self.dtypes):
+                    encoding, nb_bytes = PLANE.unpack(file.read(PLANE.size))
+                    payload = file.read(nb_bytes)
+                    values = rle_decode(payload, dtype) if encoding == RLE_PLANE else np.frombuffer(payload, dtype=dtype)
+
+                    if kind[0] == DELTA_FRAME:
+                        values = np.where(values == np.iinfo(dtype).max, previous[index], values)
+                    planes.append(values)
+                previous = planes
+
+                char_rows = planes[0].reshape(self.height, self.width) if self.output_type != OutputType.PIXEL_ART else None
+                colour_rows = self.palette[planes[-1]].reshape(self.height, self.width, 3) if self.output_type != OutputType.ASCII else None
+                yield char_rows, colour_rows
+
+
+##### Player #####
+
+# Play a frame sequence in the terminal at its frame rate
+def play(path: str, truecolour: bool =True, fps: float =None, output=sys.stdout) -> int:
+    reader = FrameSequenceReader(path)
+    encoder = AnsiEncoder(reader.chars, reader.output_type, truecolour)
+    frame_time = 1/(fps or reader.fps or 30)
+
+    nb_frame = 0
+    next_frame = time.perf_counter()
+    try:
+        for char_rows, colour_rows in reader.frames():
+            output.write(encoder.encode(char_rows, colour_rows))
+            output.flush()
+            nb_frame += 1
+
+            next_frame += frame_time
+            delay = next_frame - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        output.write(encoder.footer())
+        output.flush()
+    return nb_frame
+
+def main(argv: list =None) -> int:
+    parser = argparse.ArgumentParser(description='Play an ASCIIXEL frame sequence (.axl) in the terminal.')
+    parser.add_argument('path', help='frame sequence recorded with the FRAMES backend')
+    parser.add_argument('--fps', type=float, help='frame rate, the recorded one by default')
+    parser.add_argument('--256', dest='truecolour', action='store_false', help='use the 256 colours of xterm instead of truecolour')
+    args = parser.parse_args(argv)
+
+    play(args.path, args.truecolour, args.fps)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
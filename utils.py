@@ -1,8 +1,11 @@
-from numba import njit
+from PIL import Image
 from enum import Enum
 import numpy as np
+import threading
+import functools
 import shutil
 import os
+import cv2
 
 
 ##### Data Util #####
@@ -19,53 +22,290 @@ class OutputType(Enum):
     ASCII_COLOUR = 1
     PIXEL_ART = 2
 
+# Rendering engines
+# PIL draws every cell with ImageDraw (reference)
+# NUMPY composites whole frames from pre-rendered arrays
+class RenderEngine(Enum):
+    PIL = 0
+    NUMPY = 1
+
+# Recording backends
+# PNG saves every frame in frames/ and encodes them at the end
+# PIPE streams the frames into a running ffmpeg process
+# TEXT writes the characters of every frame in a text file
+# ANSI_256 and ANSI_TRUECOLOUR write a terminal escape stream redrawing only the changed cells
+# FRAMES writes the character and palette indices in a compact binary sequence, played by textoutput.py
+class RecordBackend(Enum):
+    PNG = 0
+    PIPE = 1
+    TEXT = 2
+    ANSI_256 = 3
+    ANSI_TRUECOLOUR = 4
+    FRAMES = 5
+
+# Colour quantisation modes
+# UNIFORM rounds every channel to colour_lvl levels
+# PALETTE replaces every colour by the nearest colour of a named palette
+# KMEANS and MEDIAN_CUT fit a palette of nb_colours colours on the first frame of every scene
+class QuantiseMode(Enum):
+    UNIFORM = 0
+    PALETTE = 1
+    KMEANS = 2
+    MEDIAN_CUT = 3
+
+# Backends writing the grids of cells instead of the rendered frames
+GRID_BACKENDS = (RecordBackend.TEXT, RecordBackend.ANSI_256, RecordBackend.ANSI_TRUECOLOUR, RecordBackend.FRAMES)
+
+# Extention of the output of each recording backend
+RECORD_EXTENTIONS = {
+    RecordBackend.PNG: '.mp4',
+    RecordBackend.PIPE: '.mp4',
+    RecordBackend.TEXT: '.txt',
+    RecordBackend.ANSI_256: '.ans256',
+    RecordBackend.ANSI_TRUECOLOUR: '.ans24',
+    RecordBackend.FRAMES: '.axl'
+}
+
 # Supported extentions
 EXTENTIONS = ['.mp4', '.mov', '.mkv']
+IMAGE_EXTENTIONS = ['.png', '.jpg', '.jpeg', '.webp', '.bmp']
+
+
+##### Kernel Compilation #####
+
+# Set ASCIIXEL_NO_NUMBA=1 to run the NumPy versions of the kernels
+USE_NUMBA = os.environ.get('ASCIIXEL_NO_NUMBA', '') in ('', '0')
+
+# Conversion kernel compiled by numba on its first call, so that importing utils does not import numba
+# The listed signatures are compiled together and cached on disk, next launches only load them
+# The NumPy version given with @kernel.numpy is used when numba is not available
+class Kernel:
+    def __init__(self, function, signatures: list) -> None:
+        functools.update_wrapper(self, function)
+        self.function = function
+        self.signatures = signatures
+        self.fallback = function
+        self.compiled = None
+        self.lock = threading.Lock()
+
+    def numpy(self, fallback):
+        self.fallback = fallback
+        return fallback
+
+    # Compile (or load from the cache) the kernel, return the function to call
+    def load(self):
+        with self.lock:
+            if self.compiled is None:
+                self.compiled = self.compile()
+        return self.compiled
+
+    def compile(self):
+        if not USE_NUMBA: return self.fallback
+        try:
+            from numba import njit
+        except ImportError:
+            return self.fallback
+
+        dispatcher = njit(fastmath=True, cache=True)(self.function)
+        for signature in self.signatures:
+            dispatcher.compile(signature)
+        return dispatcher
+
+    def __call__(self, *args):
+        return (self.compiled or self.load())(*args)
+
+def kernel(*signatures: str):
+    return lambda function: Kernel(function, list(signatures))
+
+# Compile or load all the kernels, in a background thread so that it happens off the critical path
+def warm_up_kernels(background: bool =True) -> threading.Thread:
+    kernels = [value for value in globals().values() if isinstance(value, Kernel) and value.compiled is None]
+    if not kernels: return None
+    if not background:
+        for kernel in kernels:
+            kernel.load()
+        return None
+
+    thread = threading.Thread(target=lambda: [kernel.load() for kernel in kernels], name='kernel-warm-up', daemon=True)
+    thread.start()
+    return thread
+
+# Check if the kernels run compiled by numba
+def kernels_compiled() -> bool:
+    return USE_NUMBA and accelerate_conversion_ascii.load() is not accelerate_conversion_ascii.fallback
 
 
 ##### Image Conversion Functions #####
 
-# Conversion of an image into classic ASCII
-@njit(fastmath=True)
-def accelerate_conversion_ascii(image: np.ndarray, width: int, height: int, ascii_coeff: float, skip_index: int) -> list:
+# Conversion of an image into classic ASCII, the glyph of each cell is read from a table indexed by its luma
+@kernel('(uint8[:, ::1], int64, int64, uint8[::1], int64)')
+def accelerate_conversion_ascii(image: np.ndarray, width: int, height: int, char_lut: np.ndarray, blank: int) -> list:
     array_of_values = []
     for x in range(width):
         for y in range(height):
-            char_index = int(image[x,y] * ascii_coeff)
-            if char_index != skip_index:
-                array_of_values.append((char_index, (x,y)))
+            char_index = char_lut[image[x,y]]
+            if char_index != blank:
+                array_of_values.append((int(char_index), (x,y)))
     return array_of_values
 
-# Conversion of an image into colour ASCII
-@njit(fastmath=True)
-def accelerate_conversion_ascii_colour(image: np.ndarray, gray_image: np.ndarray, width: int, height: int, ascii_coeff: float, colour_lvl: float, skip_index: int) -> list:
+@accelerate_conversion_ascii.numpy
+def accelerate_conversion_ascii_numpy(image: np.ndarray, width: int, height: int, char_lut: np.ndarray, blank: int) -> list:
+    char_index = char_lut[image[:width, :height]]
+    xs, ys = np.nonzero(char_index != blank)
+    return [(index, (x, y)) for index, x, y in zip(char_index[xs, ys].tolist(), xs.tolist(), ys.tolist())]
+
+# Conversion of an image into colour ASCII, the colours are quantised through a lookup table per channel
+@kernel('(uint8[:, :, ::1], uint8[:, ::1], int64, int64, uint8[::1], uint8[::1], int64)')
+def accelerate_conversion_ascii_colour(image: np.ndarray, gray_image: np.ndarray, width: int, height: int, char_lut: np.ndarray, colour_lut: np.ndarray, blank: int) -> list:
     array_of_values = []
     for x in range(width):
         for y in range(height):
-            char_index = int(gray_image[x,y] * ascii_coeff)
-            if char_index != skip_index:
-                r, g, b = ((image[x,y] * (colour_lvl-1))/255)
-                r = round(r) * 255//(colour_lvl-1)
-                g = round(g) * 255//(colour_lvl-1)
-                b = round(b) * 255//(colour_lvl-1)
-                if r+g+b:
-                    array_of_values.append((char_index, (r, g, b), (x,y)))
+            char_index = char_lut[gray_image[x,y]]
+            if char_index != blank:
+                r = colour_lut[image[x,y,0]]
+                g = colour_lut[image[x,y,1]]
+                b = colour_lut[image[x,y,2]]
+                if r or g or b:
+                    array_of_values.append((int(char_index), (int(r), int(g), int(b)), (x,y)))
     return array_of_values
 
-# Conversion of an image into pixel art with colour
-@njit(fastmath=True)
-def accelerate_conversion_pixel(image: np.ndarray, width: int, height: int, colour_lvl: float) -> list:
+@accelerate_conversion_ascii_colour.numpy
+def accelerate_conversion_ascii_colour_numpy(image: np.ndarray, gray_image: np.ndarray, width: int, height: int, char_lut: np.ndarray, colour_lut: np.ndarray, blank: int) -> list:
+    colours = colour_lut[image[:width, :height]]
+    char_index = char_lut[gray_image[:width, :height]]
+    xs, ys = np.nonzero((char_index != blank) & colours.any(axis=2))
+    return [(index, tuple(colour), (x, y)) for index, colour, x, y in zip(char_index[xs, ys].tolist(), colours[xs, ys].tolist(), xs.tolist(), ys.tolist())]
+
+# Conversion of an image into pixel art with colour, the colours are quantised through a lookup table per channel
+@kernel('(uint8[:, :, ::1], int64, int64, uint8[::1])')
+def accelerate_conversion_pixel(image: np.ndarray, width: int, height: int, colour_lut: np.ndarray) -> list:
     array_of_values = []
     for x in range(0, width):
         for y in range(0, height):
-            r, g, b = ((image[x,y] * (colour_lvl-1))/255)
-            r = round(r) * 255//(colour_lvl-1)
-            g = round(g) * 255//(colour_lvl-1)
-            b = round(b) * 255//(colour_lvl-1)
-            if r+g+b:
-                array_of_values.append(((r, g, b), (x,y)))
+            r = colour_lut[image[x,y,0]]
+            g = colour_lut[image[x,y,1]]
+            b = colour_lut[image[x,y,2]]
+            if r or g or b:
+                array_of_values.append(((int(r), int(g), int(b)), (x,y)))
     return array_of_values
 
+@accelerate_conversion_pixel.numpy
+def accelerate_conversion_pixel_numpy(image: np.ndarray, width: int, height: int, colour_lut: np.ndarray) -> list:
+    colours = colour_lut[image[:width, :height]]
+    xs, ys = np.nonzero(colours.any(axis=2))
+    return [(tuple(colour), (x, y)) for colour, x, y in zip(colours[xs, ys].tolist(), xs.tolist(), ys.tolist())]
+
+# Conversion of an image into a grid of ASCII character indices, a single lookup per cell
+@kernel('(uint8[:, ::1], uint8[::1], uint8[:, ::1])')
+def accelerate_conversion_ascii_grid(image: np.ndarray, char_lut: np.ndarray, char_grid: np.ndarray) -> np.ndarray:
+    width, height = char_grid.shape
+    for x in range(width):
+        for y in range(height):
+            char_grid[x,y] = char_lut[image[x,y]]
+    return char_grid
+
+@accelerate_conversion_ascii_grid.numpy
+def accelerate_conversion_ascii_grid_numpy(image: np.ndarray, char_lut: np.ndarray, char_grid: np.ndarray) -> np.ndarray:
+    np.take(char_lut, image, out=char_grid)
+    return char_grid
+
+# Conversion of an image into grids of ASCII character indices and quantised colours, blank for the black cells
+@kernel('(uint8[:, :, ::1], uint8[:, ::1], uint8[::1], uint8[::1], int64, uint8[:, ::1], uint8[:, :, ::1])')
+def accelerate_conversion_ascii_colour_grid(image: np.ndarray, gray_image: np.ndarray, char_lut: np.ndarray, colour_lut: np.ndarray, blank: int, char_grid: np.ndarray, colour_grid: np.ndarray) -> np.ndarray:
+    width, height = char_grid.shape
+    for x in range(width):
+        for y in range(height):
+            r = colour_lut[image[x,y,0]]
+            g = colour_lut[image[x,y,1]]
+            b = colour_lut[image[x,y,2]]
+            colour_grid[x,y,0] = r
+            colour_grid[x,y,1] = g
+            colour_grid[x,y,2] = b
+
+            if r or g or b:
+                char_grid[x,y] = char_lut[gray_image[x,y]]
+            else:
+                char_grid[x,y] = blank
+    return char_grid
+
+@accelerate_conversion_ascii_colour_grid.numpy
+def accelerate_conversion_ascii_colour_grid_numpy(image: np.ndarray, gray_image: np.ndarray, char_lut: np.ndarray, colour_lut: np.ndarray, blank: int, char_grid: np.ndarray, colour_grid: np.ndarray) -> np.ndarray:
+    np.take(colour_lut, image, out=colour_grid)
+    np.take(char_lut, gray_image, out=char_grid)
+    char_grid[~colour_grid.any(axis=2)] = blank
+    return char_grid
+
+# Conversion of an image into a grid of quantised colours and the mask of the cells to draw
+@kernel('(uint8[:, :, ::1], uint8[::1], uint8[:, :, ::1], boolean[:, ::1])')
+def accelerate_conversion_pixel_grid(image: np.ndarray, colour_lut: np.ndarray, colour_grid: np.ndarray, drawn_grid: np.ndarray) -> np.ndarray:
+    width, height = drawn_grid.shape
+    for x in range(width):
+        for y in range(height):
+            r = colour_lut[image[x,y,0]]
+            g = colour_lut[image[x,y,1]]
+            b = colour_lut[image[x,y,2]]
+            colour_grid[x,y,0] = r
+            colour_grid[x,y,1] = g
+            colour_grid[x,y,2] = b
+            drawn_grid[x,y] = r or g or b
+    return colour_grid
+
+@accelerate_conversion_pixel_grid.numpy
+def accelerate_conversion_pixel_grid_numpy(image: np.ndarray, colour_lut: np.ndarray, colour_grid: np.ndarray, drawn_grid: np.ndarray) -> np.ndarray:
+    np.take(colour_lut, image, out=colour_grid)
+    np.any(colour_grid, axis=2, out=drawn_grid)
+    return colour_grid
+
+# Replacement of every colour by the nearest colour of a palette, looked up in a table indexed by the high bits of the channels
+# The (2**(3*bits), 3) table is computed once per palette, so the cost does not depend on the size of the palette
+@kernel('(uint8[:, :, ::1], uint8[:, ::1], int64, uint8[:, :, ::1])')
+def accelerate_quantisation_lut3d(image: np.ndarray, lut: np.ndarray, bits: int, out: np.ndarray) -> np.ndarray:
+    width, height = out.shape[0], out.shape[1]
+    shift = 8-bits
+    for x in range(width):
+        for y in range(height):
+            index = ((image[x,y,0] >> shift) << (2*bits)) | ((image[x,y,1] >> shift) << bits) | (image[x,y,2] >> shift)
+            out[x,y,0] = lut[index,0]
+            out[x,y,1] = lut[index,1]
+            out[x,y,2] = lut[index,2]
+    return out
+
+@accelerate_quantisation_lut3d.numpy
+def accelerate_quantisation_lut3d_numpy(image: np.ndarray, lut: np.ndarray, bits: int, out: np.ndarray) -> np.ndarray:
+    channels = (image >> (8-bits)).astype(np.intp)
+    index = (channels[..., 0] << (2*bits)) | (channels[..., 1] << bits) | channels[..., 2]
+    np.take(lut, index, axis=0, out=out)
+    return out
+
+# Transposition of a BGR grid of cells into the (width, height) RGB cells and their luma, in a single pass
+# The luma uses the ITU-R BT.601 weights (0.299, 0.587, 0.114) in 14-bit fixed point, rounded to nearest
+@kernel('(uint8[:, :, ::1], uint8[:, :, ::1], uint8[:, ::1])')
+def accelerate_preprocessing(cells: np.ndarray, image: np.ndarray, grayscale: np.ndarray) -> np.ndarray:
+    height, width = grayscale.shape[1], grayscale.shape[0]
+    for y in range(height):
+        for x in range(width):
+            b = np.int32(cells[y,x,0])
+            g = np.int32(cells[y,x,1])
+            r = np.int32(cells[y,x,2])
+            image[x,y,0] = r
+            image[x,y,1] = g
+            image[x,y,2] = b
+            grayscale[x,y] = (r*4899 + g*9617 + b*1868 + 8192) >> 14
+    return image
+
+@accelerate_preprocessing.numpy
+def accelerate_preprocessing_numpy(cells: np.ndarray, image: np.ndarray, grayscale: np.ndarray) -> np.ndarray:
+    rgb = cells.transpose(1, 0, 2)[..., ::-1]
+    image[:] = rgb
+    weighted = rgb[..., 0]*np.int32(4899) + rgb[..., 1]*np.int32(9617) + rgb[..., 2]*np.int32(1868) + 8192
+    grayscale[:] = weighted >> 14
+    return image
+
+# Lookup table of the quantised value of every channel value, same rounding as the kernels
+def colour_lut(colour_lvl: int) -> np.ndarray:
+    values = np.arange(256, dtype=np.int64)
+    return ((np.rint(values * (colour_lvl-1) / 255).astype(np.int64) * 255) // (colour_lvl-1)).astype(np.uint8)
+
 
 ##### Folder Managment Functions #####
 
@@ -76,9 +316,66 @@ def createFolder() -> None:
     
     os.mkdir('frames')
 
-    if not os.path.exists('outputs'):
-        os.mkdir('outputs')
+    createOutputFolder()
+
+def createOutputFolder(folder: str ='outputs') -> None:
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+# The audio starts at audio_start seconds and stops with the frames when only a time range was rendered
+def createVideo(videopath: str, audiopath: str, fps: int, width: int, height: int, audio_start: float =None) -> int:
+    audio_input, audio_output = f'-i {audiopath}', ''
+    if audio_start is not None:
+        audio_input, audio_output = f'-ss {audio_start} -i {audiopath}', ' -shortest'
+    status = os.system(f'ffmpeg -r {str(fps)} -f image2 -s {width}x{height} -i frames/{videopath}_%05d.png {audio_input} -map 0 -map 1:a?{audio_output} -crf 25 -vcodec libx264 -pix_fmt yuv420p outputs/{videopath}.mp4')
+    shutil.rmtree('frames', ignore_errors=True)
+    return status
+
+
+##### Image Files #####
+
+def is_image(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() in IMAGE_EXTENTIONS
+
+# Decode a still image as a BGR array like the video frames, None if it can not be read
+# PIL reads what OpenCV can not, such as the formats left out of its build or the paths it can not open
+def read_image(path: str) -> np.ndarray:
+    frame = cv2.imread(path, cv2.IMREAD_COLOR)
+    if frame is not None: return frame
+
+    try:
+        with Image.open(path) as image:
+            return np.ascontiguousarray(np.asarray(image.convert('RGB'))[..., ::-1])
+    except OSError:
+        return None
+
+# Still image read like a video of a single frame, with the methods of cv2.VideoCapture used on the videos
+class StillCapture:
+    def __init__(self, path: str) -> None:
+        self.image = read_image(path)
+        self.position = 0
+
+    def read(self) -> tuple:
+        if self.image is None or self.position > 0: return False, None
+        self.position += 1
+        return True, self.image.copy()
+
+    def grab(self) -> bool:
+        ret = self.image is not None and self.position == 0
+        self.position += 1
+        return ret
+
+    def set(self, prop: int, value: float) -> bool:
+        if prop != cv2.CAP_PROP_POS_FRAMES: return False
+        self.position = int(value)
+        return True
+
+    # A still has no frame rate, the previews show it at once
+    def get(self, prop: int) -> float:
+        if prop == cv2.CAP_PROP_FRAME_COUNT: return 1.0 if self.image is not None else 0.0
+        if prop == cv2.CAP_PROP_FRAME_WIDTH: return float(self.image.shape[1]) if self.image is not None else 0.0
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT: return float(self.image.shape[0]) if self.image is not None else 0.0
+        return 0.0
 
-def createVideo(videopath: str, audiopath: str, fps: int, width: int, height: int) -> None:
-    os.system(f'ffmpeg -r {str(fps)} -f image2 -s {width}x{height} -i frames/{videopath}_%05d.png -i {audiopath} -map 0 -map 1:a -crf 25 -vcodec libx264 -pix_fmt yuv420p outputs/{videopath}.mp4')
-    shutil.rmtree('frames', ignore_errors=True)
\ No newline at end of file
+    def release(self) -> None:
+        self.image = None